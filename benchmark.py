@@ -0,0 +1,1638 @@
+"""
+Flux Kontext 本地性能基准
+不调用API，只测量客户端处理开销
+
+使用方法:
+python benchmark.py preprocess                      # 使用合成图片
+python benchmark.py preprocess --inputs a.jpg b.png # 使用自己的图片
+python benchmark.py encoding                        # 对比不同上传编码策略，并检查直通判断
+python benchmark.py parallel --workers 4            # 串行与进程池并行预处理
+python benchmark.py downscale                       # 常规缩放与快速缩放 (耗时和峰值内存)
+python benchmark.py download                        # 整体解码保存与流式下载 (耗时和峰值内存)
+python benchmark.py polling                         # 不同任务耗时分布下各轮询策略的完成检测延迟和轮询次数
+python benchmark.py ratelimit --rate 4              # 本地限流API模拟突发负载，对比有无客户端限流
+python benchmark.py isolation --tenants 16          # 多个密钥的编辑器并发运行，检查请求是否串用密钥
+python benchmark.py routing                         # 检查每个模型的请求是否发送到注册表中的地址
+python benchmark.py hedging --jobs 300              # 长尾延迟的模拟API上对比有无对冲提交的 p50/p95/p99
+python benchmark.py pool                            # 保持连接与每次新建连接的连接数，检查连接池统计与服务端一致
+python benchmark.py async --jobs 200                # 异步编辑器大量提交时检查同时进行的任务数不超过并发上限
+python benchmark.py batch                           # 清单批量任务的结果文件、并发数和失败任务续跑
+python benchmark.py resume                          # 提交后强制终止进程，再从任务库收取结果
+python benchmark.py metrics                         # 指标更新和追踪区间的单次开销，以及每个任务的总开销
+python benchmark.py progress                        # 原进度回调 (每次休眠并重建日志HTML) 与增量进度通道的每个任务开销
+python benchmark.py preview                         # 网页上传预览：原图直接显示与缓存缩略图的页面重新运行耗时 (需要 streamlit)
+"""
+
+import argparse
+import asyncio
+import base64
+import contextlib
+import functools
+import html
+import http.server
+import io
+import json
+import logging
+import math
+import multiprocessing
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image
+
+from flux_kontext_async import AsyncFluxKontextEditor
+from flux_kontext_background import ProgressChannel, ProgressView
+from flux_kontext_balancer import ApiConfig
+from flux_kontext_batch import load_completed, load_manifest, run_batch
+from flux_kontext_hedging import HedgePolicy
+from flux_kontext_jobs import JobStore, resume_jobs
+from flux_kontext_metrics import EditorMetrics, start_metrics_server
+from flux_kontext_models import MODEL_REGISTRY
+from flux_kontext_multi_native import (
+    MAX_INPUT_SIZE,
+    EncodingPolicy,
+    FluxKontextNativeMultiEditor,
+    PooledTransport,
+    format_input_report,
+    make_thumbnail,
+    preprocess_image,
+    preprocess_images,
+    stream_download,
+)
+from flux_kontext_polling import (
+    POLL_STRATEGIES,
+    LinearBackoffPolling,
+    simulate_detection_lag,
+)
+from flux_kontext_ratelimit import RateLimiter
+from flux_kontext_tracing import NULL_TRACER, LatencyAggregator, Tracer
+
+SAMPLE_IMAGES = [
+    ("photo_1600.jpg", (1600, 1200), "RGB", "JPEG"),
+    ("photo_2048.jpg", (2048, 1536), "RGB", "JPEG"),
+    ("photo_4032.jpg", (4032, 3024), "RGB", "JPEG"),
+    ("screenshot_rgba.png", (1920, 1080), "RGBA", "PNG"),
+]
+
+# 手机相机常见的大尺寸照片
+LARGE_SAMPLE_IMAGES = [
+    (f"camera_{i}.jpg", (6000, 4000), "RGB", "JPEG") for i in range(1, 5)
+]
+
+# 无需缩放的RGB输入，检查直通判断是否遵循上传策略
+PASSTHROUGH_SAMPLE_IMAGES = [
+    ("photo_1500.png", (1500, 1000), "RGB", "PNG"),
+    ("photo_1600.jpg", (1600, 1200), "RGB", "JPEG"),
+]
+
+# 12MP 照片，网页一次上传的数量
+PREVIEW_SAMPLE_IMAGES = [
+    (f"upload_{i}.jpg", (4032, 3024), "RGB", "JPEG") for i in range(1, 5)
+]
+
+
+def create_sample_images(directory, samples=SAMPLE_IMAGES):
+    """生成覆盖常见情况的合成测试图片"""
+    paths = []
+    for name, size, mode, fmt in samples:
+        path = os.path.join(directory, name)
+        # 使用噪声叠加渐变，避免纯色图片让编码器表现失真
+        image = Image.effect_noise(size, 40).convert(mode)
+        gradient = Image.linear_gradient("L").resize(size).convert(mode)
+        Image.blend(image, gradient, 0.5).save(path, format=fmt, quality=90)
+        paths.append(path)
+    return paths
+
+
+def legacy_preprocess(path, max_size=MAX_INPUT_SIZE):
+    """旧版处理路径: 完整解码 -> RGB -> LANCZOS缩放 -> PNG编码"""
+    image = Image.open(path)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+    if max(image.size) > max_size:
+        ratio = max_size / max(image.size)
+        new_size = (int(image.width * ratio), int(image.height * ratio))
+        image = image.resize(new_size, Image.Resampling.LANCZOS)
+    buffered = io.BytesIO()
+    image.save(buffered, format="PNG")
+    return base64.b64encode(buffered.getvalue()).decode("utf-8")
+
+
+def measure(func, *args, repeat=3, **kwargs):
+    """返回 (最小CPU时间, 最小墙钟时间, 结果)"""
+    best_cpu = best_wall = float("inf")
+    result = None
+    for _ in range(repeat):
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        result = func(*args, **kwargs)
+        best_cpu = min(best_cpu, time.process_time() - cpu_start)
+        best_wall = min(best_wall, time.perf_counter() - wall_start)
+    return best_cpu, best_wall, result
+
+
+def bench_preprocess(paths, repeat):
+    """对比旧版路径和当前预处理路径的CPU时间与请求体大小"""
+    print(f"{'图片':<24}{'路径':<10}{'CPU(ms)':>10}{'墙钟(ms)':>10}{'base64(KB)':>12}")
+    for path in paths:
+        name = os.path.basename(path)
+        cpu, wall, encoded = measure(legacy_preprocess, path, repeat=repeat)
+        print(
+            f"{name:<24}{'legacy':<10}{cpu * 1000:>10.1f}{wall * 1000:>10.1f}"
+            f"{len(encoded) / 1024:>12.1f}"
+        )
+        cpu, wall, (encoded, info) = measure(preprocess_image, path, repeat=repeat)
+        label = "pass" if info["passthrough"] else "current"
+        print(
+            f"{'':<24}{label:<10}{cpu * 1000:>10.1f}{wall * 1000:>10.1f}"
+            f"{len(encoded) / 1024:>12.1f}"
+        )
+
+
+ENCODING_POLICIES = {
+    "png (默认)": EncodingPolicy(),
+    "png level=1": EncodingPolicy(compress_level=1),
+    "jpeg q=90": EncodingPolicy(format="jpeg", quality=90),
+    "webp q=90": EncodingPolicy(format="webp", quality=90),
+    "jpeg ≤500KB": EncodingPolicy(format="jpeg", quality=95, max_bytes=500_000),
+}
+
+
+def bench_encoding(paths):
+    """对比不同上传编码策略的请求体大小和编码耗时 (关闭直通以测量编码本身)"""
+    for label, policy in ENCODING_POLICIES.items():
+        policy.passthrough = False
+        report = [preprocess_image(path, policy)[1] for path in paths]
+        total = sum(info["base64_chars"] for info in report) / 1024
+        print(f"\n== {label}: 请求体图片部分共 {total:.1f} KB")
+        print(format_input_report(report))
+
+
+# (策略名称, 策略, 各源格式是否应当直通)
+PASSTHROUGH_CASES = [
+    ("png (默认)", EncodingPolicy(), {"PNG": True, "JPEG": True}),
+    ("jpeg", EncodingPolicy(format="jpeg"), {"PNG": False, "JPEG": True}),
+    (
+        "jpeg q=80",
+        EncodingPolicy(format="jpeg", quality=80),
+        {"PNG": False, "JPEG": False},
+    ),
+    ("webp", EncodingPolicy(format="webp"), {"PNG": False, "JPEG": False}),
+]
+
+
+def bench_passthrough(paths):
+    """
+    检查开启直通时各上传策略对 PNG/JPEG 输入的处理：只有源格式符合策略时才发送原始字节，
+    PNG 输入在有损策略下必须重新编码
+
+    返回:
+        全部符合预期时返回True
+    """
+    ok = True
+    print(f"\n{'策略':<14}{'输入':<18}{'直通':<6}{'上传格式':<10}{'大小(KB)':>10}")
+    for label, policy, expected in PASSTHROUGH_CASES:
+        for path in paths:
+            _, info = preprocess_image(path, policy)
+            source_format = info["source_format"]
+            matches = info["passthrough"] == expected[source_format]
+            ok = ok and matches
+            print(
+                f"{label:<14}{os.path.basename(path):<18}"
+                f"{'是' if info['passthrough'] else '否':<6}{info['format']:<10}"
+                f"{info['bytes'] / 1024:>10.1f}"
+                + ("" if matches else "  ❌ 不符合预期")
+            )
+    print("✅ 直通判断符合上传策略" if ok else "❌ 直通判断与上传策略不一致")
+    return ok
+
+
+def bench_parallel(paths, workers, repeat):
+    """对比串行和进程池并行预处理多张大图的墙钟时间"""
+    policy = EncodingPolicy()
+    _, serial, _ = measure(preprocess_images, paths, policy, repeat=repeat)
+    print(f"串行:            {serial * 1000:>8.0f} ms")
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # 预热进程池，避免把进程启动时间计入结果
+        list(executor.map(abs, range(workers)))
+        _, parallel, _ = measure(
+            preprocess_images, paths, policy, executor=executor, repeat=repeat
+        )
+    print(f"进程池 ({workers} 进程): {parallel * 1000:>8.0f} ms")
+    print(f"加速比:          {serial / parallel:>8.2f}x")
+
+
+def _peak_rss_kb():
+    """
+    返回当前进程的峰值常驻内存 (KB)
+
+    优先读取 /proc/self/status 的 VmHWM：ru_maxrss 会继承 fork 前父进程的峰值，
+    在子进程中无法反映自身的内存占用
+    """
+    try:
+        with open("/proc/self/status", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _downscale_child(path, fast_resize, upload_format, queue):
+    """在独立子进程中运行一次预处理，报告耗时和峰值内存增量"""
+    baseline = _peak_rss_kb()
+    started = time.perf_counter()
+    preprocess_image(
+        path, EncodingPolicy(format=upload_format), fast_resize=fast_resize
+    )
+    elapsed = time.perf_counter() - started
+    queue.put((elapsed, (_peak_rss_kb() - baseline) / 1024))
+
+
+def bench_downscale(paths, upload_format):
+    """对比常规完整解码缩放与草稿解码快速缩放的墙钟时间和峰值内存"""
+    context = multiprocessing.get_context("spawn")
+    print(f"{'图片':<18}{'模式':<8}{'耗时(ms)':>10}{'峰值内存(MB)':>14}")
+    for path in paths:
+        name = os.path.basename(path)
+        for label, fast_resize in (("常规", False), ("快速", True)):
+            queue = context.Queue()
+            process = context.Process(
+                target=_downscale_child, args=(path, fast_resize, upload_format, queue)
+            )
+            process.start()
+            elapsed, peak_mb = queue.get()
+            process.join()
+            print(f"{name:<18}{label:<8}{elapsed * 1000:>10.0f}{peak_mb:>14.1f}")
+            name = ""
+
+
+def legacy_download(transport, url, destination, output_format):
+    """旧版下载路径: 整体读入内存 -> PIL解码 -> 重新编码保存"""
+    response = transport.get(url, timeout=30)
+    response.raise_for_status()
+    image = Image.open(io.BytesIO(response.content))
+    image.save(destination, format=output_format.upper())
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    """不输出访问日志的静态文件服务"""
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _download_child(mode, url, destination, output_format, queue):
+    """在独立子进程中下载一次结果，报告耗时和峰值内存增量"""
+    transport = PooledTransport()
+    baseline = _peak_rss_kb()
+    started = time.perf_counter()
+    if mode == "stream":
+        stream_download(transport, url, destination, output_format)
+    else:
+        legacy_download(transport, url, destination, output_format)
+    elapsed = time.perf_counter() - started
+    queue.put((elapsed, (_peak_rss_kb() - baseline) / 1024))
+    transport.close()
+
+
+def bench_download(paths, tmp_dir):
+    """在本地HTTP服务上对比旧版整体解码保存与流式下载的耗时和峰值内存"""
+    directory = os.path.dirname(paths[0])
+    handler = functools.partial(_QuietHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    context = multiprocessing.get_context("spawn")
+    print(f"{'图片':<22}{'路径':<10}{'耗时(ms)':>10}{'峰值内存(MB)':>14}")
+    try:
+        for path in paths:
+            name = os.path.basename(path)
+            output_format = "png" if name.endswith(".png") else "jpeg"
+            url = f"{base_url}/{name}"
+            for mode in ("legacy", "stream"):
+                destination = os.path.join(tmp_dir, f"out_{mode}_{name}")
+                queue = context.Queue()
+                process = context.Process(
+                    target=_download_child,
+                    args=(mode, url, destination, output_format, queue),
+                )
+                process.start()
+                elapsed, peak_mb = queue.get()
+                process.join()
+                print(f"{name:<22}{mode:<10}{elapsed * 1000:>10.0f}{peak_mb:>14.1f}")
+                name = ""
+    finally:
+        server.shutdown()
+
+
+# 模拟的任务耗时分布 (秒)
+POLLING_DISTRIBUTIONS = {
+    "稳定 (8±1秒)": lambda rng: max(rng.gauss(8, 1), 1.0),
+    "长尾 (对数正态，中位10秒)": lambda rng: rng.lognormvariate(math.log(10), 0.5),
+    "双峰 (6秒/25秒)": lambda rng: (
+        rng.gauss(6, 1) if rng.random() < 0.6 else rng.gauss(25, 3)
+    ),
+    "慢任务 (45±10秒)": lambda rng: max(rng.gauss(45, 10), 5.0),
+}
+
+
+def bench_polling(jobs, seed):
+    """
+    在模拟的任务耗时分布上比较各轮询策略：完成后多久才被发现 (检测延迟) 和每个任务的轮询次数
+
+    每个分布使用新的策略实例，依次处理 jobs 个任务，ETA 策略从模型先验开始边运行边学习
+    """
+    context = ("flux-kontext-pro", 1)
+    print(f"每个分布 {jobs} 个任务，上下文 {context}\n")
+    print(
+        f"{'分布':<24} {'策略':<12} {'平均延迟':>9} {'p95延迟':>9} "
+        f"{'最大延迟':>9} {'平均轮询':>8}"
+    )
+    for name, sample in POLLING_DISTRIBUTIONS.items():
+        rng = random.Random(seed)
+        durations = [sample(rng) for _ in range(jobs)]
+        for strategy_name, strategy_class in POLL_STRATEGIES.items():
+            # 指数退避的抖动使用全局随机数
+            random.seed(seed)
+            stats = simulate_detection_lag(strategy_class(), durations, context)
+            print(
+                f"{name:<24} {strategy_name:<12} {stats['mean_lag']:>8.2f}s "
+                f"{stats['p95_lag']:>8.2f}s {stats['max_lag']:>8.2f}s "
+                f"{stats['mean_polls']:>8.1f}"
+            )
+        print()
+
+
+class _JsonApiHandler(http.server.BaseHTTPRequestHandler):
+    """模拟API的公共部分：keep-alive、JSON响应，state 由子类绑定"""
+
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, code, body, content_type="application/json", headers=None):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        if self.close_connection:
+            # 与真实服务一样确认客户端的 Connection: close，客户端据此不再复用该连接
+            self.send_header("Connection", "close")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def _sample_jpeg():
+    buffered = io.BytesIO()
+    Image.new("RGB", (64, 64), (120, 80, 40)).save(buffered, format="JPEG")
+    return buffered.getvalue()
+
+
+def _start_api_server(handler_class, state):
+    """在后台线程启动模拟API，返回 (server, base_url)"""
+    handler = type("Handler", (handler_class,), {"state": state})
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+class _ThrottledApiHandler(_JsonApiHandler):
+    """
+    模拟带服务端限流的API：提交按令牌桶限速，超出时返回429和 Retry-After；
+    任务在提交 ready_after 秒后完成
+    """
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        state = self.state
+        with state["lock"]:
+            now = time.monotonic()
+            state["tokens"] = min(
+                state["rate"],
+                state["tokens"] + (now - state["updated"]) * state["rate"],
+            )
+            state["updated"] = now
+            if state["tokens"] < 1:
+                state["rejected_submits"] += 1
+                throttled = True
+            else:
+                state["tokens"] -= 1
+                task_id = len(state["accepted"])
+                state["accepted"].append(now)
+                throttled = False
+
+        if throttled:
+            self._send(
+                429, {"detail": "Too Many Requests"}, headers={"Retry-After": "1"}
+            )
+            return
+        host = self.headers["Host"]
+        self._send(
+            200,
+            {
+                "id": f"task{task_id:06d}",
+                "polling_url": f"http://{host}/poll?id={task_id}",
+            },
+        )
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        state = self.state
+        if url.path == "/poll":
+            task_id = int(parse_qs(url.query)["id"][0])
+            with state["lock"]:
+                state["polls"] += 1
+                submitted = state["accepted"][task_id]
+            if time.monotonic() - submitted < state["ready_after"]:
+                self._send(200, {"status": "Pending"})
+                return
+            host = self.headers["Host"]
+            self._send(
+                200,
+                {"status": "Ready", "result": {"sample": f"http://{host}/sample.jpg"}},
+            )
+        elif url.path == "/sample.jpg":
+            self._send(200, state["sample"], "image/jpeg")
+        else:
+            self._send(404, {})
+
+
+def _run_load(tmp_dir, config, jobs, editors, threads, server_rate, ready_after):
+    """启动模拟API，用多个编辑器实例并发提交任务，返回 (服务端状态, 结果, 耗时, 限流器统计)"""
+    state = {
+        "lock": threading.Lock(),
+        "rate": server_rate,
+        "tokens": float(server_rate),
+        "updated": time.monotonic(),
+        "accepted": [],
+        "rejected_submits": 0,
+        "polls": 0,
+        "ready_after": ready_after,
+        "sample": _sample_jpeg(),
+    }
+    server, base_url = _start_api_server(_ThrottledApiHandler, state)
+
+    config_path = os.path.join(tmp_dir, "ratelimit_config.ini")
+    with open(config_path, "w", encoding="utf-8") as f:
+        f.write(f"[API]\nX_KEY = benchmark\nBASE_URL = {base_url}\n{config}")
+    input_path = os.path.join(tmp_dir, "ratelimit_input.jpg")
+    Image.new("RGB", (256, 256), (10, 20, 30)).save(input_path, format="JPEG")
+
+    # 编辑器会打印每个任务的进度，压力测试中不输出
+    with contextlib.redirect_stdout(io.StringIO()):
+        instances = [FluxKontextNativeMultiEditor(config_path) for _ in range(editors)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(
+                executor.map(
+                    lambda i: instances[i % editors].edit_multi_images_native(
+                        [input_path],
+                        "benchmark",
+                        output_path=os.path.join(tmp_dir, f"ratelimit_{i}.png"),
+                    ),
+                    range(jobs),
+                )
+            )
+        elapsed = time.perf_counter() - started
+        limiter_stats = instances[0].rate_limiter.get_stats()
+        for editor in instances:
+            editor.close()
+
+    server.shutdown()
+    return state, results, elapsed, limiter_stats
+
+
+def bench_ratelimit(tmp_dir, rate, server_rate, jobs, editors, threads):
+    """对比无客户端限流和按配置限流时，突发负载下的服务端接受速率与429次数"""
+    scenarios = [
+        ("无客户端限流", ""),
+        (
+            f"限流 {rate:g}/s",
+            f"[RATE_LIMIT]\nsubmit_per_second = {rate}\nburst = 1\n"
+            f"max_in_flight = {threads}\n",
+        ),
+    ]
+    print(
+        f"服务端限流 {server_rate:g}/s，{jobs} 个任务，"
+        f"{editors} 个编辑器实例，{threads} 个线程并发"
+    )
+    print(
+        f"{'场景':<14}{'成功':>6}{'提交429':>9}{'耗时(s)':>9}"
+        f"{'接受速率(/s)':>14}{'每秒波动':>10}"
+    )
+    for label, config in scenarios:
+        state, results, elapsed, limiter_stats = _run_load(
+            tmp_dir, config, jobs, editors, threads, server_rate, ready_after=1.0
+        )
+        accepted = state["accepted"]
+        span = accepted[-1] - accepted[0] if len(accepted) > 1 else 0.0
+        per_second = [0] * (int(span) + 1)
+        for t in accepted:
+            per_second[int(t - accepted[0])] += 1
+        # 最后一秒通常不完整，不计入波动
+        full = per_second[:-1] or per_second
+        mean = sum(full) / len(full)
+        spread = (sum((n - mean) ** 2 for n in full) / len(full)) ** 0.5
+        ok = sum(1 for result in results if result)
+        print(
+            f"{label:<14}{ok:>6}{state['rejected_submits']:>9}{elapsed:>9.1f}"
+            f"{(len(accepted) - 1) / span if span else 0.0:>14.2f}{spread:>10.2f}"
+        )
+        print(f"{'':<14}每秒接受: {' '.join(str(n) for n in per_second)}")
+        print(
+            f"{'':<14}客户端: 限流等待 {limiter_stats['rate_wait_seconds']:.1f}s，"
+            f"收到429 {limiter_stats['throttled_submits']} 次，"
+            f"最多同时进行 {limiter_stats['max_in_flight_seen']} 个任务"
+        )
+
+
+class _TenantApiHandler(_JsonApiHandler):
+    """
+    检查密钥隔离的模拟API：提交的指令中带有租户名，必须与请求使用的密钥一致；
+    轮询必须使用提交该任务的密钥，否则返回403
+    """
+
+    def do_POST(self):
+        payload = json.loads(
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        )
+        key = self.headers.get("x-key")
+        state = self.state
+        with state["lock"]:
+            if not payload["prompt"].startswith(f"{key}:"):
+                state["submit_mismatches"] += 1
+            task_id = len(state["owners"])
+            state["owners"].append((key, time.monotonic()))
+        host = self.headers["Host"]
+        self._send(
+            200,
+            {
+                "id": f"task{task_id:06d}",
+                "polling_url": f"http://{host}/poll?id={task_id}",
+            },
+        )
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        state = self.state
+        if url.path == "/sample.jpg":
+            self._send(200, state["sample"], "image/jpeg")
+            return
+        owner, submitted = state["owners"][int(parse_qs(url.query)["id"][0])]
+        if self.headers.get("x-key") != owner:
+            with state["lock"]:
+                state["poll_mismatches"] += 1
+            self._send(403, {"detail": "Task belongs to another key"})
+            return
+        if time.monotonic() - submitted < state["ready_after"]:
+            self._send(200, {"status": "Pending"})
+            return
+        host = self.headers["Host"]
+        self._send(
+            200, {"status": "Ready", "result": {"sample": f"http://{host}/sample.jpg"}}
+        )
+
+
+def bench_isolation(tmp_dir, tenants, jobs_per_tenant, threads):
+    """
+    多个使用不同密钥的编辑器在同一进程中并发运行，检查每个请求都使用了自己编辑器的密钥
+
+    一半租户从各自的配置文件创建编辑器，另一半直接传入 ApiConfig
+
+    返回:
+        没有串用密钥时返回True
+    """
+    state = {
+        "lock": threading.Lock(),
+        "owners": [],
+        "submit_mismatches": 0,
+        "poll_mismatches": 0,
+        "ready_after": 0.3,
+        "sample": _sample_jpeg(),
+    }
+    server, base_url = _start_api_server(_TenantApiHandler, state)
+    input_path = os.path.join(tmp_dir, "isolation_input.jpg")
+    Image.new("RGB", (128, 128), (10, 20, 30)).save(input_path, format="JPEG")
+
+    jobs = [
+        (f"tenant-{t:02d}", j) for j in range(jobs_per_tenant) for t in range(tenants)
+    ]
+    with contextlib.redirect_stdout(io.StringIO()):
+        editors = {}
+        for t in range(tenants):
+            key = f"tenant-{t:02d}"
+            if t % 2:
+                editors[key] = FluxKontextNativeMultiEditor(
+                    api_config=ApiConfig(key, base_url), job_store=None
+                )
+            else:
+                config_path = os.path.join(tmp_dir, f"{key}.ini")
+                with open(config_path, "w", encoding="utf-8") as f:
+                    f.write(f"[API]\nX_KEY = {key}\nBASE_URL = {base_url}\n")
+                editors[key] = FluxKontextNativeMultiEditor(config_path)
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(
+                executor.map(
+                    lambda job: editors[job[0]].edit_multi_images_native(
+                        [input_path],
+                        f"{job[0]}: job {job[1]}",
+                        output_path=os.path.join(tmp_dir, f"{job[0]}_{job[1]}.png"),
+                    ),
+                    jobs,
+                )
+            )
+        elapsed = time.perf_counter() - started
+        for editor in editors.values():
+            editor.close()
+    server.shutdown()
+
+    ok = sum(1 for result in results if result)
+    print(f"{tenants} 个租户 x {jobs_per_tenant} 个任务，{threads} 个线程并发")
+    print(f"成功:           {ok}/{len(jobs)} ({elapsed:.1f}s)")
+    print(f"提交串用密钥:   {state['submit_mismatches']}")
+    print(f"轮询串用密钥:   {state['poll_mismatches']}")
+    passed = (
+        ok == len(jobs)
+        and state["submit_mismatches"] == 0
+        and state["poll_mismatches"] == 0
+    )
+    print("✅ 通过" if passed else "❌ 失败")
+    return passed
+
+
+class _RoutingApiHandler(_JsonApiHandler):
+    """记录每次提交的请求路径，任务立即完成"""
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        with self.state["lock"]:
+            self.state["paths"].append(self.path)
+        host = self.headers["Host"]
+        self._send(200, {"id": "task", "polling_url": f"http://{host}/poll"})
+
+    def do_GET(self):
+        if self.path == "/sample.jpg":
+            self._send(200, self.state["sample"], "image/jpeg")
+            return
+        host = self.headers["Host"]
+        self._send(
+            200, {"status": "Ready", "result": {"sample": f"http://{host}/sample.jpg"}}
+        )
+
+
+def bench_routing(tmp_dir):
+    """
+    每个注册的模型提交一个任务，检查请求发送到了注册表中该模型的地址；
+    未注册的模型应在发送请求之前被拒绝
+
+    返回:
+        全部符合时返回True
+    """
+    state = {"lock": threading.Lock(), "paths": [], "sample": _sample_jpeg()}
+    server, base_url = _start_api_server(_RoutingApiHandler, state)
+    input_path = os.path.join(tmp_dir, "routing_input.jpg")
+    Image.new("RGB", (128, 128), (10, 20, 30)).save(input_path, format="JPEG")
+    with contextlib.redirect_stdout(io.StringIO()):
+        editor = FluxKontextNativeMultiEditor(
+            api_config=ApiConfig("routing", base_url), job_store=None
+        )
+
+    passed = True
+    print(f"{'模型':<20} {'预期路径':<24} {'实际路径':<24}")
+    for spec in MODEL_REGISTRY.values():
+        del state["paths"][:]
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = editor.edit_multi_images_native(
+                [input_path],
+                "routing check",
+                output_path=os.path.join(tmp_dir, f"{spec.name}.png"),
+                model=spec.name,
+            )
+        actual = ", ".join(state["paths"]) or "-"
+        ok = bool(result) and state["paths"] == [spec.path]
+        passed = passed and ok
+        print(f"{spec.name:<20} {spec.path:<24} {actual:<24} {'✅' if ok else '❌'}")
+
+    del state["paths"][:]
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = editor.edit_multi_images_native(
+            [input_path], "routing check", model="flux-kontext-unknown"
+        )
+    ok = result is None and not state["paths"]
+    passed = passed and ok
+    print(
+        f"{'flux-kontext-unknown':<20} {'(拒绝)':<24} {', '.join(state['paths']) or '-':<24} {'✅' if ok else '❌'}"
+    )
+
+    editor.close()
+    server.shutdown()
+    print("✅ 通过" if passed else "❌ 失败")
+    return passed
+
+
+class _TailLatencyApiHandler(_JsonApiHandler):
+    """
+    长尾延迟的模拟API：大多数任务 fast 秒左右完成，tail_ratio 比例的任务需要 slow 秒
+    """
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        state = self.state
+        with state["lock"]:
+            rng = state["rng"]
+            if rng.random() < state["tail_ratio"]:
+                latency = state["slow"]
+            else:
+                latency = state["fast"] * rng.uniform(0.8, 1.2)
+            task_id = len(state["tasks"])
+            state["tasks"].append(time.monotonic() + latency)
+        host = self.headers["Host"]
+        self._send(
+            200,
+            {"id": f"task{task_id}", "polling_url": f"http://{host}/poll?id={task_id}"},
+        )
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/sample.jpg":
+            self._send(200, self.state["sample"], "image/jpeg")
+            return
+        ready_at = self.state["tasks"][int(parse_qs(url.query)["id"][0])]
+        if time.monotonic() < ready_at:
+            self._send(200, {"status": "Pending"})
+            return
+        host = self.headers["Host"]
+        self._send(
+            200, {"status": "Ready", "result": {"sample": f"http://{host}/sample.jpg"}}
+        )
+
+
+def _percentile(values, q):
+    """最近秩法分位数"""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+
+def bench_hedging(
+    tmp_dir, jobs, concurrency, percentile, budget, tail_ratio, max_in_flight
+):
+    """
+    在长尾延迟的模拟API上分别不对冲和对冲运行相同数量的任务，对比端到端耗时分位数和额外提交数，
+    并检查对冲请求计入进行中任务数上限
+
+    返回:
+        实际进行中的任务数从未超过 max_in_flight 时返回True
+    """
+    bounded = True
+    input_path = os.path.join(tmp_dir, "hedging_input.jpg")
+    Image.new("RGB", (128, 128), (10, 20, 30)).save(input_path, format="JPEG")
+    print(
+        f"{jobs} 个任务，并发 {concurrency}，进行中任务上限 {max_in_flight}；"
+        f"{tail_ratio:.0%} 的任务需要 3秒，其余约 0.3秒"
+    )
+    print(
+        f"{'模式':<12} {'p50':>7} {'p95':>7} {'p99':>7} {'最大':>7} {'提交数':>6} "
+        f"{'对冲':>5} {'对冲胜出':>8} {'最大进行中':>10}"
+    )
+
+    for name, hedge_policy in (
+        ("不对冲", None),
+        (
+            f"对冲 p{percentile:g}",
+            HedgePolicy(
+                percentile=percentile, budget=budget, min_samples=20, min_delay=0.1
+            ),
+        ),
+    ):
+        state = {
+            "lock": threading.Lock(),
+            "rng": random.Random(42),
+            "tasks": [],
+            "fast": 0.3,
+            "slow": 3.0,
+            "tail_ratio": tail_ratio,
+            "sample": _sample_jpeg(),
+        }
+        server, base_url = _start_api_server(_TailLatencyApiHandler, state)
+        with contextlib.redirect_stdout(io.StringIO()):
+            editor = FluxKontextNativeMultiEditor(
+                api_config=ApiConfig("hedging", base_url),
+                poll_strategy=LinearBackoffPolling(base=0.05, max_interval=0.05),
+                hedge_policy=hedge_policy,
+                pool_maxsize=concurrency * 2,
+                rate_limiter=RateLimiter(max_in_flight=max_in_flight),
+            )
+
+            def run(i):
+                started = time.perf_counter()
+                output = editor.edit_multi_images_native(
+                    [input_path],
+                    f"job {i}",
+                    output_path=os.path.join(tmp_dir, f"hedging_{i}.png"),
+                )
+                return time.perf_counter() - started if output else None
+
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                latencies = list(executor.map(run, range(jobs)))
+            editor.close()
+        server.shutdown()
+
+        ok = [latency for latency in latencies if latency is not None]
+        stats = hedge_policy.get_stats() if hedge_policy else {}
+        peak = editor.rate_limiter.get_stats()["max_in_flight_seen"]
+        bounded = bounded and peak <= max_in_flight
+        print(
+            f"{name:<12} {_percentile(ok, 50):>6.2f}s {_percentile(ok, 95):>6.2f}s "
+            f"{_percentile(ok, 99):>6.2f}s {max(ok):>6.2f}s {len(state['tasks']):>6} "
+            f"{stats.get('hedged', 0):>5} {stats.get('hedge_wins', 0):>8} {peak:>10}"
+        )
+        if len(ok) != jobs:
+            print(f"⚠️  {jobs - len(ok)} 个任务失败")
+    if not bounded:
+        print(f"❌ 进行中的任务数超过了上限 {max_in_flight}")
+    return bounded
+
+
+class _ConcurrencyApiHandler(_JsonApiHandler):
+    """
+    统计服务端连接数和同时进行的任务数的模拟API：任务在提交 ready_after 秒后完成，
+    从提交到下载结果之间算作进行中；指令以 "fail" 开头的任务第一次提交时处理失败
+    """
+
+    def setup(self):
+        super().setup()
+        with self.state["lock"]:
+            self.state["connections"] += 1
+
+    def do_POST(self):
+        payload = json.loads(
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        )
+        prompt = payload["prompt"]
+        state = self.state
+        with state["lock"]:
+            failed = prompt.startswith("fail") and prompt not in state["failed_prompts"]
+            if failed:
+                state["failed_prompts"].add(prompt)
+            task_id = len(state["tasks"])
+            state["tasks"].append((time.monotonic() + state["ready_after"], failed))
+            state["active"].add(task_id)
+            state["peak_active"] = max(state["peak_active"], len(state["active"]))
+        host = self.headers["Host"]
+        self._send(
+            200,
+            {
+                "id": f"task{task_id:06d}",
+                "polling_url": f"http://{host}/poll?id={task_id}",
+            },
+        )
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        state = self.state
+        task_id = int(parse_qs(url.query)["id"][0])
+        if url.path == "/sample.jpg":
+            with state["lock"]:
+                state["active"].discard(task_id)
+            self._send(200, state["sample"], "image/jpeg")
+            return
+        ready_at, failed = state["tasks"][task_id]
+        with state["lock"]:
+            state["polled"].add(task_id)
+        if time.monotonic() < ready_at:
+            self._send(200, {"status": "Pending"})
+            return
+        if failed:
+            with state["lock"]:
+                state["active"].discard(task_id)
+            self._send(200, {"status": "Error", "error": "simulated failure"})
+            return
+        host = self.headers["Host"]
+        self._send(
+            200,
+            {
+                "status": "Ready",
+                "result": {"sample": f"http://{host}/sample.jpg?id={task_id}"},
+            },
+        )
+
+
+def _start_concurrency_server(ready_after):
+    state = {
+        "lock": threading.Lock(),
+        "connections": 0,
+        "tasks": [],
+        "active": set(),
+        "peak_active": 0,
+        "polled": set(),
+        "failed_prompts": set(),
+        "ready_after": ready_after,
+        "sample": _sample_jpeg(),
+    }
+    server, base_url = _start_api_server(_ConcurrencyApiHandler, state)
+    return server, base_url, state
+
+
+def bench_pool(tmp_dir, jobs, threads):
+    """
+    多线程共享一个编辑器运行任务，对比保持连接和每次请求新建连接时的连接数，
+    并检查 get_pool_stats 统计的连接数与服务端实际接受的连接数一致 (包括服务端关闭连接后的重连)
+
+    返回:
+        统计准确、保持连接时连接数不超过连接池大小且大部分请求复用连接时返回True
+    """
+    input_path = os.path.join(tmp_dir, "pool_input.jpg")
+    Image.new("RGB", (128, 128), (10, 20, 30)).save(input_path, format="JPEG")
+    print(f"{jobs} 个任务，{threads} 个线程并发，连接池大小 {threads}")
+    print(
+        f"{'模式':<12} {'请求数':>6} {'客户端连接':>10} {'服务端连接':>10} "
+        f"{'复用率':>7} {'耗时':>7}"
+    )
+
+    passed = True
+    for name, keep_alive in (("保持连接", True), ("每次新建", False)):
+        server, base_url, state = _start_concurrency_server(ready_after=0.2)
+        with contextlib.redirect_stdout(io.StringIO()):
+            editor = FluxKontextNativeMultiEditor(
+                api_config=ApiConfig("pool", base_url),
+                transport=PooledTransport(pool_maxsize=threads, keep_alive=keep_alive),
+                poll_strategy=LinearBackoffPolling(base=0.05, max_interval=0.05),
+                job_store=None,
+            )
+            started = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=threads) as executor:
+                results = list(
+                    executor.map(
+                        lambda i: editor.edit_multi_images_native(
+                            [input_path],
+                            f"job {i}",
+                            output_path=os.path.join(tmp_dir, f"pool_{i}.png"),
+                        ),
+                        range(jobs),
+                    )
+                )
+            elapsed = time.perf_counter() - started
+            stats = editor.get_pool_stats()
+            editor.close()
+        server.shutdown()
+
+        ok = sum(1 for result in results if result)
+        print(
+            f"{name:<12} {stats['requests']:>6} {stats['connections']:>10} "
+            f"{state['connections']:>10} {stats['reuse_ratio']:>6.0%} {elapsed:>6.2f}s"
+        )
+        passed = passed and ok == jobs and stats["connections"] == state["connections"]
+        if keep_alive:
+            passed = (
+                passed
+                and stats["connections"] <= threads
+                and stats["reuse_ratio"] >= 0.9
+            )
+        else:
+            passed = passed and stats["connections"] == stats["requests"]
+
+    print("✅ 通过" if passed else "❌ 失败")
+    return passed
+
+
+def bench_async(tmp_dir, jobs, max_concurrency):
+    """
+    异步编辑器在单个事件循环中提交大量任务，检查服务端同时进行的任务数不超过 max_concurrency
+
+    返回:
+        全部成功且并发数受限时返回True
+    """
+    input_path = os.path.join(tmp_dir, "async_input.jpg")
+    Image.new("RGB", (128, 128), (10, 20, 30)).save(input_path, format="JPEG")
+    server, base_url, state = _start_concurrency_server(ready_after=0.5)
+    with contextlib.redirect_stdout(io.StringIO()):
+        editor = FluxKontextNativeMultiEditor(
+            api_config=ApiConfig("async", base_url),
+            poll_strategy=LinearBackoffPolling(base=0.05, max_interval=0.05),
+            job_store=None,
+        )
+
+        async def run():
+            async with AsyncFluxKontextEditor(
+                editor=editor, max_concurrency=max_concurrency
+            ) as async_editor:
+                return await async_editor.run_many(
+                    [
+                        {
+                            "image_paths": [input_path],
+                            "edit_instruction": f"job {i}",
+                            "output_path": os.path.join(tmp_dir, f"async_{i}.png"),
+                        }
+                        for i in range(jobs)
+                    ]
+                )
+
+        started = time.perf_counter()
+        try:
+            results = asyncio.run(run())
+        except ImportError as e:
+            results = None
+            error = str(e)
+        elapsed = time.perf_counter() - started
+        editor.close()
+    server.shutdown()
+
+    if results is None:
+        print(f"❌ {error}")
+        return False
+    ok = sum(1 for result in results if result)
+    print(f"{jobs} 个任务，并发上限 {max_concurrency}，每个任务约0.5秒")
+    print(f"成功:           {ok}/{jobs} ({elapsed:.1f}s)")
+    print(f"最大进行中:     {state['peak_active']}")
+    print(f"服务端连接:     {state['connections']}")
+    passed = ok == jobs and state["peak_active"] <= max_concurrency
+    print("✅ 通过" if passed else "❌ 失败")
+    return passed
+
+
+def bench_batch(tmp_dir, jobs, concurrency, failures):
+    """
+    从JSONL清单运行批量任务，其中 failures 个任务第一次处理失败；检查结果文件每个任务一行、
+    同时执行的任务数不超过 concurrency，续跑时只重新提交失败的任务
+
+    返回:
+        结果文件、并发数和续跑行为都符合预期时返回True
+    """
+    Image.new("RGB", (128, 128), (10, 20, 30)).save(
+        os.path.join(tmp_dir, "batch_input.jpg"), format="JPEG"
+    )
+    manifest_path = os.path.join(tmp_dir, "batch.jsonl")
+    with open(manifest_path, "w", encoding="utf-8") as f:
+        for i in range(jobs):
+            prompt = f"fail {i}" if i < failures else f"job {i}"
+            row = {"id": f"job{i:03d}", "inputs": ["batch_input.jpg"], "prompt": prompt}
+            f.write(json.dumps(row) + "\n")
+    results_path = os.path.join(tmp_dir, "batch_results.jsonl")
+    manifest = load_manifest(
+        manifest_path, output_dir=os.path.join(tmp_dir, "batch_outputs")
+    )
+
+    server, base_url, state = _start_concurrency_server(ready_after=0.3)
+    with contextlib.redirect_stdout(io.StringIO()):
+        editor = FluxKontextNativeMultiEditor(
+            api_config=ApiConfig("batch", base_url),
+            poll_strategy=LinearBackoffPolling(base=0.05, max_interval=0.05),
+            job_store=None,
+        )
+        first = run_batch(editor, manifest, results_path, concurrency=concurrency)
+        first_submits = len(state["tasks"])
+        second = run_batch(editor, manifest, results_path, concurrency=concurrency)
+        editor.close()
+    server.shutdown()
+
+    with open(results_path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f]
+    first_records = records[:jobs]
+    resubmits = len(state["tasks"]) - first_submits
+    print(f"{jobs} 个任务，并发 {concurrency}，{failures} 个任务第一次失败")
+    print(
+        f"首次运行:       成功 {first['ok']}，失败 {first['failed']} "
+        f"({first['seconds']:.1f}s)，结果 {len(first_records)} 行"
+    )
+    print(
+        f"续跑:           跳过 {second['skipped']}，成功 {second['ok']}，"
+        f"重新提交 {resubmits}"
+    )
+    print(f"最大进行中:     {state['peak_active']}")
+    passed = (
+        sorted(record["id"] for record in first_records)
+        == [job["id"] for job in manifest]
+        and first["ok"] == jobs - failures
+        and first["failed"] == failures
+        and second["skipped"] == jobs - failures
+        and second["ok"] == failures
+        and resubmits == failures
+        and load_completed(results_path) == {job["id"] for job in manifest}
+        and state["peak_active"] <= concurrency
+    )
+    print("✅ 通过" if passed else "❌ 失败")
+    return passed
+
+
+def _resume_child(base_url, db_path, input_path, tmp_dir, jobs):
+    """提交任务后在轮询中被终止的进程"""
+    sys.stdout = io.StringIO()
+    editor = FluxKontextNativeMultiEditor(
+        api_config=ApiConfig("resume", base_url),
+        poll_strategy=LinearBackoffPolling(base=0.05, max_interval=0.05),
+        job_store=JobStore(db_path),
+    )
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for i in range(jobs):
+            executor.submit(
+                editor.edit_multi_images_native,
+                [input_path],
+                f"job {i}",
+                output_path=os.path.join(tmp_dir, f"resume_{i}.png"),
+            )
+
+
+def bench_resume(tmp_dir, jobs):
+    """
+    子进程提交任务后、结果完成之前被强制终止，再从任务库继续收取结果；
+    检查所有任务都已记录、续跑不重新提交且全部收取成功
+
+    返回:
+        全部收取成功且没有重复提交时返回True
+    """
+    input_path = os.path.join(tmp_dir, "resume_input.jpg")
+    Image.new("RGB", (128, 128), (10, 20, 30)).save(input_path, format="JPEG")
+    db_path = os.path.join(tmp_dir, "resume_jobs.db")
+    server, base_url, state = _start_concurrency_server(ready_after=2.0)
+
+    context = multiprocessing.get_context("spawn")
+    process = context.Process(
+        target=_resume_child, args=(base_url, db_path, input_path, tmp_dir, jobs)
+    )
+    process.start()
+    # 每个任务都开始轮询时已写入任务库
+    deadline = time.monotonic() + 30
+    while len(state["polled"]) < jobs and time.monotonic() < deadline:
+        time.sleep(0.05)
+    process.kill()
+    process.join()
+    submits = len(state["tasks"])
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        store = JobStore(db_path)
+        recorded = store.get_stats()
+        editor = FluxKontextNativeMultiEditor(
+            api_config=ApiConfig("resume", base_url),
+            poll_strategy=LinearBackoffPolling(base=0.05, max_interval=0.05),
+            job_store=store,
+        )
+        summary = resume_jobs(editor, concurrency=jobs)
+        editor.close()
+        store.close()
+    server.shutdown()
+
+    outputs = sum(
+        1
+        for i in range(jobs)
+        if os.path.exists(os.path.join(tmp_dir, f"resume_{i}.png"))
+    )
+    print(f"{jobs} 个任务，提交后终止进程 (退出码 {process.exitcode})")
+    print(f"终止时已提交:   {submits}，任务库中未完成 {recorded['submitted']}")
+    print(
+        f"续跑收取:       {summary['completed']}/{summary['total']} "
+        f"({summary['seconds']:.1f}s)，重新提交 {len(state['tasks']) - submits}"
+    )
+    print(f"输出文件:       {outputs}/{jobs}")
+    passed = (
+        submits == jobs
+        and recorded["submitted"] == jobs
+        and summary["completed"] == jobs
+        and len(state["tasks"]) == submits
+        and outputs == jobs
+    )
+    print("✅ 通过" if passed else "❌ 失败")
+    return passed
+
+
+def _time_per_call(func, number):
+    """多次调用取最快一轮的单次耗时 (微秒)"""
+    best = float("inf")
+    for _ in range(5):
+        started = time.perf_counter()
+        for _ in range(number):
+            func()
+        best = min(best, time.perf_counter() - started)
+    return best / number * 1e6
+
+
+def bench_metrics(tmp_dir, number):
+    """
+    测量热路径上的指标开销：单次计数/直方图更新、关闭和开启指标时的追踪区间，
+    再用模拟API上一个真实任务产生的区间数估算每个任务的额外耗时
+    """
+    metrics = EditorMetrics()
+    tracer = Tracer([metrics])
+
+    def null_span():
+        with NULL_TRACER.span("poll", attempt=1) as span:
+            span.set(status=200)
+
+    def metrics_span():
+        with tracer.span("poll", attempt=1) as span:
+            span.set(status=200)
+
+    cases = [
+        (
+            "计数器 labels().inc()",
+            lambda: metrics.jobs_submitted.labels("flux-kontext-pro").inc(),
+        ),
+        (
+            "直方图 observe()",
+            lambda: metrics.stage_duration.labels("poll").observe(0.012),
+        ),
+        ("任务完成计数", lambda: metrics.job_finished("flux-kontext-pro", True)),
+        ("追踪区间 (未启用)", null_span),
+        ("追踪区间 + 指标", metrics_span),
+    ]
+    print(f"{'操作':<24} {'单次耗时':>10}")
+    costs = {}
+    for name, func in cases:
+        costs[name] = _time_per_call(func, number)
+        print(f"{name:<24} {costs[name]:>8.2f}µs")
+
+    # 在模拟API上运行一个任务，统计实际产生的区间数和指标调用数
+    state = {"lock": threading.Lock(), "paths": [], "sample": _sample_jpeg()}
+    server, base_url = _start_api_server(_RoutingApiHandler, state)
+    input_path = os.path.join(tmp_dir, "metrics_input.jpg")
+    Image.new("RGB", (2400, 1800), (10, 20, 30)).save(input_path, format="JPEG")
+    job_metrics = EditorMetrics()
+    aggregator = LatencyAggregator()
+    with contextlib.redirect_stdout(io.StringIO()):
+        editor = FluxKontextNativeMultiEditor(
+            api_config=ApiConfig("metrics", base_url),
+            tracer=Tracer([aggregator]),
+            metrics=job_metrics,
+            poll_strategy=LinearBackoffPolling(base=0.05, max_interval=0.05),
+        )
+        editor.edit_multi_images_native(
+            [input_path, input_path],
+            "metrics check",
+            output_path=os.path.join(tmp_dir, "metrics.png"),
+        )
+        editor.close()
+    server.shutdown()
+
+    summary = aggregator.summary()
+    spans = sum(row["count"] for row in summary.values())
+    job_seconds = summary["edit"]["max"]
+    # 每个任务另有 提交、完成、进行中增减、下载 共5次直接的指标调用
+    overhead = spans * costs["追踪区间 + 指标"] + 5 * costs["计数器 labels().inc()"]
+    print(
+        f"\n一个2张输入图片的任务产生 {spans} 个区间，"
+        f"指标和追踪共约 {overhead:.0f}µs，"
+        f"占本地模拟任务 {job_seconds * 1000:.0f}ms 的 {overhead / 1e4 / job_seconds:.3f}%"
+    )
+    expected = MODEL_REGISTRY["flux-kontext-pro"].expected_latency
+    print(f"相对真实API的典型耗时 {expected:.0f}秒 为 {overhead / 1e4 / expected:.5f}%")
+
+    # /metrics 输出
+    metrics_server = start_metrics_server(job_metrics.registry, port=0)
+    port = metrics_server.server_address[1]
+    transport = PooledTransport()
+    started = time.perf_counter()
+    body = transport.get(f"http://127.0.0.1:{port}/metrics", timeout=5).text
+    elapsed = (time.perf_counter() - started) * 1000
+    metrics_server.shutdown()
+    transport.close()
+    lines = [line for line in body.splitlines() if not line.startswith("#")]
+    print(
+        f"\n/metrics: {len(lines)} 个样本，{len(body)} 字节，抓取耗时 {elapsed:.1f}ms"
+    )
+    for line in lines:
+        if not line.startswith("flux_stage_duration_seconds_bucket"):
+            print(f"  {line}")
+
+
+def legacy_progress_callback(log_messages, message, current, total, delay=0.1):
+    """原网页内联进度回调的客户端部分：每次休眠0.1秒，并重建整个日志HTML"""
+    progress = min(int((current / total) * 100), 100) if total > 0 else 0
+    log_messages.append(f"[{time.strftime('%H:%M:%S')}] {message}")
+    log_text = "\n".join(log_messages[-15:])
+    log_html = f"<div>{html.escape(log_text)}</div>"
+    time.sleep(delay)
+    return progress, log_html
+
+
+def bench_progress(callbacks, frames):
+    """
+    一个任务的进度显示开销：原回调在工作线程里每次回调都休眠并重建日志HTML；
+    进度通道的回调只追加一行，界面每帧读取一次增量
+    """
+    messages = [f"⏳ 正在处理中... ({i}/{callbacks})" for i in range(1, callbacks + 1)]
+
+    log_messages = []
+    html_bytes = 0
+    started = time.perf_counter()
+    for i, message in enumerate(messages, 1):
+        _, log_html = legacy_progress_callback(log_messages, message, i, callbacks)
+        html_bytes += len(log_html.encode("utf-8"))
+    legacy_seconds = time.perf_counter() - started
+    legacy_render = _time_per_call(
+        lambda: legacy_progress_callback(log_messages[:15], messages[-1], 1, 2, 0),
+        200,
+    )
+
+    def channel_job():
+        channel = ProgressChannel()
+        view = ProgressView(channel)
+        rendered = 0
+        per_frame = max(callbacks // frames, 1)
+        for i, message in enumerate(messages, 1):
+            channel.update(message, i, callbacks)
+            if i % per_frame == 0 or i == callbacks:
+                view.refresh()
+                rendered += len(f"<div>{view.log_text()}</div>".encode("utf-8"))
+        return rendered
+
+    channel_bytes = channel_job()
+    channel_seconds = _time_per_call(channel_job, 50) / 1e6
+
+    print(f"每个任务 {callbacks} 次进度回调，界面刷新 {frames} 帧\n")
+    print(f"{'方式':<20} {'每任务耗时':>12} {'生成的日志HTML':>14}")
+    print(
+        f"{'原回调 (休眠+重建)':<20} {legacy_seconds * 1000:>10.1f}ms "
+        f"{html_bytes / 1024:>12.1f}KB"
+    )
+    print(f"{'  其中不含休眠':<20} {legacy_render * callbacks / 1000:>10.2f}ms")
+    print(
+        f"{'进度通道 (增量)':<20} {channel_seconds * 1000:>10.2f}ms "
+        f"{channel_bytes / 1024:>12.1f}KB"
+    )
+    print(
+        f"\n每个任务减少 {(legacy_seconds - channel_seconds) * 1000:.0f}ms 的工作线程阻塞"
+    )
+
+
+def _legacy_preview_script(paths):
+    """原网页的上传预览：每次运行都打开原图交给 st.image"""
+    import io
+
+    import streamlit as st
+    from PIL import Image
+
+    cols = st.columns(len(paths))
+    for i, path in enumerate(paths):
+        with open(path, "rb") as f:
+            data = f.read()
+        with cols[i]:
+            st.image(Image.open(io.BytesIO(data)), caption=f"图片 {i+1}")
+
+
+def _thumbnail_preview_script(paths):
+    """按文件内容缓存缩略图的上传预览 (与 streamlit_app.get_thumbnail 相同)"""
+    import streamlit as st
+
+    from flux_kontext_multi_native import make_thumbnail
+
+    @st.cache_data(max_entries=64, show_spinner=False)
+    def get_thumbnail(data):
+        return make_thumbnail(data, 384)
+
+    cols = st.columns(len(paths))
+    for i, path in enumerate(paths):
+        with open(path, "rb") as f:
+            data = f.read()
+        with cols[i]:
+            st.image(get_thumbnail(data), caption=f"图片 {i+1}")
+
+
+def bench_preview(paths, reruns):
+    """
+    用 Streamlit AppTest 运行只包含上传预览的页面，测量首次运行和之后每次重新运行的耗时
+    (按钮点击、滑块移动都会触发重新运行)
+    """
+    try:
+        from streamlit.testing.v1 import AppTest
+    except ImportError:
+        print("❌ 需要安装 streamlit: pip install streamlit")
+        return
+    # AppTest 在没有脚本上下文的主线程中运行，忽略相应的提示
+    # (streamlit 运行时会重置日志级别，因此使用过滤器)
+    logging.getLogger(
+        "streamlit.runtime.scriptrunner_utils.script_run_context"
+    ).addFilter(lambda record: "missing ScriptRunContext" not in record.getMessage())
+
+    source_bytes = sum(os.path.getsize(path) for path in paths)
+    thumbnail_bytes = sum(len(make_thumbnail(path)) for path in paths)
+    print(
+        f"{len(paths)} 张上传图片，共 {source_bytes / 1024 / 1024:.1f}MB，"
+        f"缩略图共 {thumbnail_bytes / 1024:.0f}KB\n"
+    )
+    print(f"{'方式':<16} {'首次运行':>10} {'重新运行(平均)':>14}")
+    for name, script in (
+        ("原图预览", _legacy_preview_script),
+        ("缓存缩略图", _thumbnail_preview_script),
+    ):
+        app = AppTest.from_function(script, args=(paths,), default_timeout=120)
+        started = time.perf_counter()
+        app.run()
+        first = time.perf_counter() - started
+        if app.exception:
+            print(f"❌ {name}: {app.exception[0].value}")
+            continue
+        started = time.perf_counter()
+        for _ in range(reruns):
+            app.run()
+        rerun = (time.perf_counter() - started) / reruns
+        print(f"{name:<16} {first * 1000:>8.0f}ms {rerun * 1000:>12.0f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Flux Kontext 本地性能基准")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    preprocess_parser = subparsers.add_parser("preprocess", help="输入图片预处理")
+    preprocess_parser.add_argument("--inputs", nargs="+", help="测试图片 (默认合成)")
+    preprocess_parser.add_argument("--repeat", type=int, default=3, help="重复次数")
+
+    encoding_parser = subparsers.add_parser("encoding", help="上传编码策略")
+    encoding_parser.add_argument("--inputs", nargs="+", help="测试图片 (默认合成)")
+
+    parallel_parser = subparsers.add_parser("parallel", help="并行预处理")
+    parallel_parser.add_argument("--inputs", nargs="+", help="测试图片 (默认合成大图)")
+    parallel_parser.add_argument("--workers", type=int, default=4, help="进程数")
+    parallel_parser.add_argument("--repeat", type=int, default=2, help="重复次数")
+
+    downscale_parser = subparsers.add_parser("downscale", help="大图缩放")
+    downscale_parser.add_argument("--inputs", nargs="+", help="测试图片 (默认合成大图)")
+    downscale_parser.add_argument(
+        "--upload-format",
+        choices=EncodingPolicy.FORMATS,
+        default="png",
+        help="上传编码格式 (jpeg 可减少编码耗时对缩放对比的干扰)",
+    )
+
+    download_parser = subparsers.add_parser("download", help="结果下载")
+    download_parser.add_argument(
+        "--inputs", nargs="+", help="作为生成结果的测试图片 (需位于同一目录，默认合成)"
+    )
+
+    ratelimit_parser = subparsers.add_parser("ratelimit", help="客户端限流压力测试")
+    ratelimit_parser.add_argument(
+        "--rate", type=float, default=4, help="客户端每秒提交数上限"
+    )
+    ratelimit_parser.add_argument(
+        "--server-rate", type=float, default=5, help="模拟服务端每秒接受的提交数"
+    )
+    ratelimit_parser.add_argument("--jobs", type=int, default=40, help="任务数")
+    ratelimit_parser.add_argument(
+        "--editors", type=int, default=4, help="共享限流器的编辑器实例数"
+    )
+    ratelimit_parser.add_argument("--threads", type=int, default=20, help="并发线程数")
+
+    isolation_parser = subparsers.add_parser("isolation", help="多密钥并发隔离检查")
+    isolation_parser.add_argument("--tenants", type=int, default=16, help="密钥数")
+    isolation_parser.add_argument(
+        "--jobs", type=int, default=4, help="每个密钥的任务数"
+    )
+    isolation_parser.add_argument("--threads", type=int, default=32, help="并发线程数")
+
+    subparsers.add_parser("routing", help="检查模型路由")
+
+    polling_parser = subparsers.add_parser("polling", help="轮询策略的完成检测延迟")
+    polling_parser.add_argument(
+        "--jobs", type=int, default=500, help="每个分布的任务数"
+    )
+    polling_parser.add_argument("--seed", type=int, default=1, help="随机种子")
+
+    progress_parser = subparsers.add_parser("progress", help="进度显示开销")
+    progress_parser.add_argument(
+        "--callbacks", type=int, default=40, help="每个任务的进度回调次数"
+    )
+    progress_parser.add_argument(
+        "--frames", type=int, default=20, help="任务期间界面刷新的帧数"
+    )
+
+    preview_parser = subparsers.add_parser("preview", help="网页上传预览")
+    preview_parser.add_argument(
+        "--inputs", nargs="+", help="上传的测试图片 (默认合成4张12MP照片)"
+    )
+    preview_parser.add_argument("--reruns", type=int, default=5, help="重新运行次数")
+
+    metrics_parser = subparsers.add_parser("metrics", help="指标开销微基准")
+    metrics_parser.add_argument(
+        "--number", type=int, default=100000, help="每轮调用次数"
+    )
+
+    hedging_parser = subparsers.add_parser("hedging", help="对冲提交的长尾延迟对比")
+    hedging_parser.add_argument("--jobs", type=int, default=300, help="任务数")
+    hedging_parser.add_argument("--concurrency", type=int, default=16, help="并发数")
+    hedging_parser.add_argument(
+        "--percentile", type=float, default=90, help="对冲分位数"
+    )
+    hedging_parser.add_argument(
+        "--budget", type=float, default=0.15, help="额外提交比例上限"
+    )
+    hedging_parser.add_argument(
+        "--tail-ratio", type=float, default=0.05, help="慢任务比例"
+    )
+    hedging_parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=20,
+        help="进行中任务数上限 (对冲请求也占用名额，需大于并发数才有空闲名额对冲)",
+    )
+
+    pool_parser = subparsers.add_parser("pool", help="连接复用检查")
+    pool_parser.add_argument("--jobs", type=int, default=60, help="任务数")
+    pool_parser.add_argument("--threads", type=int, default=8, help="并发线程数")
+
+    async_parser = subparsers.add_parser("async", help="异步编辑器并发上限检查")
+    async_parser.add_argument("--jobs", type=int, default=200, help="任务数")
+    async_parser.add_argument(
+        "--max-concurrency", type=int, default=50, help="同时处理的最大任务数"
+    )
+
+    batch_parser = subparsers.add_parser("batch", help="批量任务与续跑检查")
+    batch_parser.add_argument("--jobs", type=int, default=40, help="任务数")
+    batch_parser.add_argument("--concurrency", type=int, default=8, help="并发数")
+    batch_parser.add_argument(
+        "--failures", type=int, default=5, help="第一次处理失败的任务数"
+    )
+
+    resume_parser = subparsers.add_parser("resume", help="进程终止后收取结果检查")
+    resume_parser.add_argument("--jobs", type=int, default=8, help="任务数")
+
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.command == "preprocess":
+            paths = args.inputs or create_sample_images(tmp_dir)
+            bench_preprocess(paths, args.repeat)
+        elif args.command == "encoding":
+            paths = args.inputs or create_sample_images(tmp_dir)
+            bench_encoding(paths)
+            passthrough_paths = create_sample_images(tmp_dir, PASSTHROUGH_SAMPLE_IMAGES)
+            if not bench_passthrough(passthrough_paths):
+                sys.exit(1)
+        elif args.command == "parallel":
+            paths = args.inputs or create_sample_images(tmp_dir, LARGE_SAMPLE_IMAGES)
+            bench_parallel(paths, args.workers, args.repeat)
+        elif args.command == "downscale":
+            paths = args.inputs or create_sample_images(
+                tmp_dir, LARGE_SAMPLE_IMAGES[:2]
+            )
+            bench_downscale(paths, args.upload_format)
+        elif args.command == "download":
+            paths = args.inputs or create_sample_images(
+                tmp_dir, [SAMPLE_IMAGES[1], SAMPLE_IMAGES[3], LARGE_SAMPLE_IMAGES[0]]
+            )
+            bench_download(paths, tmp_dir)
+        elif args.command == "ratelimit":
+            bench_ratelimit(
+                tmp_dir,
+                args.rate,
+                args.server_rate,
+                args.jobs,
+                args.editors,
+                args.threads,
+            )
+        elif args.command == "isolation":
+            if not bench_isolation(tmp_dir, args.tenants, args.jobs, args.threads):
+                sys.exit(1)
+        elif args.command == "routing":
+            if not bench_routing(tmp_dir):
+                sys.exit(1)
+        elif args.command == "metrics":
+            bench_metrics(tmp_dir, args.number)
+        elif args.command == "polling":
+            bench_polling(args.jobs, args.seed)
+        elif args.command == "progress":
+            bench_progress(args.callbacks, args.frames)
+        elif args.command == "preview":
+            paths = args.inputs or create_sample_images(tmp_dir, PREVIEW_SAMPLE_IMAGES)
+            bench_preview(paths, args.reruns)
+        elif args.command == "hedging":
+            if not bench_hedging(
+                tmp_dir,
+                args.jobs,
+                args.concurrency,
+                args.percentile,
+                args.budget,
+                args.tail_ratio,
+                args.max_in_flight,
+            ):
+                sys.exit(1)
+        elif args.command == "pool":
+            if not bench_pool(tmp_dir, args.jobs, args.threads):
+                sys.exit(1)
+        elif args.command == "async":
+            if not bench_async(tmp_dir, args.jobs, args.max_concurrency):
+                sys.exit(1)
+        elif args.command == "batch":
+            if not bench_batch(tmp_dir, args.jobs, args.concurrency, args.failures):
+                sys.exit(1)
+        elif args.command == "resume":
+            if not bench_resume(tmp_dir, args.jobs):
+                sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,575 @@
+"""
+Flux Kontext 异步编辑器
+在单个事件循环中并发驱动大量 提交/轮询/下载 任务
+
+使用方法:
+    async with AsyncFluxKontextEditor(max_concurrency=200) as editor:
+        results = await editor.run_many([
+            {"image_paths": ["a.jpg"], "edit_instruction": "...", "output_path": "a_out.png"},
+            {"image_paths": ["b.jpg"], "edit_instruction": "...", "output_path": "b_out.png"},
+        ])
+
+请求体构建、结果缓存、状态解释、结果下载保存和任务记录都复用同步编辑器的实现，
+两条路径的行为保持一致；提交和轮询在事件循环中进行，下载和保存放到线程池中
+(流式下载时边下载边写入)。对冲提交 (hedge_policy) 和集中轮询 (status_poller) 只用于同步编辑器
+
+追踪: 并发任务共用事件循环线程，跨 await 的阶段不能用 tracer.span 嵌套，
+计时后用 tracer.record 记录为独立区间；线程池中的预处理、下载和保存区间照常嵌套
+
+依赖安装:
+pip install aiohttp
+"""
+
+import asyncio
+import time
+
+from flux_kontext_models import DEFAULT_MODEL, get_model
+from flux_kontext_multi_native import (
+    UNHEALTHY_STATUS_CODES,
+    FluxKontextNativeMultiEditor,
+    Status,
+)
+
+try:
+    import aiohttp
+except ImportError:  # pragma: no cover - 可选依赖
+    aiohttp = None
+
+
+class AsyncFluxKontextEditor:
+    """
+    Flux Kontext 异步编辑器 - 共享客户端、并发上限、可取消
+
+    对冲提交和集中轮询只用于同步编辑器，包装设置了 hedge_policy 或 status_poller 的编辑器时
+    抛出 ValueError，避免这些设置被静默忽略
+    """
+
+    def __init__(
+        self,
+        editor=None,
+        config_path=None,
+        max_concurrency=100,
+        connector_limit=100,
+        connector_limit_per_host=50,
+        request_timeout=60,
+    ):
+        """
+        参数:
+            editor: 复用的同步编辑器 (负责配置、图片预处理和请求体构建)
+            config_path: 未提供 editor 时使用的配置文件路径
+            max_concurrency: 同时处理的最大任务数
+            connector_limit: 共享客户端的总连接数上限
+            connector_limit_per_host: 每个主机的连接数上限
+            request_timeout: 单次HTTP请求超时时间 (秒)
+        """
+        if aiohttp is None:
+            raise ImportError("异步编辑器需要 aiohttp，请运行: pip install aiohttp")
+
+        editor = editor or FluxKontextNativeMultiEditor(config_path)
+        if editor.hedge_policy is not None:
+            raise ValueError(
+                "异步编辑器不支持对冲提交，请使用未设置 hedge_policy 的编辑器"
+            )
+        if editor.status_poller is not None:
+            raise ValueError(
+                "异步编辑器在事件循环中轮询，不使用集中轮询服务，请使用未设置 status_poller 的编辑器"
+            )
+        self.editor = editor
+        self.max_concurrency = max_concurrency
+        self.connector_limit = connector_limit
+        self.connector_limit_per_host = connector_limit_per_host
+        self.request_timeout = request_timeout
+        self._session = None
+        self._semaphore = None
+        self._tasks = set()
+
+    async def __aenter__(self):
+        await self._get_session()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.close()
+
+    async def _get_session(self):
+        """获取共享的 aiohttp 客户端 (在当前事件循环中惰性创建)"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.connector_limit,
+                limit_per_host=self.connector_limit_per_host,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.request_timeout),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def close(self):
+        """取消未完成的任务并关闭共享客户端"""
+        self.cancel_all()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def submit(self, **kwargs):
+        """
+        以后台任务方式提交一个编辑任务
+
+        返回:
+            asyncio.Task，可通过 task.cancel() 单独取消
+        """
+        task = asyncio.ensure_future(self.edit_multi_images_native_async(**kwargs))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def cancel_all(self):
+        """取消所有通过 submit 提交的未完成任务"""
+        for task in list(self._tasks):
+            task.cancel()
+
+    async def run_many(self, jobs):
+        """
+        并发执行多个任务
+
+        参数:
+            jobs: 参数字典列表，键与 edit_multi_images_native_async 相同
+
+        返回:
+            与 jobs 顺序一致的结果列表 (输出路径或None)
+        """
+        tasks = [self.submit(**job) for job in jobs]
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+        return [None if isinstance(r, BaseException) else r for r in results]
+
+    def _record_span(self, name, started, **attrs):
+        """记录从 started (time.monotonic()) 到现在的一个阶段"""
+        self.editor.tracer.record(name, time.monotonic() - started, **attrs)
+
+    async def edit_multi_images_native_async(
+        self,
+        image_paths,
+        edit_instruction,
+        output_path=None,
+        model=DEFAULT_MODEL,
+        aspect_ratio="1:1",
+        output_format="png",
+        safety_tolerance=2,
+        seed=-1,
+        prompt_upsampling=False,
+        progress_callback=None,
+        max_attempts=120,
+        use_result_cache=True,
+    ):
+        """
+        edit_multi_images_native 的异步版本，参数含义与同步版本相同
+
+        返回:
+            成功时返回输出路径，失败时返回None
+        """
+        started = time.monotonic()
+        output = await self._edit_async(
+            image_paths,
+            edit_instruction,
+            output_path,
+            model,
+            aspect_ratio,
+            output_format,
+            safety_tolerance,
+            seed,
+            prompt_upsampling,
+            progress_callback,
+            max_attempts,
+            use_result_cache,
+        )
+        self._record_span(
+            "edit",
+            started,
+            model=model,
+            inputs=len(image_paths or []),
+            ok=output is not None,
+        )
+        if self.editor.metrics is not None:
+            self.editor.metrics.job_finished(model, output is not None)
+        return output
+
+    def _preprocess(self, image_paths, progress_callback, max_size):
+        """在线程池中预处理输入图片"""
+        with self.editor.tracer.span("preprocess", images=len(image_paths or [])):
+            return self.editor.prepare_input_images(
+                image_paths, progress_callback, max_size
+            )
+
+    async def _edit_async(
+        self,
+        image_paths,
+        edit_instruction,
+        output_path,
+        model,
+        aspect_ratio,
+        output_format,
+        safety_tolerance,
+        seed,
+        prompt_upsampling,
+        progress_callback,
+        max_attempts,
+        use_result_cache,
+    ):
+        """edit_multi_images_native_async 的实现，参数含义相同"""
+        editor = self.editor
+        if not edit_instruction.strip():
+            print("❌ 编辑指令不能为空")
+            if progress_callback:
+                progress_callback("❌ 编辑指令不能为空", 0, 100)
+            return None
+
+        try:
+            spec = get_model(model)
+        except ValueError as e:
+            print(f"❌ {str(e)}")
+            if progress_callback:
+                progress_callback(f"❌ {str(e)}", 0, 100)
+            return None
+
+        if image_paths is not None and len(image_paths) > spec.max_inputs:
+            print(
+                f"⚠️  {model} 最多支持{spec.max_inputs}张图片，将使用前{spec.max_inputs}张"
+            )
+            image_paths = image_paths[: spec.max_inputs]
+
+        session = await self._get_session()
+        loop = asyncio.get_running_loop()
+
+        async with self._semaphore:
+            try:
+                # 图片预处理是CPU密集型操作，放到线程池中避免阻塞事件循环
+                base64_images = await loop.run_in_executor(
+                    None,
+                    self._preprocess,
+                    image_paths,
+                    progress_callback,
+                    spec.max_input_size,
+                )
+                if base64_images is None:
+                    return None
+
+                with editor.tracer.span("build_payload"):
+                    payload = editor.build_payload(
+                        edit_instruction,
+                        base64_images,
+                        aspect_ratio=aspect_ratio,
+                        output_format=output_format,
+                        safety_tolerance=safety_tolerance,
+                        seed=seed,
+                        prompt_upsampling=prompt_upsampling,
+                    )
+
+                # 固定种子的相同请求直接使用缓存结果
+                cache_key = editor._result_cache_key(
+                    model, payload, seed, use_result_cache
+                )
+                cached_output = await loop.run_in_executor(
+                    None,
+                    editor._restore_cached_result,
+                    cache_key,
+                    output_path,
+                    output_format,
+                    progress_callback,
+                )
+                if cached_output is not None:
+                    return cached_output
+
+                if progress_callback:
+                    progress_callback("🚀 正在发送请求到AI服务器...", 60, 100)
+
+                limiter = editor.rate_limiter
+                slot_started = time.monotonic()
+                await limiter.acquire_slot_async()
+                self._record_span("slot_wait", slot_started)
+                if editor.metrics is not None:
+                    editor.metrics.in_flight.inc()
+                # 选择提交使用的密钥/端点，该任务之后的轮询固定使用同一密钥
+                endpoint = editor.balancer.acquire()
+                try:
+                    url = spec.url(endpoint.base_url)
+                    headers = {
+                        "x-key": endpoint.x_key,
+                        "Content-Type": "application/json",
+                    }
+                    response_data = await self._submit_async(
+                        session, endpoint, url, payload, headers, progress_callback
+                    )
+                    if response_data is None:
+                        return None
+
+                    task_id = response_data.get("id")
+                    polling_url = response_data.get("polling_url")
+                    print(f"🔄 轮询URL: {polling_url}")
+                    if not task_id:
+                        print("❌ 未收到任务ID")
+                        print(f"响应内容: {response_data}")
+                        if progress_callback:
+                            progress_callback("❌ 未收到任务ID", 60, 100)
+                        return None
+
+                    print(f"🆔 任务ID: {task_id}")
+                    if editor.metrics is not None:
+                        editor.metrics.job_submitted(
+                            model, sum(len(image) for image in base64_images)
+                        )
+                    if progress_callback:
+                        progress_callback(
+                            f"✅ 任务已提交 (ID: {task_id[:8]}...)", 70, 100
+                        )
+
+                    if output_path is None:
+                        output_path = editor._default_output_path(
+                            output_format, task_id
+                        )
+
+                    # 开始轮询之前记录任务，进程中断后仍可收取结果
+                    editor._record_job(
+                        task_id,
+                        polling_url,
+                        model,
+                        payload,
+                        output_path,
+                        output_format,
+                        len(base64_images),
+                        endpoint.name,
+                    )
+
+                    ready = await self.wait_for_ready_async(
+                        polling_url,
+                        endpoint.x_key,
+                        max_attempts=max_attempts,
+                        progress_callback=progress_callback,
+                        poll_context=(model, len(base64_images)),
+                        job_id=task_id,
+                    )
+                    # 下载和保存与同步编辑器相同 (流式下载、追踪区间、下载字节数)
+                    if ready is not None and await loop.run_in_executor(
+                        None,
+                        editor._save_sample,
+                        ready,
+                        output_path,
+                        output_format,
+                        progress_callback,
+                    ):
+                        return await loop.run_in_executor(
+                            None,
+                            editor._finish_job,
+                            task_id,
+                            output_path,
+                            cache_key,
+                            progress_callback,
+                        )
+                    print("❌ 图像生成失败")
+                    if progress_callback:
+                        progress_callback("❌ 图像生成失败", 100, 100)
+                    return None
+                finally:
+                    editor.balancer.release(endpoint)
+                    limiter.release_slot()
+                    if editor.metrics is not None:
+                        editor.metrics.in_flight.dec()
+
+            except asyncio.TimeoutError:
+                print("❌ 请求超时，请重试")
+                if progress_callback:
+                    progress_callback("❌ 请求超时，请重试", 60, 100)
+                return None
+            except aiohttp.ClientError as e:
+                print(f"❌ 网络连接错误: {str(e)}")
+                if progress_callback:
+                    progress_callback("❌ 网络连接错误", 60, 100)
+                return None
+            except Exception as e:
+                print(f"❌ 意外错误: {str(e)}")
+                if progress_callback:
+                    progress_callback(f"❌ 意外错误: {str(e)}", 60, 100)
+                return None
+
+    async def _submit_async(
+        self, session, endpoint, url, payload, headers, progress_callback=None
+    ):
+        """
+        提交任务，按共享限流器的速率发送，收到429时按 Retry-After 退避后重试；
+        结果反馈给负载均衡器用于健康跟踪
+
+        返回:
+            响应字典，失败时返回None
+        """
+        limiter = self.editor.rate_limiter
+        balancer = self.editor.balancer
+        for attempt in range(limiter.max_retries + 1):
+            await limiter.acquire_submit_async()
+            started = time.monotonic()
+            try:
+                response = await session.post(url, json=payload, headers=headers)
+            except (asyncio.TimeoutError, aiohttp.ClientError):
+                self._record_span(
+                    "submit", started, endpoint=endpoint.name, attempt=attempt
+                )
+                balancer.report_failure(endpoint)
+                raise
+            self._record_span(
+                "submit",
+                started,
+                endpoint=endpoint.name,
+                attempt=attempt,
+                status=response.status,
+            )
+
+            async with response:
+                if response.status == 200:
+                    balancer.report_success(endpoint)
+                    return await response.json()
+                text = await response.text()
+                if response.status != 429 or attempt == limiter.max_retries:
+                    if response.status in UNHEALTHY_STATUS_CODES:
+                        balancer.report_failure(endpoint)
+                    self.editor._report_submit_failure(
+                        response.status, text, progress_callback
+                    )
+                    return None
+                delay = limiter.retry_delay(response, attempt)
+
+            print(f"⏳ 请求被限流 (429)，{delay:.1f}秒后重试")
+            if progress_callback:
+                progress_callback(f"⏳ 请求被限流，{delay:.1f}秒后重试...", 60, 100)
+            await asyncio.sleep(limiter.throttled("submit", delay))
+        return None
+
+    async def wait_for_result_async(
+        self,
+        polling_url,
+        x_key,
+        max_attempts=120,
+        progress_callback=None,
+        poll_context=None,
+    ):
+        """
+        wait_for_result 的异步版本：等待任务完成并下载为PIL图像
+
+        返回:
+            PIL.Image，失败时返回None
+        """
+        ready = await self.wait_for_ready_async(
+            polling_url,
+            x_key,
+            max_attempts=max_attempts,
+            progress_callback=progress_callback,
+            poll_context=poll_context,
+        )
+        if ready is None:
+            return None
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            None, self.editor._download_sample, ready, progress_callback, 100, 100
+        )
+
+    async def wait_for_ready_async(
+        self,
+        polling_url,
+        x_key,
+        max_attempts=120,
+        progress_callback=None,
+        poll_context=None,
+        job_id=None,
+    ):
+        """wait_for_ready 的异步版本，等待期间不占用线程，参数含义相同"""
+        started = time.monotonic()
+        result = await self._wait_for_ready_async(
+            polling_url, x_key, max_attempts, progress_callback, poll_context, job_id
+        )
+        self._record_span("queue_wait", started, ok=result is not None)
+        return result
+
+    async def _wait_for_ready_async(
+        self, polling_url, x_key, max_attempts, progress_callback, poll_context, job_id
+    ):
+        """wait_for_ready_async 的实现"""
+        session = await self._get_session()
+        headers = {"x-key": x_key}
+        editor = self.editor
+        strategy = editor.poll_strategy
+        started = time.monotonic()
+
+        for attempt in range(1, max_attempts + 1):
+            elapsed = time.monotonic() - started
+            wait_time = strategy.next_interval(attempt, elapsed, poll_context)
+            if elapsed + wait_time > editor.max_wait:
+                break
+            if progress_callback:
+                progress_callback(
+                    f"🔄 检查进度 {attempt}/{max_attempts} - 等待 {wait_time:.1f}秒",
+                    attempt,
+                    max_attempts,
+                )
+            await asyncio.sleep(wait_time)
+
+            await editor.rate_limiter.acquire_poll_async()
+            poll_started = time.monotonic()
+            try:
+                async with session.get(polling_url, headers=headers) as response:
+                    self._record_span(
+                        "poll", poll_started, attempt=attempt, status=response.status
+                    )
+                    if response.status == 429:
+                        limiter = editor.rate_limiter
+                        delay = limiter.retry_delay(response, 0)
+                        print(f"⏳ 状态检查被限流 (429)，{delay:.1f}秒后继续")
+                        await asyncio.sleep(limiter.throttled("poll", delay))
+                        continue
+                    if response.status != 200:
+                        print(f"⚠️  状态检查失败: {response.status}")
+                        continue
+                    result = await response.json()
+            except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                self._record_span("poll", poll_started, attempt=attempt)
+                print(f"🌐 状态检查出错 (尝试 {attempt}/{max_attempts}): {str(e)}")
+                continue
+
+            status = editor._interpret_status(
+                result,
+                started,
+                poll_context,
+                job_id,
+                progress_callback,
+                attempt,
+                max_attempts,
+            )
+            if status == Status.READY:
+                return result
+            if status == Status.ERROR:
+                return None
+
+        print("❌ 达到最大尝试次数，处理失败")
+        if progress_callback:
+            progress_callback("❌ 处理超时，请重试", max_attempts, max_attempts)
+        return None
+
+
+def edit_many(jobs, config_path=None, max_concurrency=100):
+    """
+    同步入口：在新的事件循环中并发执行多个任务
+
+    参数:
+        jobs: 参数字典列表，键与 edit_multi_images_native 相同
+        config_path: 配置文件路径
+        max_concurrency: 同时处理的最大任务数
+
+    返回:
+        与 jobs 顺序一致的结果列表 (输出路径或None)
+    """
+
+    async def _run():
+        async with AsyncFluxKontextEditor(
+            config_path=config_path, max_concurrency=max_concurrency
+        ) as editor:
+            return await editor.run_many(jobs)
+
+    return asyncio.run(_run())
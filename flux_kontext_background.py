@@ -0,0 +1,324 @@
+"""
+Flux Kontext 后台任务
+在共享线程池中执行编辑请求，界面线程只读取任务状态快照，不等待生成完成
+
+    ProgressChannel  - 进度通道，工作线程每次回调只做一次加锁赋值和追加，界面按帧读取增量
+    ProgressView     - 界面侧的增量视图，每帧只取新增日志行并只转义新行
+    BackgroundJob    - 一个编辑请求的状态和进度通道，progress_callback 可直接传给编辑器
+    BackgroundRunner - 进程内共享的后台执行器，提交后立即返回 BackgroundJob；
+                       任务在一个事件循环中由 AsyncFluxKontextEditor 执行，等待生成结果时不占用线程，
+                       线程池只执行预处理、下载等阻塞步骤 (未安装 aiohttp 时每个任务占用一个线程)
+
+进度回调的频率由编辑器决定 (轮询时每次查询一次)，界面刷新的频率由界面决定，
+两次读取之间的所有回调合并为一帧：最新的进度和消息加上新增的日志行
+
+任务状态:
+    queued    - 等待空闲线程
+    running   - 执行中 (预处理、提交、等待结果或下载)
+    succeeded - 结果已保存
+    failed    - 编辑失败或出现异常
+"""
+
+import asyncio
+import html
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from flux_kontext_async import AsyncFluxKontextEditor
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_SUCCEEDED = "succeeded"
+JOB_FAILED = "failed"
+
+FINISHED_STATES = (JOB_SUCCEEDED, JOB_FAILED)
+
+
+class ProgressChannel:
+    """进度通道 - 一个写入者 (进度回调)，任意个按游标读取增量的读取者"""
+
+    def __init__(self, log_size=50):
+        """
+        参数:
+            log_size: 保留的最近日志条数
+        """
+        self.message = "⏳ 排队中..."
+        self.progress = 0
+        self.version = 0
+        self._seq = 0
+        self._log = deque(maxlen=log_size)
+        self._lock = threading.Lock()
+
+    def update(self, message, current, total):
+        """进度回调，签名与编辑器的 progress_callback 相同"""
+        progress = min(int(current / total * 100), 100) if total > 0 else 0
+        line = f"[{time.strftime('%H:%M:%S')}] {message}"
+        with self._lock:
+            self.message = message
+            self.progress = progress
+            self._log.append(line)
+            self._seq += 1
+            self.version += 1
+
+    def lines(self):
+        """返回保留的全部日志行"""
+        with self._lock:
+            return list(self._log)
+
+    def read(self, cursor=None):
+        """
+        读取上次读取之后的变化
+
+        参数:
+            cursor: 上次返回的游标，首次读取传 None
+
+        返回:
+            (frame, cursor)；没有变化时 frame 为 None，
+            否则 frame 为 {"message", "progress", "lines", "reset"}，
+            lines 只包含新增的日志行，reset 为 True 时表示读取者落后太多、
+            lines 是保留的全部日志，应替换而不是追加
+        """
+        version, seq = cursor or (0, 0)
+        with self._lock:
+            if self.version == version:
+                return None, cursor
+            new = self._seq - seq
+            reset = new > len(self._log)
+            if reset:
+                lines = list(self._log)
+            else:
+                lines = [
+                    self._log[i] for i in range(len(self._log) - new, len(self._log))
+                ]
+            frame = {
+                "message": self.message,
+                "progress": self.progress,
+                "lines": lines,
+                "reset": reset,
+            }
+            return frame, (self.version, self._seq)
+
+
+class ProgressView:
+    """
+    界面侧的增量视图 - 保存已转义的日志行，refresh() 只处理上一帧之后新增的行
+
+    每个会话为每个任务保留一个实例 (如存放在 st.session_state 中)
+    """
+
+    def __init__(self, channel, max_lines=15, escape=html.escape):
+        """
+        参数:
+            channel: ProgressChannel
+            max_lines: 显示的最近日志条数
+            escape: 日志行的转义函数
+        """
+        self.channel = channel
+        self.escape = escape
+        self.message = channel.message
+        self.progress = channel.progress
+        self.log_lines = deque(maxlen=max_lines)
+        self._cursor = None
+
+    def refresh(self):
+        """
+        拉取新的一帧
+
+        返回:
+            是否有变化
+        """
+        frame, self._cursor = self.channel.read(self._cursor)
+        if frame is None:
+            return False
+        self.message = frame["message"]
+        self.progress = frame["progress"]
+        if frame["reset"]:
+            self.log_lines.clear()
+        self.log_lines.extend(self.escape(line) for line in frame["lines"])
+        return True
+
+    def log_text(self):
+        """返回已转义的日志文本"""
+        return "\n".join(self.log_lines)
+
+
+class BackgroundJob:
+    """后台编辑任务 - 工作线程写入，界面线程通过 snapshot() 读取"""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, label, params=None, log_size=50):
+        """
+        参数:
+            label: 显示名称 (如编辑指令)
+            params: 任务参数，用于界面展示
+            log_size: 保留的最近日志条数
+        """
+        self.id = next(self._ids)
+        self.label = label
+        self.params = dict(params or {})
+        self.state = JOB_QUEUED
+        self.channel = ProgressChannel(log_size)
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self._lock = threading.Lock()
+
+    def update(self, message, current, total):
+        """进度回调，签名与编辑器的 progress_callback 相同"""
+        self.channel.update(message, current, total)
+
+    @property
+    def message(self):
+        return self.channel.message
+
+    def _set_state(self, state, result=None, error=None):
+        with self._lock:
+            self.state = state
+            if state == JOB_RUNNING:
+                self.started_at = time.time()
+            elif state in FINISHED_STATES:
+                self.finished_at = time.time()
+                self.result = result
+                self.error = error
+
+    @property
+    def finished(self):
+        return self.state in FINISHED_STATES
+
+    def snapshot(self):
+        """返回当前状态的副本 (不含进度和日志，它们通过 channel 按增量读取)"""
+        with self._lock:
+            return {
+                "id": self.id,
+                "label": self.label,
+                "params": self.params,
+                "state": self.state,
+                "result": self.result,
+                "error": self.error,
+                "created_at": self.created_at,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class BackgroundRunner:
+    """
+    共享的后台编辑执行器
+
+    任务提交到后台线程中的事件循环，由包装共享编辑器的 AsyncFluxKontextEditor 执行：
+    服务端排队和生成期间只是一个挂起的协程，同时进行的任务数不受线程数限制，
+    由 max_concurrency 和编辑器限流器的进行中名额约束。
+    编辑器无法异步执行 (未安装 aiohttp、设置了对冲或集中轮询) 时，任务在线程池中同步执行
+    """
+
+    def __init__(self, max_workers=8, max_concurrency=100):
+        """
+        参数:
+            max_workers: 执行预处理、下载保存等阻塞步骤的线程数 (同步执行时为同时执行的任务数)
+            max_concurrency: 每个编辑器同时进行的异步任务数上限
+        """
+        self.max_workers = max_workers
+        self.max_concurrency = max_concurrency
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="flux-background"
+        )
+        self._loop = asyncio.new_event_loop()
+        self._loop.set_default_executor(self._executor)
+        self._loop_thread = threading.Thread(
+            target=self._loop.run_forever, name="flux-background-loop", daemon=True
+        )
+        self._loop_thread.start()
+        # 编辑器 -> AsyncFluxKontextEditor (无法异步执行时为 None)
+        self._async_editors = {}
+        self._lock = threading.Lock()
+
+    def submit(self, editor, label, **kwargs):
+        """
+        提交一个编辑请求，立即返回
+
+        参数:
+            editor: FluxKontextNativeMultiEditor 实例
+            label: 任务显示名称
+            kwargs: 传给 edit_multi_images_native 的参数 (不含 progress_callback)
+
+        返回:
+            BackgroundJob
+        """
+        params = {k: v for k, v in kwargs.items() if k != "image_paths"}
+        params["inputs"] = len(kwargs.get("image_paths") or [])
+        job = BackgroundJob(label, params)
+        async_editor = self._get_async_editor(editor)
+        if async_editor is None:
+            self._executor.submit(self._run, job, editor, kwargs)
+        else:
+            asyncio.run_coroutine_threadsafe(
+                self._run_async(job, async_editor, kwargs), self._loop
+            )
+        return job
+
+    def _get_async_editor(self, editor):
+        """返回包装该编辑器的 AsyncFluxKontextEditor，无法异步执行时返回None"""
+        with self._lock:
+            if editor not in self._async_editors:
+                try:
+                    self._async_editors[editor] = AsyncFluxKontextEditor(
+                        editor=editor, max_concurrency=self.max_concurrency
+                    )
+                except (ImportError, ValueError) as e:
+                    print(f"⚠️  后台任务改为同步执行: {str(e)}")
+                    self._async_editors[editor] = None
+            return self._async_editors[editor]
+
+    async def _run_async(self, job, async_editor, kwargs):
+        job._set_state(JOB_RUNNING)
+        try:
+            # 通过 submit 创建任务，关闭时由异步编辑器统一取消
+            result = await async_editor.submit(progress_callback=job.update, **kwargs)
+        except asyncio.CancelledError:
+            job.update("❌ 任务已取消", 100, 100)
+            job._set_state(JOB_FAILED, error="任务已取消")
+            raise
+        except Exception as e:
+            job.update(f"❌ 处理出错: {str(e)}", 100, 100)
+            job._set_state(JOB_FAILED, error=str(e))
+            return
+        if result:
+            job._set_state(JOB_SUCCEEDED, result=result)
+        else:
+            job._set_state(JOB_FAILED, error=job.message)
+
+    def _run(self, job, editor, kwargs):
+        job._set_state(JOB_RUNNING)
+        try:
+            result = editor.edit_multi_images_native(
+                progress_callback=job.update, **kwargs
+            )
+            if result:
+                job._set_state(JOB_SUCCEEDED, result=result)
+            else:
+                job._set_state(JOB_FAILED, error=job.message)
+        except Exception as e:
+            job.update(f"❌ 处理出错: {str(e)}", 100, 100)
+            job._set_state(JOB_FAILED, error=str(e))
+
+    def shutdown(self, wait=False):
+        """取消未完成的任务，关闭异步编辑器的客户端，然后停止事件循环和线程池"""
+
+        async def close_editors():
+            editors = [e for e in self._async_editors.values() if e is not None]
+            await asyncio.gather(*(e.close() for e in editors), return_exceptions=True)
+
+        future = asyncio.run_coroutine_threadsafe(close_editors(), self._loop)
+        future.add_done_callback(
+            lambda _: self._loop.call_soon_threadsafe(self._loop.stop)
+        )
+        if wait:
+            future.result()
+            self._loop_thread.join()
+        self._executor.shutdown(wait=wait, cancel_futures=True)
@@ -0,0 +1,272 @@
+"""
+Flux Kontext 多密钥 / 多端点负载均衡
+在多个API密钥和端点之间分配任务提交，跟踪健康状态，连续失败的成员暂时移出轮换
+
+配置 (config.ini):
+    [API]                      # 默认成员 (可选，存在 [ENDPOINT:*] 时可省略)
+    X_KEY = key-a
+    BASE_URL = https://api.bfl.ai
+    WEIGHT = 1
+
+    [ENDPOINT:backup]          # 额外成员，名称为冒号后的部分
+    X_KEY = key-b
+    BASE_URL = https://api.eu.bfl.ai
+    WEIGHT = 2
+
+    [BALANCER]
+    strategy = least_in_flight # 或 weighted_round_robin
+    failure_threshold = 3      # 连续失败多少次后移出轮换
+    cooldown = 30              # 移出后多少秒重新尝试
+
+任务的轮询必须使用提交它的密钥，因此调用方记录 acquire() 返回的成员，并在任务结束后 release()
+"""
+
+import hashlib
+import threading
+import time
+from dataclasses import dataclass
+
+DEFAULT_BASE_URL = "https://api.bfl.ai"
+
+ENDPOINT_SECTION_PREFIX = "ENDPOINT:"
+
+BALANCE_STRATEGIES = ("least_in_flight", "weighted_round_robin")
+
+
+def normalize_base_url(base_url):
+    """规范化API端点地址"""
+    base_url = (base_url or "").rstrip("/")
+    if not base_url:
+        return DEFAULT_BASE_URL
+    if base_url == "https://api.bfl.ml":
+        print("⚠️  警告: api.bfl.ml 是文档站点，使用 api.bfl.ai 进行API调用")
+        return DEFAULT_BASE_URL
+    if not base_url.startswith("http"):
+        return f"https://{base_url}"
+    return base_url
+
+
+@dataclass(frozen=True)
+class ApiConfig:
+    """
+    一个API密钥及其端点的不可变配置
+
+    随编辑器实例显式传递到每个请求，不写入进程环境变量，
+    因此同一进程中使用不同密钥的编辑器 (如多个 Streamlit 会话) 互不影响
+    """
+
+    x_key: str
+    base_url: str = DEFAULT_BASE_URL
+
+    def __post_init__(self):
+        if not self.x_key:
+            raise KeyError("X_KEY 不能为空")
+        object.__setattr__(self, "base_url", normalize_base_url(self.base_url))
+
+    @property
+    def key_id(self):
+        """密钥指纹，用于日志和按密钥共享的资源，不暴露密钥本身"""
+        return hashlib.sha256(self.x_key.encode("utf-8")).hexdigest()[:12]
+
+    def __repr__(self):
+        return f"ApiConfig(key_id={self.key_id!r}, base_url={self.base_url!r})"
+
+
+class Endpoint:
+    """负载均衡成员 - 一个不可变的 ApiConfig 加上分配和健康状态"""
+
+    def __init__(self, name, api_config, weight=1):
+        if weight <= 0:
+            raise ValueError(f"端点 {name} 的 WEIGHT 必须大于0")
+        self.name = name
+        self.api_config = api_config
+        self.weight = weight
+        self.in_flight = 0
+        self.submitted = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self._current_weight = 0
+
+    @property
+    def x_key(self):
+        return self.api_config.x_key
+
+    @property
+    def base_url(self):
+        return self.api_config.base_url
+
+    def copy(self):
+        """返回配置相同、统计清零的新成员"""
+        return Endpoint(self.name, self.api_config, self.weight)
+
+    def __repr__(self):
+        return f"Endpoint({self.name!r}, {self.base_url!r}, weight={self.weight})"
+
+
+class EndpointBalancer:
+    """在多个成员之间分配任务提交，连续失败的成员在冷却期内不参与分配"""
+
+    def __init__(
+        self,
+        endpoints,
+        strategy="least_in_flight",
+        failure_threshold=3,
+        cooldown=30.0,
+    ):
+        """
+        参数:
+            endpoints: Endpoint 列表
+            strategy: "least_in_flight" (按权重归一化的进行中任务数最少) 或
+                      "weighted_round_robin" (平滑加权轮询)
+            failure_threshold: 连续失败多少次后移出轮换
+            cooldown: 移出轮换的秒数，之后重新参与分配，再次失败立即移出
+        """
+        if not endpoints:
+            raise ValueError("至少需要一个端点")
+        if strategy not in BALANCE_STRATEGIES:
+            raise ValueError(f"未知的负载均衡策略: {strategy}")
+        names = [endpoint.name for endpoint in endpoints]
+        if len(set(names)) != len(names):
+            raise ValueError("端点名称重复")
+        self.endpoints = list(endpoints)
+        self.strategy = strategy
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self._by_name = {endpoint.name: endpoint for endpoint in self.endpoints}
+        self._lock = threading.Lock()
+
+    def get(self, name):
+        """按名称返回成员，不存在时返回None"""
+        return self._by_name.get(name)
+
+    @property
+    def default(self):
+        """第一个成员，用于没有记录提交成员的旧任务"""
+        return self.endpoints[0]
+
+    def acquire(self):
+        """
+        选择一个成员用于提交新任务，其进行中任务数加一
+
+        所有成员都不健康时选择最早结束冷却的成员，而不是拒绝请求
+        """
+        with self._lock:
+            now = time.monotonic()
+            healthy = [e for e in self.endpoints if e.ejected_until <= now]
+            if not healthy:
+                endpoint = min(self.endpoints, key=lambda e: e.ejected_until)
+            elif self.strategy == "weighted_round_robin":
+                endpoint = self._pick_weighted_round_robin(healthy)
+            else:
+                endpoint = self._pick_least_in_flight(healthy)
+            endpoint.in_flight += 1
+            endpoint.submitted += 1
+            return endpoint
+
+    def release(self, endpoint):
+        """任务结束 (成功、失败或放弃) 后调用"""
+        with self._lock:
+            endpoint.in_flight -= 1
+
+    def report_success(self, endpoint):
+        """成员成功处理请求，清零连续失败计数"""
+        with self._lock:
+            endpoint.consecutive_failures = 0
+
+    def report_failure(self, endpoint):
+        """成员请求失败 (网络错误、5xx、密钥无效、持续限流)，达到阈值后移出轮换"""
+        with self._lock:
+            endpoint.failures += 1
+            endpoint.consecutive_failures += 1
+            if endpoint.consecutive_failures >= self.failure_threshold:
+                endpoint.ejected_until = time.monotonic() + self.cooldown
+                ejected = True
+            else:
+                ejected = False
+        if ejected:
+            print(
+                f"⚠️  端点 {endpoint.name} 连续失败，{self.cooldown:.0f}秒内不再分配任务"
+            )
+
+    def get_stats(self):
+        """返回每个成员的分配和健康状态 (不包含密钥)"""
+        with self._lock:
+            now = time.monotonic()
+            return {
+                endpoint.name: {
+                    "base_url": endpoint.base_url,
+                    "weight": endpoint.weight,
+                    "in_flight": endpoint.in_flight,
+                    "submitted": endpoint.submitted,
+                    "failures": endpoint.failures,
+                    "healthy": endpoint.ejected_until <= now,
+                }
+                for endpoint in self.endpoints
+            }
+
+    def _pick_weighted_round_robin(self, candidates):
+        """平滑加权轮询：按权重交错分配，不会连续集中到同一成员"""
+        total = 0
+        best = None
+        for endpoint in candidates:
+            endpoint._current_weight += endpoint.weight
+            total += endpoint.weight
+            if best is None or endpoint._current_weight > best._current_weight:
+                best = endpoint
+        best._current_weight -= total
+        return best
+
+    def _pick_least_in_flight(self, candidates):
+        """按权重归一化的进行中任务数最少；并列时按加权轮询分配"""
+        lowest = min(endpoint.in_flight / endpoint.weight for endpoint in candidates)
+        tied = [e for e in candidates if e.in_flight / e.weight == lowest]
+        return self._pick_weighted_round_robin(tied)
+
+
+def endpoints_from_config(config):
+    """
+    从 ConfigParser 读取 [API] 和所有 [ENDPOINT:name] 部分
+
+    返回:
+        Endpoint 列表，[API] 对应的成员名为 "default" 并排在第一位
+
+    异常:
+        KeyError: 没有任何端点配置或缺少 X_KEY
+    """
+    sections = []
+    if config.has_section("API"):
+        sections.append(("default", "API"))
+    for section in config.sections():
+        if section.startswith(ENDPOINT_SECTION_PREFIX):
+            sections.append((section[len(ENDPOINT_SECTION_PREFIX) :].strip(), section))
+    if not sections:
+        raise KeyError("配置文件中未找到 [API] 部分")
+
+    endpoints = []
+    for name, section in sections:
+        options = config[section]
+        if not options.get("X_KEY"):
+            raise KeyError(f"[{section}] 中未找到 X_KEY")
+        endpoints.append(
+            Endpoint(
+                name,
+                ApiConfig(options["X_KEY"], options.get("BASE_URL", DEFAULT_BASE_URL)),
+                weight=options.getfloat("WEIGHT", 1.0),
+            )
+        )
+    return endpoints
+
+
+def balancer_settings_from_config(config):
+    """读取 [BALANCER] 部分，返回 EndpointBalancer 参数字典"""
+    settings = {}
+    if config.has_section("BALANCER"):
+        section = config["BALANCER"]
+        if "strategy" in section:
+            settings["strategy"] = section["strategy"].strip()
+        if "failure_threshold" in section:
+            settings["failure_threshold"] = section.getint("failure_threshold")
+        if "cooldown" in section:
+            settings["cooldown"] = section.getfloat("cooldown")
+    return settings
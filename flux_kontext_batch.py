@@ -0,0 +1,285 @@
+"""
+Flux Kontext 批量任务
+从 JSONL/CSV 清单读取任务，在同一进程中并发执行，结果逐行写入 JSONL，中断后可续跑
+
+清单字段:
+    id                任务标识 (可选，默认为清单中的行号)，续跑时据此跳过已完成的任务
+    inputs            输入图片路径列表；CSV 中用 ";" 分隔。相对路径相对于清单文件所在目录
+    prompt            编辑指令
+    output            输出路径 (可选，默认 <output_dir>/<id>.<format>)
+    model, aspect_ratio, format, safety, seed, prompt_upsampling  同命令行参数
+
+JSONL 示例:
+    {"id": "family", "inputs": ["a.jpg", "b.jpg"], "prompt": "合成全家福", "seed": 42}
+
+CSV 示例:
+    id,inputs,prompt,format
+    family,a.jpg;b.jpg,合成全家福,jpeg
+"""
+
+import csv
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+
+# 清单字段 -> edit_multi_images_native 参数
+MANIFEST_FIELDS = {
+    "model": "model",
+    "aspect_ratio": "aspect_ratio",
+    "format": "output_format",
+    "safety": "safety_tolerance",
+    "seed": "seed",
+    "prompt_upsampling": "prompt_upsampling",
+}
+
+INT_FIELDS = ("safety", "seed")
+
+STATUS_OK = "ok"
+STATUS_FAILED = "failed"
+
+
+class ManifestError(ValueError):
+    """清单格式错误"""
+
+
+def _parse_bool(value):
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() in ("1", "true", "yes", "y", "on")
+
+
+def _read_rows(path):
+    """按扩展名读取 CSV 或 JSONL 清单，返回 (行号, 原始字典) 列表"""
+    rows = []
+    if path.lower().endswith(".csv"):
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            for line_no, row in enumerate(csv.DictReader(f), start=2):
+                rows.append((line_no, row))
+        return rows
+
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            try:
+                rows.append((line_no, json.loads(line)))
+            except ValueError as e:
+                raise ManifestError(f"第 {line_no} 行不是有效的JSON: {str(e)}")
+    return rows
+
+
+def load_manifest(path, output_dir="batch_outputs"):
+    """
+    读取任务清单
+
+    参数:
+        path: .jsonl 或 .csv 清单文件
+        output_dir: 未指定 output 的任务的输出目录
+
+    返回:
+        任务列表，每项为 {"id", "kwargs"}，kwargs 可直接传给 edit_multi_images_native
+
+    异常:
+        ManifestError: 缺少必填字段、字段类型错误或任务ID重复
+    """
+    base_dir = os.path.dirname(os.path.abspath(path))
+    jobs = []
+    seen = set()
+
+    for line_no, row in _read_rows(path):
+        row = {key: value for key, value in row.items() if value not in (None, "")}
+        job_id = str(row.get("id", line_no))
+        if job_id in seen:
+            raise ManifestError(f"第 {line_no} 行: 任务ID重复: {job_id}")
+        seen.add(job_id)
+
+        inputs = row.get("inputs")
+        if isinstance(inputs, str):
+            inputs = [item.strip() for item in inputs.split(";") if item.strip()]
+        if not inputs or not row.get("prompt"):
+            raise ManifestError(f"第 {line_no} 行: 缺少 inputs 或 prompt")
+
+        kwargs = {
+            "image_paths": [os.path.join(base_dir, item) for item in inputs],
+            "edit_instruction": row["prompt"],
+        }
+        for field, param in MANIFEST_FIELDS.items():
+            if field not in row:
+                continue
+            value = row[field]
+            try:
+                if field in INT_FIELDS:
+                    value = int(value)
+                elif field == "prompt_upsampling":
+                    value = _parse_bool(value)
+            except ValueError:
+                raise ManifestError(f"第 {line_no} 行: {field} 必须是整数")
+            kwargs[param] = value
+
+        output = row.get("output")
+        if output:
+            output = os.path.join(base_dir, output)
+        else:
+            extension = kwargs.get("output_format", "png")
+            output = os.path.join(output_dir, f"{job_id}.{extension}")
+        kwargs["output_path"] = output
+
+        jobs.append({"id": job_id, "kwargs": kwargs})
+
+    return jobs
+
+
+def load_completed(results_path):
+    """
+    从结果文件读取已成功完成的任务ID
+
+    只有状态为 ok 且输出文件仍然存在的任务才算完成；文件末尾被中断写入的不完整行会被忽略
+    """
+    completed = set()
+    if not os.path.exists(results_path):
+        return completed
+
+    with open(results_path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("status") == STATUS_OK and os.path.exists(
+                record.get("output") or ""
+            ):
+                completed.add(record["id"])
+            else:
+                completed.discard(record.get("id"))
+    return completed
+
+
+def run_batch(editor, jobs, results_path, concurrency=4, resume=True):
+    """
+    并发执行批量任务
+
+    每个任务结束时立即在结果文件中追加一行。按 Ctrl-C 后不再提交排队中的任务，
+    等待已提交的任务完成并写入结果 (再次按 Ctrl-C 立即返回)，续跑时不会重复提交
+
+    参数:
+        editor: FluxKontextNativeMultiEditor 实例，所有任务共享其连接池和预处理进程池
+        jobs: load_manifest 返回的任务列表
+        results_path: 结果 JSONL 文件，每完成一个任务追加一行
+        concurrency: 同时执行的任务数
+        resume: 跳过结果文件中已成功完成的任务
+
+    返回:
+        {"total", "skipped", "ok", "failed", "cancelled", "interrupted", "seconds"}
+    """
+    completed = load_completed(results_path) if resume else set()
+    pending = [job for job in jobs if job["id"] not in completed]
+    skipped = len(jobs) - len(pending)
+    summary = {
+        "total": len(jobs),
+        "skipped": skipped,
+        "ok": 0,
+        "failed": 0,
+        "cancelled": 0,
+        "interrupted": False,
+    }
+
+    if skipped:
+        print(f"⏭️  跳过 {skipped} 个已完成的任务")
+    if not pending:
+        summary["seconds"] = 0.0
+        return summary
+
+    results_dir = os.path.dirname(os.path.abspath(results_path))
+    os.makedirs(results_dir, exist_ok=True)
+    for job in pending:
+        output_dir = os.path.dirname(job["kwargs"]["output_path"])
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+
+    # 多个任务同时等待时，由同一个调度线程轮询状态
+    if concurrency > 1:
+        editor.enable_batch_polling()
+
+    started = time.perf_counter()
+    lock = threading.Lock()
+
+    def record_result(future):
+        # 在执行任务的工作线程中调用，中断后仍在进行的任务完成时也会写入结果
+        if future.cancelled():
+            return
+        record = future.result()
+        with lock:
+            summary[record["status"]] += 1
+            done = summary["ok"] + summary["failed"]
+            with open(results_path, "a", encoding="utf-8") as results_file:
+                results_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+            icon = "✅" if record["status"] == STATUS_OK else "❌"
+            print(
+                f"{icon} [{done + skipped}/{len(jobs)}] {record['id']} "
+                f"({record['seconds']:.1f}秒) {record['output'] or record['error']}"
+            )
+
+    executor = ThreadPoolExecutor(
+        max_workers=concurrency, thread_name_prefix="flux-batch"
+    )
+    futures = [executor.submit(_run_job, editor, job) for job in pending]
+    for future in futures:
+        future.add_done_callback(record_result)
+
+    try:
+        wait(futures)
+    except KeyboardInterrupt:
+        summary["interrupted"] = True
+        executor.shutdown(wait=False, cancel_futures=True)
+        summary["cancelled"] = sum(1 for future in futures if future.cancelled())
+        running = [future for future in futures if not future.done()]
+        print(f"\n⏸️  已中断，取消 {summary['cancelled']} 个排队中的任务")
+        if running:
+            print(
+                f"⏳ 等待 {len(running)} 个已提交的任务完成并写入结果 (再次 Ctrl-C 立即退出)"
+            )
+            try:
+                wait(running)
+            except KeyboardInterrupt:
+                print("⚠️  不再等待已提交的任务，未写入结果的任务续跑时会重新提交")
+    else:
+        executor.shutdown(wait=True)
+
+    summary["seconds"] = time.perf_counter() - started
+    return summary
+
+
+def _run_job(editor, job):
+    """执行单个任务并生成结果记录，异常不会中断整个批次"""
+    started = time.perf_counter()
+    record = {
+        "id": job["id"],
+        "status": STATUS_FAILED,
+        "output": None,
+        "error": None,
+        "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    messages = []
+
+    def progress_callback(message, current, total):
+        messages.append(message)
+
+    try:
+        output = editor.edit_multi_images_native(
+            progress_callback=progress_callback, **job["kwargs"]
+        )
+        if output:
+            record["status"] = STATUS_OK
+            record["output"] = str(output)
+        else:
+            # 记录编辑器给出的错误 (如输入不存在、参数错误、生成失败)，便于区分失败原因
+            errors = [message for message in messages if message.startswith("❌")]
+            record["error"] = (errors or messages or ["编辑失败"])[-1]
+    except Exception as e:
+        record["error"] = str(e)
+    record["seconds"] = round(time.perf_counter() - started, 3)
+    return record
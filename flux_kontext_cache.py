@@ -0,0 +1,354 @@
+"""
+Flux Kontext 缓存
+PayloadCache - 预处理后的 base64 输入图片缓存，按文件内容和预处理参数寻址
+ResultCache  - 固定种子请求的生成结果缓存，按完整请求体寻址
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+
+
+def _canonical_json(value):
+    """生成稳定的JSON表示，用于计算缓存键"""
+    return json.dumps(value, sort_keys=True, separators=(",", ":"), default=str)
+
+
+class PayloadCache:
+    """预处理结果缓存 - 内存LRU + 磁盘两级，按大小上限淘汰"""
+
+    def __init__(
+        self,
+        cache_dir=None,
+        max_memory_bytes=256 * 1024 * 1024,
+        max_disk_bytes=2 * 1024 * 1024 * 1024,
+    ):
+        """
+        参数:
+            cache_dir: 磁盘缓存目录，None 表示只使用内存
+            max_memory_bytes: 内存缓存的base64字符总量上限
+            max_disk_bytes: 磁盘缓存的文件总大小上限
+        """
+        self.cache_dir = cache_dir
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+        }
+
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            self._disk_bytes = sum(size for _, _, size in self._disk_entries())
+
+    @staticmethod
+    def make_key(raw_bytes, params):
+        """
+        计算缓存键
+
+        参数:
+            raw_bytes: 原始文件内容
+            params: 影响预处理结果的参数 (编码策略、最大尺寸、缩放模式等)
+        """
+        digest = hashlib.sha256(raw_bytes)
+        digest.update(_canonical_json(params).encode("utf-8"))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        查找缓存
+
+        返回:
+            (base64字符串, 处理信息) 或 None
+        """
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self._stats["hits"] += 1
+                self._stats["memory_hits"] += 1
+                return entry
+
+        entry = self._read_disk(key)
+
+        with self._lock:
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            self._stats["hits"] += 1
+            self._stats["disk_hits"] += 1
+            self._remember(key, entry)
+            return entry
+
+    def put(self, key, base64_str, info):
+        """写入缓存"""
+        entry = (base64_str, info)
+        with self._lock:
+            self._remember(key, entry)
+        self._write_disk(key, entry)
+
+    def invalidate(self, key=None):
+        """使指定键失效，key 为 None 时清空全部缓存"""
+        with self._lock:
+            if key is None:
+                self._memory.clear()
+                self._memory_bytes = 0
+            else:
+                entry = self._memory.pop(key, None)
+                if entry is not None:
+                    self._memory_bytes -= len(entry[0])
+
+        if not self.cache_dir:
+            return
+        if key is None:
+            for path, _, _ in self._disk_entries():
+                self._remove_file(path)
+        else:
+            self._remove_file(self._disk_path(key))
+
+    def get_stats(self):
+        """返回命中/未命中计数和当前占用"""
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return dict(
+                self._stats,
+                hit_ratio=self._stats["hits"] / lookups if lookups else 0.0,
+                memory_entries=len(self._memory),
+                memory_bytes=self._memory_bytes,
+                disk_bytes=self._disk_bytes,
+            )
+
+    def _remember(self, key, entry):
+        """放入内存LRU (调用方持有锁)"""
+        size = len(entry[0])
+        if size > self.max_memory_bytes:
+            return
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_bytes -= len(previous[0])
+        self._memory[key] = entry
+        self._memory_bytes += size
+        while self._memory_bytes > self.max_memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted[0])
+            self._stats["evictions"] += 1
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _disk_entries(self):
+        """遍历磁盘缓存文件，返回 (路径, 修改时间, 大小) 列表"""
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            # 更新修改时间，使磁盘淘汰按最近使用顺序进行
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        info = data["info"]
+        info["size"] = tuple(info["size"])
+        return data["base64"], info
+
+    def _write_disk(self, key, entry):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({"base64": entry[0], "info": entry[1]}, f)
+            previous = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            print(f"⚠️  写入缓存失败: {str(e)}")
+            self._remove_file(tmp_path)
+            return
+
+        with self._lock:
+            self._disk_bytes += size - previous
+            over_budget = self._disk_bytes > self.max_disk_bytes
+        if over_budget:
+            self._evict_disk()
+
+    def _evict_disk(self):
+        """按最近使用时间淘汰磁盘缓存，直到低于大小上限"""
+        entries = sorted(self._disk_entries(), key=lambda entry: entry[1])
+        total = sum(size for _, _, size in entries)
+        for path, _, size in entries:
+            if total <= self.max_disk_bytes:
+                break
+            self._remove_file(path)
+            total -= size
+            with self._lock:
+                self._stats["evictions"] += 1
+        with self._lock:
+            self._disk_bytes = total
+
+    def _remove_file(self, path):
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        if path.endswith(".json"):
+            with self._lock:
+                self._disk_bytes -= size
+
+
+class ResultCache:
+    """生成结果缓存 - 固定种子时相同请求体直接返回已保存的图像，不发起网络请求"""
+
+    def __init__(
+        self,
+        cache_dir,
+        ttl=7 * 24 * 3600,
+        max_entries=1000,
+        max_bytes=1024 * 1024 * 1024,
+    ):
+        """
+        参数:
+            cache_dir: 结果图像缓存目录
+            ttl: 缓存有效期 (秒)
+            max_entries: 最多保留的结果数
+            max_bytes: 结果文件总大小上限
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    @staticmethod
+    def make_key(model, payload):
+        """按模型和完整请求体 (含输入图片和种子) 计算缓存键"""
+        canonical = _canonical_json({"model": model, "payload": payload})
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        """
+        查找缓存结果
+
+        返回:
+            缓存图像的文件路径，未命中或已过期时返回None
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._stats["misses"] += 1
+                return None
+            if time.time() - entry["created"] > self.ttl:
+                self._drop(key)
+                self._stats["expired"] += 1
+                self._stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats["hits"] += 1
+            return entry["path"]
+
+    def put(self, key, source_path):
+        """将生成结果复制到缓存中"""
+        extension = os.path.splitext(source_path)[1]
+        path = os.path.join(self.cache_dir, key[:2], f"{key}{extension}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        try:
+            shutil.copyfile(source_path, tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️  写入结果缓存失败: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._total_bytes -= self._entries.pop(key)["size"]
+            size = os.path.getsize(path)
+            self._entries[key] = {"path": path, "size": size, "created": time.time()}
+            self._total_bytes += size
+            while self._entries and (
+                len(self._entries) > self.max_entries
+                or self._total_bytes > self.max_bytes
+            ):
+                self._drop(next(iter(self._entries)))
+                self._stats["evictions"] += 1
+
+    def invalidate(self, key=None):
+        """使指定键失效，key 为 None 时清空全部缓存"""
+        with self._lock:
+            keys = list(self._entries) if key is None else [key]
+            for k in keys:
+                if k in self._entries:
+                    self._drop(k)
+
+    def get_stats(self):
+        """返回命中/未命中计数和当前占用"""
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return dict(
+                self._stats,
+                hit_ratio=self._stats["hits"] / lookups if lookups else 0.0,
+                entries=len(self._entries),
+                bytes=self._total_bytes,
+            )
+
+    def _drop(self, key):
+        """删除一条缓存 (调用方持有锁)"""
+        entry = self._entries.pop(key)
+        self._total_bytes -= entry["size"]
+        try:
+            os.remove(entry["path"])
+        except OSError:
+            pass
+
+    def _load_index(self):
+        """从磁盘重建索引，按创建时间排序作为初始的淘汰顺序"""
+        found = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                stat = os.stat(path)
+                key = os.path.splitext(name)[0]
+                found.append((stat.st_mtime, key, path, stat.st_size))
+
+        for created, key, path, size in sorted(found):
+            self._entries[key] = {"path": path, "size": size, "created": created}
+            self._total_bytes += size
@@ -0,0 +1,113 @@
+"""
+Flux Kontext 对冲提交 (可选)
+任务超过历史耗时的指定分位数仍未完成时，再提交一个相同的请求，使用先完成的结果，
+用少量额外提交换取长尾延迟的降低
+
+    HedgePolicy - 按 (模型, 输入图片数) 记录最近的完成时间，决定何时对冲，并限制额外提交的比例
+
+API不支持取消任务，落后的任务不再轮询，其结果被忽略 (仍会计费)，
+因此额外提交数受 budget 限制：对冲次数不超过任务总数的 budget 倍
+"""
+
+import math
+import threading
+from collections import deque
+
+
+class HedgePolicy:
+    """对冲策略 - 历史耗时分位数作为对冲延迟，按预算限制额外提交"""
+
+    def __init__(
+        self,
+        percentile=95.0,
+        budget=0.1,
+        min_samples=20,
+        window=200,
+        min_delay=1.0,
+    ):
+        """
+        参数:
+            percentile: 任务耗时超过历史的该分位数时对冲
+            budget: 额外提交数占任务总数的上限 (0.1 表示最多多提交10%)
+            min_samples: 同一上下文至少有多少个样本后才开始对冲
+            window: 每个上下文保留的最近样本数
+            min_delay: 对冲延迟的下限秒数
+        """
+        if not 0 < percentile < 100:
+            raise ValueError("percentile 必须在0到100之间")
+        if budget < 0:
+            raise ValueError("budget 不能为负数")
+        self.percentile = percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.window = window
+        self.min_delay = min_delay
+        self._samples = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            "jobs": 0,
+            "hedged": 0,
+            "hedge_wins": 0,
+            "budget_denied": 0,
+            "hedge_failed": 0,
+        }
+
+    def begin(self, context):
+        """
+        开始等待一个任务
+
+        返回:
+            对冲延迟秒数 (从提交开始计)，该上下文样本不足时返回None
+        """
+        with self._lock:
+            self._stats["jobs"] += 1
+            samples = self._samples.get(context)
+            if samples is None or len(samples) < self.min_samples:
+                return None
+            ordered = sorted(samples)
+        # 最近秩法：不插值，结果总是某个真实样本
+        rank = math.ceil(self.percentile / 100 * len(ordered)) - 1
+        return max(ordered[rank], self.min_delay)
+
+    def try_hedge(self):
+        """
+        申请一次对冲提交
+
+        返回:
+            预算允许时返回True 并计入对冲次数
+        """
+        with self._lock:
+            if self._stats["hedged"] + 1 > self.budget * self._stats["jobs"]:
+                self._stats["budget_denied"] += 1
+                return False
+            self._stats["hedged"] += 1
+            return True
+
+    def hedge_failed(self):
+        """对冲请求未能提交 (已计入对冲次数)"""
+        with self._lock:
+            self._stats["hedge_failed"] += 1
+
+    def record(self, context, duration, hedge_won=False):
+        """
+        记录一个完成的任务
+
+        参数:
+            context: 任务上下文，如 (model, input_count)
+            duration: 从原始任务提交到发现完成的秒数 (对冲请求胜出时也按原始任务的提交时间计)
+            hedge_won: 结果是否来自对冲请求
+        """
+        with self._lock:
+            samples = self._samples.get(context)
+            if samples is None:
+                samples = self._samples[context] = deque(maxlen=self.window)
+            samples.append(duration)
+            if hedge_won:
+                self._stats["hedge_wins"] += 1
+
+    def get_stats(self):
+        """返回任务数、对冲次数、对冲胜出次数、预算拒绝次数和提交失败次数"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats["extra_ratio"] = stats["hedged"] / stats["jobs"] if stats["jobs"] else 0.0
+        return stats
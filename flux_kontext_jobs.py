@@ -0,0 +1,300 @@
+"""
+Flux Kontext 持久化任务队列
+提交成功后、开始轮询之前把任务ID和轮询地址写入本地SQLite，进程退出后可以继续收取结果
+
+状态:
+    submitted  - 已提交，尚未收取结果 (resume 会继续轮询)
+    completed  - 结果已保存
+    failed     - API返回处理失败
+    expired    - 超过最长恢复时间，不再轮询
+
+使用方法:
+    python flux_kontext_multi_native.py resume                 # 收取所有未完成任务
+    python flux_kontext_multi_native.py resume --list          # 只列出未完成任务
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+JOB_SUBMITTED = "submitted"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_EXPIRED = "expired"
+
+JOB_STATES = (JOB_SUBMITTED, JOB_COMPLETED, JOB_FAILED, JOB_EXPIRED)
+
+DEFAULT_JOB_DB = os.path.join(".flux_cache", "jobs.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    task_id      TEXT PRIMARY KEY,
+    polling_url  TEXT NOT NULL,
+    model        TEXT NOT NULL,
+    input_count  INTEGER NOT NULL DEFAULT 0,
+    params       TEXT NOT NULL,
+    output_path  TEXT,
+    output_format TEXT NOT NULL,
+    endpoint     TEXT,
+    state        TEXT NOT NULL,
+    error        TEXT,
+    submitted_at REAL NOT NULL,
+    updated_at   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_state ON jobs (state, submitted_at);
+"""
+
+_COLUMNS = (
+    "task_id",
+    "polling_url",
+    "model",
+    "input_count",
+    "params",
+    "output_path",
+    "output_format",
+    "endpoint",
+    "state",
+    "error",
+    "submitted_at",
+    "updated_at",
+)
+
+
+class JobStore:
+    """基于SQLite的任务记录 - WAL模式，按状态建立索引，多线程共享一个连接"""
+
+    def __init__(self, db_path=DEFAULT_JOB_DB):
+        """
+        参数:
+            db_path: 数据库文件路径，":memory:" 表示只保存在内存中
+        """
+        self.db_path = db_path
+        if db_path != ":memory:":
+            directory = os.path.dirname(os.path.abspath(db_path))
+            os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        # 自动提交模式：每次状态变更都是一个独立的短事务
+        self._conn = sqlite3.connect(
+            db_path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._conn.row_factory = sqlite3.Row
+        with self._lock:
+            # WAL 允许 resume 与正在运行的批量任务同时读写；
+            # synchronous=NORMAL 在进程崩溃时不丢失已提交的记录，只在断电时可能丢失最后几条
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+            self._migrate()
+
+    def _migrate(self):
+        """为旧版数据库补充新增的列 (调用方持有锁)"""
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "endpoint" not in existing:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN endpoint TEXT")
+
+    def add(
+        self,
+        task_id,
+        polling_url,
+        model,
+        params,
+        output_path,
+        output_format,
+        input_count=0,
+        endpoint=None,
+    ):
+        """
+        记录一个已提交的任务
+
+        参数:
+            task_id: API返回的任务ID
+            polling_url: 轮询地址
+            model: 使用的模型
+            params: 请求参数 (不含图片数据)
+            output_path: 结果保存路径，无法持久化的目标 (如文件对象) 传 None
+            output_format: 输出格式
+            input_count: 输入图片数量，用于恢复时的轮询策略上下文
+            endpoint: 提交该任务的端点名称，恢复时使用同一密钥轮询
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (task_id, polling_url, model, input_count,"
+                " params, output_path, output_format, endpoint, state, error,"
+                " submitted_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, NULL, ?, ?)",
+                (
+                    task_id,
+                    polling_url,
+                    model,
+                    input_count,
+                    json.dumps(params, ensure_ascii=False),
+                    None if output_path is None else str(output_path),
+                    output_format,
+                    endpoint,
+                    JOB_SUBMITTED,
+                    now,
+                    now,
+                ),
+            )
+
+    def update(self, task_id, state, error=None, output_path=None):
+        """更新任务状态 (output_path 为 None 时保留原值)"""
+        if state not in JOB_STATES:
+            raise ValueError(f"未知的任务状态: {state}")
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, error = ?,"
+                " output_path = COALESCE(?, output_path), updated_at = ?"
+                " WHERE task_id = ?",
+                (
+                    state,
+                    error,
+                    None if output_path is None else str(output_path),
+                    time.time(),
+                    task_id,
+                ),
+            )
+
+    def get(self, task_id):
+        """按任务ID查询，返回字典或None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE task_id = ?", (task_id,)
+            ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def unfinished(self, limit=None):
+        """
+        返回所有尚未收取结果的任务，按提交时间排序
+
+        查询走 (state, submitted_at) 索引，不会扫描已完成的历史记录
+        """
+        sql = "SELECT * FROM jobs WHERE state = ? ORDER BY submitted_at"
+        args = (JOB_SUBMITTED,)
+        if limit is not None:
+            sql += " LIMIT ?"
+            args += (limit,)
+        with self._lock:
+            rows = self._conn.execute(sql, args).fetchall()
+        return [self._to_dict(row) for row in rows]
+
+    def expire(self, max_age):
+        """
+        将提交超过 max_age 秒仍未完成的任务标记为过期
+
+        返回:
+            被标记的任务数
+        """
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET state = ?, error = ?, updated_at = ?"
+                " WHERE state = ? AND submitted_at < ?",
+                (JOB_EXPIRED, "超过最长恢复时间", now, JOB_SUBMITTED, now - max_age),
+            )
+        return cursor.rowcount
+
+    def prune(self, older_than):
+        """
+        删除 older_than 秒之前更新过的已结束任务，控制数据库大小
+
+        返回:
+            删除的任务数
+        """
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM jobs WHERE state != ? AND updated_at < ?",
+                (JOB_SUBMITTED, time.time() - older_than),
+            )
+        return cursor.rowcount
+
+    def get_stats(self):
+        """返回各状态的任务数"""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT state, COUNT(*) FROM jobs GROUP BY state"
+            ).fetchall()
+        stats = dict.fromkeys(JOB_STATES, 0)
+        stats.update({state: count for state, count in rows})
+        return stats
+
+    def close(self):
+        """关闭数据库连接"""
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _to_dict(row):
+        job = {column: row[column] for column in _COLUMNS}
+        job["params"] = json.loads(job["params"])
+        return job
+
+
+def resume_jobs(editor, concurrency=4, max_age=24 * 3600, progress_callback=None):
+    """
+    收取任务库中所有未完成任务的结果
+
+    参数:
+        editor: 设置了 job_store 的 FluxKontextNativeMultiEditor
+        concurrency: 同时收取的任务数
+        max_age: 超过该秒数的任务不再轮询，直接标记为过期 (API只在有限时间内保留结果)
+        progress_callback: 传递给每个任务的进度回调函数
+
+    返回:
+        {"total", "completed", "failed", "pending", "expired", "seconds"}，
+        pending 为本次仍未收取到结果 (超时或下载失败) 的任务数
+    """
+    store = editor.job_store
+    if store is None:
+        raise ValueError("编辑器未配置 job_store")
+
+    expired = store.expire(max_age) if max_age else 0
+    if expired:
+        print(f"⌛ {expired} 个任务超过最长恢复时间，已标记为过期")
+
+    jobs = store.unfinished()
+    summary = {
+        "total": len(jobs),
+        "completed": 0,
+        "failed": 0,
+        "pending": 0,
+        "expired": expired,
+    }
+    if not jobs:
+        summary["seconds"] = 0.0
+        return summary
+
+    print(f"♻️ 继续收取 {len(jobs)} 个未完成任务")
+    if concurrency > 1:
+        editor.enable_batch_polling()
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(
+        max_workers=concurrency, thread_name_prefix="flux-resume"
+    ) as executor:
+        futures = {
+            executor.submit(editor.collect_job, job, progress_callback): job
+            for job in jobs
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            job = futures[future]
+            try:
+                output = future.result()
+            except Exception as e:
+                print(f"❌ 收取任务 {job['task_id']} 时出错: {str(e)}")
+                output = None
+            if output:
+                summary["completed"] += 1
+            elif store.get(job["task_id"])["state"] == JOB_FAILED:
+                summary["failed"] += 1
+            else:
+                summary["pending"] += 1
+            icon = "✅" if output else "❌"
+            print(f"{icon} [{done}/{len(jobs)}] {job['task_id']} {output or ''}")
+
+    summary["seconds"] = time.perf_counter() - started
+    return summary
@@ -0,0 +1,341 @@
+"""
+Flux Kontext 运行指标
+进程内的计数器、仪表和直方图，以 Prometheus 文本格式通过本地HTTP端口暴露
+
+    MetricsRegistry      - 指标注册表，render() 输出 Prometheus 文本格式
+    EditorMetrics        - 编辑器使用的标准指标；同时是 Tracer 的 sink，各阶段耗时直接来自追踪区间
+    start_metrics_server - 在后台线程提供 /metrics
+
+指标:
+    flux_jobs_submitted_total{model}         成功提交的任务数 (包括对冲请求)
+    flux_jobs_finished_total{model,outcome}  结束的编辑请求数，outcome 为 succeeded / failed
+    flux_jobs_in_flight                      正在提交或等待结果的任务数
+    flux_submit_requests_total{status}       提交请求数 (按响应状态码，含429重试)
+    flux_polls_total{status}                 状态查询数 (按响应状态码)
+    flux_upload_bytes_total                  请求体中的图片数据字节数
+    flux_download_bytes_total                下载的结果字节数
+    flux_stage_duration_seconds{stage}       各阶段耗时直方图 (阶段名称见 flux_kontext_tracing)
+
+热路径上每次更新只是一次字典查找加一次无竞争的加锁累加，开销见 benchmark.py metrics
+"""
+
+import bisect
+import http.server
+import threading
+
+DEFAULT_METRICS_PORT = 9464
+
+# 覆盖从几毫秒的预处理到几分钟的生成等待
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    120.0,
+    300.0,
+)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    """带标签的指标，labels() 返回按标签值缓存的子指标"""
+
+    type_name = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        if not self.labelnames:
+            self._default = self._children[()] = self._new_child()
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """返回对应标签值的子指标 (首次使用时创建)"""
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} 需要标签 {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(
+                    tuple(str(v) for v in values), self._new_child()
+                )
+                self._children[values] = child
+        return child
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.help}",
+            f"# TYPE {self.name} {self.type_name}",
+        ]
+        seen = set()
+        for values, child in list(self._children.items()):
+            if id(child) in seen:
+                continue
+            seen.add(id(child))
+            lines.extend(self._render_child(values, child))
+        return lines
+
+    def _render_child(self, values, child):
+        labels = _format_labels(self.labelnames, values)
+        return [f"{self.name}{labels} {_format_value(child.get())}"]
+
+
+class _Value:
+    __slots__ = ("_value", "_lock")
+
+    def __init__(self):
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self._value -= amount
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+    def get(self):
+        return self._value
+
+
+class Counter(_Metric):
+    """只增不减的计数器"""
+
+    type_name = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+
+class Gauge(_Metric):
+    """可增可减的当前值"""
+
+    type_name = "gauge"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self._default.inc(amount)
+
+    def dec(self, amount=1):
+        self._default.dec(amount)
+
+    def set(self, value):
+        self._default.set(value)
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "_lock")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+
+    def snapshot(self):
+        with self._lock:
+            return list(self.counts), self.sum
+
+
+class Histogram(_Metric):
+    """按固定区间统计分布的直方图"""
+
+    type_name = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self._default.observe(value)
+
+    def _render_child(self, values, child):
+        counts, total = child.snapshot()
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), counts):
+            cumulative += count
+            labels = _format_labels(
+                self.labelnames, values, f'le="{_format_value(bound)}"'
+            )
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, values)
+        lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """指标注册表"""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            elif not isinstance(metric, cls):
+                raise ValueError(f"指标 {name} 已注册为其他类型")
+            return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter, name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=()):
+        return self._register(Gauge, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help, labelnames, buckets=buckets)
+
+    def render(self):
+        """输出 Prometheus 文本格式 (0.0.4)"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+class EditorMetrics:
+    """
+    编辑器的标准指标
+
+    任务计数由编辑器直接调用；阶段耗时、提交和轮询次数来自追踪区间 (作为 Tracer 的 sink)，
+    同一个实例可以被多个编辑器共享，汇总整个进程的数据
+    """
+
+    def __init__(self, registry=None):
+        self.registry = registry or MetricsRegistry()
+        r = self.registry
+        self.jobs_submitted = r.counter(
+            "flux_jobs_submitted_total", "成功提交的任务数", ("model",)
+        )
+        self.jobs_finished = r.counter(
+            "flux_jobs_finished_total", "结束的编辑请求数", ("model", "outcome")
+        )
+        self.in_flight = r.gauge("flux_jobs_in_flight", "正在提交或等待结果的任务数")
+        self.submit_requests = r.counter(
+            "flux_submit_requests_total", "提交请求数", ("status",)
+        )
+        self.polls = r.counter("flux_polls_total", "状态查询数", ("status",))
+        self.upload_bytes = r.counter(
+            "flux_upload_bytes_total", "请求体中的图片数据字节数"
+        )
+        self.download_bytes = r.counter("flux_download_bytes_total", "下载的结果字节数")
+        self.stage_duration = r.histogram(
+            "flux_stage_duration_seconds", "各阶段耗时", ("stage",)
+        )
+
+    def job_submitted(self, model, upload_bytes=0):
+        self.jobs_submitted.labels(model).inc()
+        if upload_bytes:
+            self.upload_bytes.inc(upload_bytes)
+
+    def job_finished(self, model, ok):
+        self.jobs_finished.labels(model, "succeeded" if ok else "failed").inc()
+
+    def downloaded(self, nbytes):
+        self.download_bytes.inc(nbytes)
+
+    def emit(self, span):
+        """Tracer sink 接口"""
+        self.stage_duration.labels(span.name).observe(span.duration)
+        if span.name == "poll":
+            self.polls.labels(span.attrs.get("status", "error")).inc()
+        elif span.name == "submit":
+            self.submit_requests.labels(span.attrs.get("status", "error")).inc()
+
+    def close(self):
+        pass
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    registry = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/metrics", "/"):
+            self.send_error(404)
+            return
+        body = self.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(registry, port=DEFAULT_METRICS_PORT, addr="127.0.0.1"):
+    """
+    在后台线程提供 http://addr:port/metrics
+
+    返回:
+        ThreadingHTTPServer (调用 shutdown() 停止)
+
+    异常:
+        OSError: 端口已被占用
+    """
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    server = http.server.ThreadingHTTPServer((addr, port), handler)
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, name="flux-metrics", daemon=True
+    ).start()
+    return server
@@ -0,0 +1,67 @@
+"""
+Flux Kontext 模型注册表
+每个模型的API路径、输入限制和典型耗时集中在这里，提交、预处理和轮询都从注册表读取
+
+    flux-kontext-pro - 速度快、成本低，适合草稿和批量任务
+    flux-kontext-max - 质量更高、耗时更长，适合最终出图
+
+expected_latency 是提交到完成的典型秒数，只作为 ETA 轮询策略在没有样本时的先验估计，
+实际运行中会被观察到的完成时间取代
+"""
+
+from dataclasses import dataclass
+
+DEFAULT_MODEL = "flux-kontext-pro"
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    """一个模型的路由和限制"""
+
+    name: str
+    path: str
+    max_inputs: int = 4
+    max_input_size: int = 2048
+    expected_latency: float = 10.0
+    description: str = ""
+
+    def url(self, base_url):
+        """返回该模型在指定端点上的提交地址"""
+        return f"{base_url.rstrip('/')}{self.path}"
+
+
+MODEL_REGISTRY = {
+    spec.name: spec
+    for spec in (
+        ModelSpec(
+            "flux-kontext-pro",
+            "/v1/flux-kontext-pro",
+            expected_latency=8.0,
+            description="专业版 - 速度快、成本低",
+        ),
+        ModelSpec(
+            "flux-kontext-max",
+            "/v1/flux-kontext-max",
+            expected_latency=12.0,
+            description="旗舰版 - 质量更高、耗时更长",
+        ),
+    )
+}
+
+
+def get_model(name):
+    """
+    按名称查找模型
+
+    异常:
+        ValueError: 注册表中没有该模型
+    """
+    spec = MODEL_REGISTRY.get(name)
+    if spec is None:
+        raise ValueError(f"未知的模型: {name} (可用: {', '.join(MODEL_REGISTRY)})")
+    return spec
+
+
+def model_latency_priors():
+    """返回 {模型: 典型耗时秒数}，用作 ETA 轮询的先验"""
+    return {name: spec.expected_latency for name, spec in MODEL_REGISTRY.items()}
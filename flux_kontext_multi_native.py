@@ -5,6 +5,8 @@ Flux Kontext 原生多图片编辑器
 
 使用方法:
 python flux_kontext_multi_native.py --inputs image1.jpg image2.jpg image3.jpg --prompt "将这些人物融合成一张全家福" --output result.png
+python flux_kontext_multi_native.py batch jobs.jsonl --concurrency 8 --results results.jsonl
+python flux_kontext_multi_native.py resume   # 收取上次中断时仍未完成的任务
 
 依赖安装:
 pip install requests pillow numpy
@@ -13,14 +15,67 @@ pip install requests pillow numpy
 import requests
 from PIL import Image
 import io
+import multiprocessing
 import numpy as np
 import os
 import configparser
 import time
 import base64
 import argparse
+import shutil
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from enum import Enum
 from pathlib import Path
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+
+from flux_kontext_balancer import (
+    Endpoint,
+    EndpointBalancer,
+    balancer_settings_from_config,
+    endpoints_from_config,
+)
+from flux_kontext_batch import ManifestError, load_manifest, run_batch
+from flux_kontext_cache import PayloadCache, ResultCache
+from flux_kontext_hedging import HedgePolicy
+from flux_kontext_metrics import EditorMetrics, start_metrics_server
+from flux_kontext_models import DEFAULT_MODEL, MODEL_REGISTRY, get_model
+from flux_kontext_jobs import (
+    DEFAULT_JOB_DB,
+    JOB_COMPLETED,
+    JOB_FAILED,
+    JobStore,
+    resume_jobs,
+)
+from flux_kontext_ratelimit import (
+    get_shared_rate_limiter,
+    rate_limit_settings_from_config,
+)
+from flux_kontext_tracing import NULL_TRACER, JsonlSink, LatencyAggregator, Tracer
+from flux_kontext_polling import (
+    POLL_STRATEGIES,
+    BatchStatusPoller,
+    EtaAwarePolling,
+    create_poll_strategy,
+)
+
+# API接受的输入图片最大边长
+MAX_INPUT_SIZE = 2048
+
+# 预览缩略图的默认最大边长
+THUMBNAIL_SIZE = 384
+
+# 各上传格式下可以不经解码直接发送原始字节的源格式
+# (PNG 策略是无损的，原始JPEG与解码后重新编码为PNG的像素相同且更小)
+PASSTHROUGH_FORMATS = {"png": ("PNG", "JPEG"), "jpeg": ("JPEG",), "webp": ()}
+
+# EXIF 方向标签
+EXIF_ORIENTATION = 0x0112
+
+# 提交时计为端点故障的响应状态码 (密钥无效、持续限流、服务端错误)
+UNHEALTHY_STATUS_CODES = (401, 403, 429, 500, 502, 503, 504)
 
 
 class Status(Enum):
@@ -29,51 +84,530 @@ class Status(Enum):
     ERROR = "Error"
 
 
-class ConfigLoader:
-    """配置加载器 - 从config.ini读取API配置"""
+class EncodingPolicy:
+    """输入图片上传编码策略 - 在带宽和保真度之间取舍"""
+
+    FORMATS = ("png", "jpeg", "webp")
 
-    def __init__(self, config_path=None):
-        if config_path is None:
-            current_dir = os.path.dirname(os.path.abspath(__file__))
-            config_path = os.path.join(current_dir, "config.ini")
+    # 未指定质量时 JPEG/WebP 使用的质量
+    DEFAULT_QUALITY = 90
+
+    def __init__(
+        self,
+        format="png",
+        quality=None,
+        optimize=False,
+        compress_level=6,
+        max_bytes=None,
+        min_quality=40,
+        passthrough=True,
+    ):
+        """
+        参数:
+            format: 重新编码时使用的格式 ("png"、"jpeg" 或 "webp")
+            quality: JPEG/WebP 的质量 (1-100)，None 表示默认质量，
+                     此时JPEG策略下的JPEG输入可以直通
+            optimize: 是否启用编码器的额外优化 (更慢，文件更小)
+            compress_level: PNG 压缩等级 (0-9)
+            max_bytes: 编码后字节数目标，超出时对JPEG/WebP自动搜索更低的质量
+            min_quality: 自动搜索质量时的下限
+            passthrough: 无需缩放或转换、且源格式与上传格式一致的图片直接发送原始字节
+        """
+        if format not in self.FORMATS:
+            raise ValueError(f"不支持的上传格式: {format}")
+        self.format = format
+        self.quality = quality
+        self.optimize = optimize
+        self.compress_level = compress_level
+        self.max_bytes = max_bytes
+        self.min_quality = min_quality
+        self.passthrough = passthrough
+
+    @property
+    def lossy(self):
+        return self.format in ("jpeg", "webp")
+
+    def allows_passthrough(self, source_format):
+        """
+        源格式为 source_format 的原始字节是否符合本策略
 
-        if not os.path.exists(config_path):
-            raise FileNotFoundError(
-                f"配置文件未找到: {config_path}\n请创建config.ini文件并添加您的API密钥"
+        PNG 只在PNG (无损) 策略下直通；JPEG 在PNG策略或未指定质量的JPEG策略下直通。
+        其他情况 (如PNG输入、JPEG/WebP策略) 重新编码，使上传格式和质量设置生效
+        """
+        if (
+            not self.passthrough
+            or source_format not in PASSTHROUGH_FORMATS[self.format]
+        ):
+            return False
+        return self.format != "jpeg" or self.quality is None
+
+    def _save(self, image, quality):
+        buffered = io.BytesIO()
+        if self.format == "png":
+            image.save(
+                buffered,
+                format="PNG",
+                optimize=self.optimize,
+                compress_level=self.compress_level,
+            )
+        elif self.format == "jpeg":
+            image.save(buffered, format="JPEG", quality=quality, optimize=self.optimize)
+        else:
+            image.save(
+                buffered,
+                format="WEBP",
+                quality=quality,
+                method=6 if self.optimize else 4,
             )
+        return buffered.getvalue()
 
-        self.config = configparser.ConfigParser()
-        self.config.read(config_path, encoding="utf-8")
-        self.set_api_config()
+    def encode(self, image):
+        """
+        按策略编码图像
 
-    def set_api_config(self):
-        """设置API配置"""
-        try:
-            if not self.config.has_section("API"):
-                raise KeyError("配置文件中未找到 [API] 部分")
-
-            # 设置 X_KEY
-            if not self.config.has_option("API", "X_KEY"):
-                raise KeyError("配置文件中未找到 X_KEY")
-            x_key = self.config["API"]["X_KEY"]
-            if not x_key:
-                raise KeyError("X_KEY 不能为空")
-            os.environ["X_KEY"] = x_key
-
-            # 设置 BASE_URL
-            if self.config.has_option("API", "BASE_URL"):
-                base_url = self.config["API"]["BASE_URL"]
-                if base_url == "https://api.bfl.ml":
-                    print("⚠️  警告: api.bfl.ml 是文档站点，使用 api.bfl.ai 进行API调用")
-                    base_url = "https://api.bfl.ai"
-                elif not base_url.startswith("http"):
-                    base_url = f"https://{base_url}"
+        返回:
+            (编码后的字节, 实际使用的质量，PNG为None)
+        """
+        if not self.lossy:
+            return self._save(image, None), None
+
+        quality = self.quality or self.DEFAULT_QUALITY
+        data = self._save(image, quality)
+        if self.max_bytes is None or len(data) <= self.max_bytes:
+            return data, quality
+
+        # 二分搜索满足 max_bytes 的最高质量
+        best = None
+        low, high = self.min_quality, quality - 1
+        while low <= high:
+            quality = (low + high) // 2
+            candidate = self._save(image, quality)
+            if len(candidate) <= self.max_bytes:
+                best = (candidate, quality)
+                low = quality + 1
+            else:
+                high = quality - 1
+
+        if best is None:
+            # 即使最低质量也超出目标，使用最低质量的结果
+            return self._save(image, self.min_quality), self.min_quality
+        return best
+
+    def to_dict(self):
+        return {
+            "format": self.format,
+            "quality": self.quality,
+            "optimize": self.optimize,
+            "compress_level": self.compress_level,
+            "max_bytes": self.max_bytes,
+            "min_quality": self.min_quality,
+            "passthrough": self.passthrough,
+        }
+
+
+def read_image_source(source):
+    """
+    读取一个输入图片来源的原始字节
+
+    参数:
+        source: 文件路径 (str 或 os.PathLike)、bytes/bytearray/memoryview，
+                或具有 read() 的文件对象 (如 io.BytesIO、Streamlit 上传的文件)
+
+    返回:
+        (原始字节, 显示名称)
+    """
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as f:
+            return f.read(), os.path.basename(os.fspath(source))
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return bytes(source), "<bytes>"
+    if hasattr(source, "read"):
+        name = os.path.basename(str(getattr(source, "name", "") or "<stream>"))
+        if hasattr(source, "getvalue"):
+            # BytesIO 及其子类：不受读取位置影响，也不移动读取位置
+            return source.getvalue(), name
+        if hasattr(source, "seek"):
+            source.seek(0)
+        return source.read(), name
+    raise TypeError(f"不支持的图片输入类型: {type(source).__name__}")
+
+
+def _source_label(source):
+    """用于错误信息的输入图片描述"""
+    if isinstance(source, (str, os.PathLike)):
+        return os.fspath(source)
+    if isinstance(source, Image.Image):
+        return f"<PIL {source.mode} {source.width}x{source.height}>"
+    return str(getattr(source, "name", "") or f"<{type(source).__name__}>")
+
+
+def preprocess_image(source, policy=None, max_size=MAX_INPUT_SIZE, fast_resize=False):
+    """
+    读取、缩放并编码单张输入图片
+
+    source 可以是文件路径、原始字节、文件对象 (见 read_image_source) 或 PIL 图片。
+    PIL 图片没有原始字节，总是重新编码；传入的图片对象不会被修改。
+
+    Image.open 只解析文件头，因此可以在不完整解码的情况下判断格式、尺寸和模式。
+    对于已经是RGB、尺寸不超限、没有EXIF旋转且源格式符合上传策略的JPEG/PNG
+    (见 EncodingPolicy.allows_passthrough)，直接发送原始字节，省去解码和重新编码。
+
+    fast_resize 为 True 时，大尺寸JPEG先用 draft() 在DCT阶段按 1/2、1/4、1/8 缩小解码，
+    再用 reducing_gap 先整数倍 reduce() 后做最终的 LANCZOS 滤波，大幅降低耗时和峰值内存。
+
+    返回:
+        (base64字符串, 处理信息字典)，信息中的 timings 为各步骤 (read/decode/resize/encode) 的秒数
+    """
+    if policy is None:
+        policy = EncodingPolicy()
+
+    started = time.perf_counter()
+    timings = {}
+    if isinstance(source, Image.Image):
+        raw = None
+        image = source
+        name = "<PIL>"
+    else:
+        raw, name = read_image_source(source)
+        image = Image.open(io.BytesIO(raw))
+    timings["read"] = time.perf_counter() - started
+
+    info = {
+        "source": name,
+        "source_format": image.format,
+        "source_bytes": len(raw) if raw is not None else 0,
+        "format": image.format,
+        "size": image.size,
+        "passthrough": False,
+        "resized": False,
+        "quality": None,
+    }
+
+    if (
+        raw is not None
+        and policy.allows_passthrough(image.format)
+        and image.mode == "RGB"
+        and max(image.size) <= max_size
+        and image.getexif().get(EXIF_ORIENTATION, 1) == 1
+        and (policy.max_bytes is None or len(raw) <= policy.max_bytes)
+    ):
+        encoded = raw
+        info["passthrough"] = True
+    else:
+        new_size = None
+        if max(image.size) > max_size:
+            ratio = max_size / max(image.size)
+            new_size = (int(image.width * ratio), int(image.height * ratio))
+            if fast_resize and raw is not None and image.format == "JPEG":
+                # 必须在 convert/load 之前调用，让解码器直接输出缩小后的图像
+                image.draft("RGB", new_size)
+
+        step = time.perf_counter()
+        image.load()
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        timings["decode"] = time.perf_counter() - step
+
+        # 调整图片大小以符合API要求
+        if new_size is not None:
+            step = time.perf_counter()
+            if fast_resize:
+                image = image.resize(
+                    new_size, Image.Resampling.LANCZOS, reducing_gap=3.0
+                )
             else:
-                base_url = "https://api.bfl.ai"
+                image = image.resize(new_size, Image.Resampling.LANCZOS)
+            info["resized"] = True
+            info["size"] = new_size
+            timings["resize"] = time.perf_counter() - step
+
+        step = time.perf_counter()
+        encoded, info["quality"] = policy.encode(image)
+        info["format"] = policy.format.upper()
+        timings["encode"] = time.perf_counter() - step
+
+    step = time.perf_counter()
+    base64_str = base64.b64encode(encoded).decode("utf-8")
+    timings["encode"] = timings.get("encode", 0.0) + time.perf_counter() - step
+    info["bytes"] = len(encoded)
+    info["base64_chars"] = len(base64_str)
+    info["timings"] = timings
+    info["seconds"] = time.perf_counter() - started
+    return base64_str, info
+
+
+def make_thumbnail(source, max_size=THUMBNAIL_SIZE):
+    """
+    生成输入图片的预览缩略图
+
+    JPEG 用 draft() 在解码时直接缩小，大照片不需要完整解码。
+
+    参数:
+        source: 文件路径、原始字节或文件对象 (见 read_image_source)
+        max_size: 缩略图最大边长
+
+    返回:
+        缩略图的编码字节 (带透明通道时为PNG，否则为JPEG)
+    """
+    raw, _ = read_image_source(source)
+    image = Image.open(io.BytesIO(raw))
+    image.draft("RGB", (max_size, max_size))
+    image.thumbnail((max_size, max_size), Image.Resampling.LANCZOS)
+
+    buffer = io.BytesIO()
+    if image.mode in ("RGBA", "LA") or "transparency" in image.info:
+        image.convert("RGBA").save(buffer, format="PNG", optimize=True)
+    else:
+        image.convert("RGB").save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+
+class ImagePreprocessError(Exception):
+    """单张输入图片预处理失败"""
+
+    def __init__(self, index, cause):
+        super().__init__(f"图片 {index + 1}: {cause}")
+        self.index = index
+        self.cause = cause
+
+
+def preprocess_images(
+    paths,
+    policy=None,
+    executor=None,
+    on_complete=None,
+    fast_resize=False,
+    max_size=MAX_INPUT_SIZE,
+):
+    """
+    预处理多张输入图片
+
+    参数:
+        paths: 输入图片列表，每项为 preprocess_image 接受的来源
+               (使用进程池时需可序列化：路径、bytes 或 PIL 图片)
+        policy: 上传编码策略
+        executor: 可选的 concurrent.futures 执行器，提供时每张图片并行处理
+        on_complete: 每张图片完成时调用 on_complete(index, base64字符串, 处理信息)
+        fast_resize: 使用JPEG草稿解码和 reducing_gap 的快速缩放
+        max_size: 最大边长，超出时按比例缩小
+
+    返回:
+        与输入顺序一致的 (base64字符串, 处理信息) 列表
+
+    异常:
+        ImagePreprocessError: 任一图片失败时抛出，index 指向失败的图片
+    """
+    results = [None] * len(paths)
+
+    if executor is None:
+        for i, path in enumerate(paths):
+            try:
+                results[i] = preprocess_image(
+                    path, policy, max_size=max_size, fast_resize=fast_resize
+                )
+            except Exception as e:
+                raise ImagePreprocessError(i, e) from e
+            if on_complete:
+                on_complete(i, *results[i])
+        return results
+
+    futures = {
+        executor.submit(
+            preprocess_image, path, policy, max_size=max_size, fast_resize=fast_resize
+        ): i
+        for i, path in enumerate(paths)
+    }
+    try:
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                results[i] = future.result()
+            except Exception as e:
+                raise ImagePreprocessError(i, e) from e
+            if on_complete:
+                on_complete(i, *results[i])
+    finally:
+        for future in futures:
+            future.cancel()
+    return results
+
+
+def format_input_report(report):
+    """将每张输入图片的处理信息格式化为表格文本"""
+    lines = [
+        f"{'#':<3}{'来源':<24}{'格式':<14}{'尺寸':<12}{'质量':>6}"
+        f"{'原始(KB)':>10}{'上传(KB)':>10}{'耗时(ms)':>10}"
+    ]
+    for i, info in enumerate(report, 1):
+        fmt = f"{info['source_format']}->{'原样' if info['passthrough'] else info['format']}"
+        size = f"{info['size'][0]}x{info['size'][1]}"
+        quality = info["quality"] if info["quality"] is not None else "-"
+        lines.append(
+            f"{i:<3}{info['source'][:23]:<24}{fmt:<14}{size:<12}{quality:>6}"
+            f"{info['source_bytes'] / 1024:>10.1f}{info['base64_chars'] / 1024:>10.1f}"
+            f"{info['seconds'] * 1000:>10.1f}"
+        )
+    return "\n".join(lines)
+
+
+def detect_image_format(head, content_type=None):
+    """根据文件头 (优先) 或 Content-Type 判断图像格式，返回 png/jpeg/webp 或 None"""
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    if content_type:
+        subtype = content_type.split(";")[0].strip().lower()
+        return {
+            "image/png": "png",
+            "image/jpeg": "jpeg",
+            "image/jpg": "jpeg",
+            "image/webp": "webp",
+        }.get(subtype)
+    return None
+
+
+def _write_output(destination, write):
+    """
+    调用 write(f) 把结果写入目标，返回 write 的返回值
+
+    目标为文件对象时直接写入；为路径时先写入 {destination}.part，完成后再替换，
+    写入失败 (如下载中断) 时删除临时文件后重新抛出，不会留下不完整的输出
+    """
+    if hasattr(destination, "write"):
+        return write(destination)
+    part_path = f"{destination}.part"
+    try:
+        with open(part_path, "wb") as f:
+            result = write(f)
+        os.replace(part_path, destination)
+    except BaseException:
+        try:
+            os.remove(part_path)
+        except OSError:
+            pass
+        raise
+    return result
+
+
+def stream_download(
+    transport, url, destination, output_format, chunk_size=64 * 1024, timeout=30
+):
+    """
+    流式下载生成结果
+
+    服务端格式与 output_format 相同 (或无法识别) 时，响应按块直接写入目标，不经过PIL；
+    格式不同时才缓冲并解码转换。
+
+    参数:
+        transport: 提供 get(url, **kwargs) 的传输层
+        url: 结果图像地址
+        destination: 输出文件路径，或支持 write() 的文件对象
+        output_format: 期望的输出格式 ("png" 或 "jpeg")
+        chunk_size: 每次读取的字节数
+
+    返回:
+        {"bytes", "seconds", "served_format", "converted", "save_seconds"}，
+        save_seconds 为格式转换 (解码+重新编码+保存) 的耗时，直接写入时为0
+
+    异常:
+        requests.exceptions.RequestException: 下载失败
+    """
+    started = time.perf_counter()
+    target_format = (
+        "jpeg" if output_format.lower() in ("jpg", "jpeg") else output_format.lower()
+    )
+
+    with transport.get(url, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        chunks = response.iter_content(chunk_size=chunk_size)
+
+        # 读取足够识别格式的文件头
+        head = b""
+        for chunk in chunks:
+            head += chunk
+            if len(head) >= 12:
+                break
+
+        served_format = detect_image_format(head, response.headers.get("Content-Type"))
+        converted = served_format is not None and served_format != target_format
+
+        save_seconds = 0.0
+        if converted:
+            buffered = io.BytesIO(head)
+            buffered.seek(0, io.SEEK_END)
+            for chunk in chunks:
+                buffered.write(chunk)
+            total = buffered.tell()
+            buffered.seek(0)
+            step = time.perf_counter()
+            image = Image.open(buffered)
+            if target_format == "jpeg" and image.mode != "RGB":
+                image = image.convert("RGB")
+            _write_output(
+                destination, lambda f: image.save(f, format=target_format.upper())
+            )
+            save_seconds = time.perf_counter() - step
+        else:
+
+            def copy_chunks(f):
+                f.write(head)
+                written = len(head)
+                for chunk in chunks:
+                    f.write(chunk)
+                    written += len(chunk)
+                return written
+
+            total = _write_output(destination, copy_chunks)
+
+    return {
+        "bytes": total,
+        "seconds": time.perf_counter() - started,
+        "served_format": served_format,
+        "converted": converted,
+        "save_seconds": save_seconds,
+    }
+
+
+class ConfigLoader:
+    """配置加载器 - 从config.ini或内存中的配置字典读取API配置"""
+
+    def __init__(self, config_path=None, config=None):
+        """
+        参数:
+            config_path: 配置文件路径 (默认为本目录下的 config.ini)
+            config: 配置字典 {部分: {选项: 值}}，格式与 config.ini 相同，设置后不读取文件
+        """
+        self.config = configparser.ConfigParser()
+        if config is not None:
+            self.config.read_dict(config)
+        else:
+            if config_path is None:
+                current_dir = os.path.dirname(os.path.abspath(__file__))
+                config_path = os.path.join(current_dir, "config.ini")
+
+            if not os.path.exists(config_path):
+                raise FileNotFoundError(
+                    f"配置文件未找到: {config_path}\n请创建config.ini文件并添加您的API密钥"
+                )
+
+            self.config.read(config_path, encoding="utf-8")
+        self.endpoints = self.load_endpoints()
+        self.api_config = self.endpoints[0].api_config
 
-            os.environ["BASE_URL"] = base_url
-            print(f"🔗 API端点: {base_url}")
+    def load_endpoints(self):
+        """
+        读取 [API] 和 [ENDPOINT:*] 中的密钥和端点
+
+        配置只保存在本实例中并显式传递给编辑器，不写入进程环境变量
 
+        返回:
+            Endpoint 列表，第一个为默认成员
+        """
+        try:
+            endpoints = endpoints_from_config(self.config)
         except KeyError as e:
             print(f"❌ 配置错误: {str(e)}")
             print("请确保config.ini包含以下格式:")
@@ -82,50 +616,369 @@ class ConfigLoader:
             print("BASE_URL = https://api.bfl.ai")
             raise
 
+        for endpoint in endpoints:
+            print(f"🔗 API端点: {endpoint.base_url} ({endpoint.name})")
+        return endpoints
+
+    @classmethod
+    def from_dict(cls, sections=None, **api_options):
+        """
+        从内存中的配置创建，不读写任何文件
+
+        用法:
+            ConfigLoader.from_dict({"API": {"X_KEY": key}, "RATE_LIMIT": {...}})
+            ConfigLoader.from_dict(X_KEY=key, BASE_URL="https://api.bfl.ai")
+
+        参数:
+            sections: 配置字典 {部分: {选项: 值}}
+            api_options: [API] 部分的选项，与 sections 中的 [API] 合并
+        """
+        config = {name: dict(options) for name, options in (sections or {}).items()}
+        if api_options:
+            config.setdefault("API", {}).update(api_options)
+        return cls(config=config)
+
+    def create_balancer(self):
+        """根据 [API]、[ENDPOINT:*] 和 [BALANCER] 部分创建负载均衡器"""
+        return EndpointBalancer(
+            [endpoint.copy() for endpoint in self.endpoints],
+            **balancer_settings_from_config(self.config),
+        )
+
+    def get_rate_limit_settings(self):
+        """读取 [RATE_LIMIT] 部分的限流设置，未配置时返回空字典"""
+        return rate_limit_settings_from_config(self.config)
+
+
+class _ConnectCountingMixin:
+    """
+    统计实际建立的TCP连接数
+
+    urllib3 在服务端关闭连接后会复用同一个连接对象重新连接，num_connections 只统计连接对象的数量；
+    取出的连接处于关闭状态时，本次请求一定会新建连接
+    """
+
+    num_connects = 0
+
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+        if conn.is_closed:
+            self.num_connects += 1
+        return conn
+
+
+class _CountingHTTPConnectionPool(_ConnectCountingMixin, HTTPConnectionPool):
+    pass
+
+
+class _CountingHTTPSConnectionPool(_ConnectCountingMixin, HTTPSConnectionPool):
+    pass
+
+
+class _CountingHTTPAdapter(HTTPAdapter):
+    """为每个主机创建统计新建连接数的连接池"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _CountingHTTPConnectionPool,
+            "https": _CountingHTTPSConnectionPool,
+        }
+
+
+class PooledTransport:
+    """连接池化的HTTP传输层 - 提交、轮询和下载共享同一组keep-alive连接"""
+
+    def __init__(
+        self,
+        pool_connections=10,
+        pool_maxsize=10,
+        max_retries=3,
+        backoff_factor=0.5,
+        pool_block=False,
+        keep_alive=True,
+    ):
+        """
+        参数:
+            pool_connections: 缓存的主机连接池数量
+            pool_maxsize: 每个主机保留的最大连接数
+            max_retries: 连接错误及5xx响应的重试次数 (仅对GET生效，提交不会重复发送)
+            backoff_factor: 重试退避系数
+            pool_block: 连接池耗尽时是否阻塞等待空闲连接
+            keep_alive: 是否复用连接
+        """
+        retry = Retry(
+            total=max_retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET"}),
+            raise_on_status=False,
+        )
+        self.adapter = _CountingHTTPAdapter(
+            pool_connections=pool_connections,
+            pool_maxsize=pool_maxsize,
+            max_retries=retry,
+            pool_block=pool_block,
+        )
+        self.session = requests.Session()
+        self.session.mount("https://", self.adapter)
+        self.session.mount("http://", self.adapter)
+        if not keep_alive:
+            self.session.headers["Connection"] = "close"
+
+    def post(self, url, **kwargs):
+        return self.session.post(url, **kwargs)
+
+    def get(self, url, **kwargs):
+        return self.session.get(url, **kwargs)
+
+    def get_pool_stats(self):
+        """返回每个主机的请求数、新建连接数和连接复用率"""
+        pools = self.adapter.poolmanager.pools
+        hosts = {}
+        total_requests = 0
+        total_connections = 0
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            host = f"{pool.scheme}://{pool.host}:{pool.port}"
+            connections = getattr(pool, "num_connects", pool.num_connections)
+            reused = max(pool.num_requests - connections, 0)
+            hosts[host] = {
+                "requests": pool.num_requests,
+                "connections": connections,
+                "reuse_ratio": (
+                    reused / pool.num_requests if pool.num_requests else 0.0
+                ),
+            }
+            total_requests += pool.num_requests
+            total_connections += connections
+
+        total_reused = max(total_requests - total_connections, 0)
+        return {
+            "hosts": hosts,
+            "requests": total_requests,
+            "connections": total_connections,
+            "reuse_ratio": total_reused / total_requests if total_requests else 0.0,
+        }
+
+    def close(self):
+        self.session.close()
+
 
 class FluxKontextNativeMultiEditor:
     """Flux Kontext 原生多图片编辑器"""
 
-    def __init__(self, config_path=None):
-        """初始化编辑器"""
+    def __init__(
+        self,
+        config_path=None,
+        transport=None,
+        pool_connections=10,
+        pool_maxsize=10,
+        max_retries=3,
+        poll_strategy=None,
+        max_wait=460,
+        status_poller=None,
+        encoding_policy=None,
+        preprocess_workers=None,
+        fast_resize=False,
+        payload_cache=None,
+        result_cache=None,
+        streaming_download=True,
+        job_store=None,
+        rate_limiter=None,
+        balancer=None,
+        api_config=None,
+        hedge_policy=None,
+        tracer=None,
+        metrics=None,
+        config=None,
+    ):
+        """
+        初始化编辑器
+
+        参数:
+            config_path: 配置文件路径
+            transport: 自定义传输层 (默认创建 PooledTransport)
+            pool_connections: 缓存的主机连接池数量
+            pool_maxsize: 每个主机的最大连接数
+            max_retries: 轮询/下载的重试次数
+            poll_strategy: 轮询间隔策略 (默认 EtaAwarePolling)
+            max_wait: 单个任务的最长等待秒数
+            status_poller: 共享的 BatchStatusPoller，设置后由其集中轮询任务状态
+            encoding_policy: 输入图片上传编码策略 (默认 EncodingPolicy())
+            preprocess_workers: 图片预处理进程数，大于1时多张图片并行解码/缩放/编码
+                                (工作进程以 spawn 方式启动，调用方脚本需要 if __name__ == "__main__" 保护)
+            fast_resize: 大图使用JPEG草稿解码 + reducing_gap 快速缩放
+            payload_cache: 预处理结果缓存 (PayloadCache)，重复提交相同图片时跳过预处理
+            result_cache: 生成结果缓存 (ResultCache)，固定种子 (seed >= 0) 的相同请求不再调用API
+            streaming_download: 结果分块直接写入输出，格式一致时不经过PIL解码/重新编码
+            job_store: 持久化任务记录 (JobStore)，提交后立即记录，进程退出后可用 resume 收取结果
+            rate_limiter: 客户端限流器 (默认按 config.ini 的 [RATE_LIMIT] 获取进程内共享实例)
+            balancer: 多密钥/端点负载均衡器 (默认按 config.ini 的 [API]、[ENDPOINT:*] 创建)
+            api_config: 直接指定的 ApiConfig，设置后不读取配置文件
+            hedge_policy: 对冲策略 (HedgePolicy)，设置后耗时过长的任务会再提交一次，使用先完成的结果
+            tracer: 各阶段耗时追踪 (Tracer)，默认不记录
+            metrics: 运行指标 (EditorMetrics)，设置后同时作为 tracer 的 sink 统计各阶段耗时
+            config: 配置字典 {部分: {选项: 值}}，格式与 config.ini 相同，设置后不读取配置文件
+        """
+        self.tracer = tracer or NULL_TRACER
+        self.metrics = metrics
+        if metrics is not None and metrics not in self.tracer.sinks:
+            if self.tracer is NULL_TRACER:
+                self.tracer = Tracer()
+            self.tracer.add_sink(metrics)
         try:
-            self.config_loader = ConfigLoader(config_path)
+            if api_config is not None:
+                self.config_loader = None
+                self.balancer = balancer or EndpointBalancer(
+                    [Endpoint("default", api_config)]
+                )
+                rate_limit_settings = {}
+            else:
+                with self.tracer.span("config_load"):
+                    self.config_loader = ConfigLoader(config_path, config=config)
+                self.balancer = balancer or self.config_loader.create_balancer()
+                rate_limit_settings = self.config_loader.get_rate_limit_settings()
+            # 默认成员的配置，每个编辑器实例独立持有
+            self.api_config = self.balancer.default.api_config
+            self.transport = transport or PooledTransport(
+                pool_connections=pool_connections,
+                pool_maxsize=pool_maxsize,
+                max_retries=max_retries,
+            )
+            self.poll_strategy = poll_strategy or EtaAwarePolling()
+            self.max_wait = max_wait
+            self.status_poller = status_poller
+            self._owns_status_poller = False
+            self.encoding_policy = encoding_policy or EncodingPolicy()
+            self.last_input_report = []
+            self.preprocess_workers = preprocess_workers
+            # 在启动轮询、批量等工作线程之前创建进程池
+            self._preprocess_executor = self._create_preprocess_executor()
+            self.fast_resize = fast_resize
+            self.payload_cache = payload_cache
+            self.result_cache = result_cache
+            self.streaming_download = streaming_download
+            self.last_download_stats = None
+            self.job_store = job_store
+            self.hedge_policy = hedge_policy
+            # 服务端按密钥限流，因此只在使用相同密钥的编辑器之间共享限流器
+            self.rate_limiter = rate_limiter or get_shared_rate_limiter(
+                scope=self.api_config.key_id, **rate_limit_settings
+            )
             print("✅ Flux Kontext 原生多图片编辑器初始化成功")
         except Exception as e:
             print(f"❌ 初始化失败: {str(e)}")
             raise
 
+    def get_pool_stats(self):
+        """获取连接池统计信息"""
+        return self.transport.get_pool_stats()
+
+    def enable_batch_polling(self, interval=1.0, max_workers=4):
+        """
+        创建使用本编辑器连接池的集中轮询服务
+
+        多线程并发调用 edit_multi_images_native 时，所有任务由同一个调度线程轮询，
+        每个任务的检查时间由本编辑器的轮询策略决定，状态请求记录在本编辑器的追踪中
+
+        参数:
+            interval: 结果等待的超时余量 (秒)
+            max_workers: 并发发送状态请求的线程数
+        """
+        if self.status_poller is None:
+            self.status_poller = BatchStatusPoller(
+                self.transport,
+                interval=interval,
+                max_workers=max_workers,
+                max_wait=self.max_wait,
+                rate_limiter=self.rate_limiter,
+                poll_strategy=self.poll_strategy,
+                tracer=self.tracer,
+            )
+            self._owns_status_poller = True
+        return self.status_poller
+
+    def close(self):
+        """关闭连接池"""
+        if self._owns_status_poller:
+            self.status_poller.close()
+        if self._preprocess_executor is not None:
+            self._preprocess_executor.shutdown(wait=False, cancel_futures=True)
+        self.transport.close()
+
     def edit_multi_images_native(
         self,
         image_paths,
         edit_instruction,
         output_path=None,
-        model="flux-kontext-pro",
+        model=DEFAULT_MODEL,
         aspect_ratio="1:1",
         output_format="png",
         safety_tolerance=2,  # 降低安全等级，减少过度保守的生成
         seed=-1,  # 使用随机种子，避免固定模式
         prompt_upsampling=False,
         progress_callback=None,
+        use_result_cache=True,
     ):
         """
         使用API原生多图片支持进行编辑
 
         参数:
-            image_paths: 输入图像路径列表 (最多4张)
+            image_paths: 输入图片列表 (数量上限由模型决定)，每项可以是文件路径、
+                         bytes、文件对象或 PIL 图片，网页等调用方无需写临时文件
             edit_instruction: 编辑指令文本
             output_path: 输出图像路径 (可选)
-            model: 模型选择 ("flux-kontext-pro" 或 "flux-kontext-max")
+            model: 模型名称，见 MODEL_REGISTRY ("flux-kontext-pro" 或 "flux-kontext-max")
             aspect_ratio: 宽高比
             output_format: 输出格式 ("png" 或 "jpeg")
             safety_tolerance: 安全等级 (0-6)
             seed: 随机种子 (-1为随机)
             prompt_upsampling: 是否启用提示词增强
             progress_callback: 进度回调函数
+            use_result_cache: 为 False 时本次请求不查询也不写入结果缓存 (强制重新生成)
 
         返回:
             成功时返回输出路径，失败时返回None
         """
+        with self.tracer.span(
+            "edit", model=model, inputs=len(image_paths or [])
+        ) as span:
+            output = self._edit_multi_images_native(
+                image_paths,
+                edit_instruction,
+                output_path,
+                model,
+                aspect_ratio,
+                output_format,
+                safety_tolerance,
+                seed,
+                prompt_upsampling,
+                progress_callback,
+                use_result_cache,
+            )
+            span.set(ok=output is not None)
+        if self.metrics is not None:
+            self.metrics.job_finished(model, output is not None)
+        return output
+
+    def _edit_multi_images_native(
+        self,
+        image_paths,
+        edit_instruction,
+        output_path,
+        model,
+        aspect_ratio,
+        output_format,
+        safety_tolerance,
+        seed,
+        prompt_upsampling,
+        progress_callback,
+        use_result_cache,
+    ):
+        """edit_multi_images_native 的实现，参数含义相同"""
         print(f"🎨 开始原生多图片编辑")
         print(f"📝 编辑指令: {edit_instruction}")
         print(f"🤖 使用模型: {model}")
@@ -147,174 +1000,165 @@ class FluxKontextNativeMultiEditor:
         #         progress_callback("❌ 没有提供输入图片", 0, 100)
         #     return None
 
-        if image_paths is not None and len(image_paths) > 4:
-            print("⚠️  API最多支持4张图片，将使用前4张")
-            if progress_callback:
-                progress_callback("⚠️ API最多支持4张图片，将使用前4张", 10, 100)
-            image_paths = image_paths[:4]
-
         try:
-            # 将图片转换为base64
+            spec = get_model(model)
+        except ValueError as e:
+            print(f"❌ {str(e)}")
             if progress_callback:
-                progress_callback("🔄 正在处理图片...", 20, 100)
-
-            if image_paths is None:
-                image_paths = []
-
-            # 初始化 base64_images 列表
-            base64_images = []
-
-            if len(image_paths) > 0:
-                for i, path in enumerate(image_paths):
-                    if not os.path.exists(path):
-                        print(f"❌ 图片文件不存在: {path}")
-                        if progress_callback:
-                            progress_callback(f"❌ 图片文件不存在: {path}", 20, 100)
-                        return None
+                progress_callback(f"❌ {str(e)}", 0, 100)
+            return None
 
-                    try:
-                        image = Image.open(path)
-                        if image.mode != "RGB":
-                            image = image.convert("RGB")
-
-                        # 调整图片大小以符合API要求
-                        max_size = 2048
-                        if max(image.size) > max_size:
-                            ratio = max_size / max(image.size)
-                            new_size = (
-                                int(image.width * ratio),
-                                int(image.height * ratio),
-                            )
-                            image = image.resize(new_size, Image.Resampling.LANCZOS)
-                            print(f"📏 图片 {i+1} 已调整大小: {new_size}")
-
-                        base64_str = self.pil_to_base64(image)
-                        if not base64_str:
-                            print(f"❌ 图片 {i+1} 编码失败")
-                            if progress_callback:
-                                progress_callback(f"❌ 图片 {i+1} 编码失败", 20, 100)
-                            return None
-
-                        base64_images.append(base64_str)
-                        print(f"✅ 图片 {i+1} 处理完成")
-                        if progress_callback:
-                            progress_callback(
-                                f"✅ 图片 {i+1} 处理完成", 20 + (i + 1) * 10, 100
-                            )
+        if image_paths is not None and len(image_paths) > spec.max_inputs:
+            message = (
+                f"{model} 最多支持{spec.max_inputs}张图片，将使用前{spec.max_inputs}张"
+            )
+            print(f"⚠️  {message}")
+            if progress_callback:
+                progress_callback(f"⚠️ {message}", 10, 100)
+            image_paths = image_paths[: spec.max_inputs]
 
-                    except Exception as e:
-                        print(f"❌ 处理图片 {i+1} 时出错: {str(e)}")
-                        if progress_callback:
-                            progress_callback(
-                                f"❌ 处理图片 {i+1} 时出错: {str(e)}", 20, 100
-                            )
-                        return None
+        try:
+            with self.tracer.span("preprocess", images=len(image_paths or [])):
+                base64_images = self.prepare_input_images(
+                    image_paths, progress_callback, max_size=spec.max_input_size
+                )
+            if base64_images is None:
+                return None
 
             # 构建API请求
             if progress_callback:
                 progress_callback("🚀 正在发送请求到AI服务器...", 60, 100)
 
-            base_url = os.environ.get("BASE_URL", "https://api.bfl.ai")
-            url = f"{base_url}/v1/flux-kontext-pro"
-
-            payload = {
-                "prompt": edit_instruction,
-                "aspect_ratio": aspect_ratio,
-                "safety_tolerance": safety_tolerance,
-                "output_format": output_format,
-                "prompt_upsampling": prompt_upsampling,
-            }
-
-            if len(base64_images) > 0:
-                payload["input_image"] = base64_images[0]
-
-            # 添加额外的图片
-            if len(base64_images) > 1:
-                payload["input_image_2"] = base64_images[1]
-            if len(base64_images) > 2:
-                payload["input_image_3"] = base64_images[2]
-            if len(base64_images) > 3:
-                payload["input_image_4"] = base64_images[3]
-
-            if seed >= 0:
-                payload["seed"] = seed
+            with self.tracer.span("build_payload"):
+                payload = self.build_payload(
+                    edit_instruction,
+                    base64_images,
+                    aspect_ratio=aspect_ratio,
+                    output_format=output_format,
+                    safety_tolerance=safety_tolerance,
+                    seed=seed,
+                    prompt_upsampling=prompt_upsampling,
+                )
 
-            # 发送请求
-            x_key = os.environ.get("X_KEY")
-            if not x_key:
-                print("❌ API密钥未找到，请检查config.ini")
-                if progress_callback:
-                    progress_callback("❌ API密钥未找到", 60, 100)
-                return None
+            # 固定种子的相同请求直接使用缓存结果
+            cache_key = self._result_cache_key(model, payload, seed, use_result_cache)
+            cached_output = self._restore_cached_result(
+                cache_key, output_path, output_format, progress_callback
+            )
+            if cached_output is not None:
+                return cached_output
 
-            headers = {"x-key": x_key, "Content-Type": "application/json"}
+            # 限制同时进行中的任务数，名额在结果保存或失败后释放
+            with self.tracer.span("slot_wait"):
+                if not self.rate_limiter.acquire_slot(blocking=False):
+                    print("⏳ 进行中的任务已达上限，等待空闲名额...")
+                    if progress_callback:
+                        progress_callback("⏳ 进行中的任务已达上限，排队中...", 60, 100)
+                    self.rate_limiter.acquire_slot()
+            if self.metrics is not None:
+                self.metrics.in_flight.inc()
 
-            # 发送请求
-            print(f"🚀 发送原生多图片请求到: {url}")
-            print(
-                f"📊 请求包含 {len([k for k in payload.keys() if k.startswith('input_image')])} 张图片"
-            )
+            # 选择提交使用的密钥/端点，该任务之后的轮询固定使用同一密钥
+            endpoint = self.balancer.acquire()
+            try:
+                url = spec.url(endpoint.base_url)
+                headers = {"x-key": endpoint.x_key, "Content-Type": "application/json"}
 
-            response = requests.post(url, json=payload, headers=headers, timeout=60)
-            print(f"📡 响应状态: {response.status_code}")
+                # 发送请求
+                print(f"🚀 发送原生多图片请求到: {url} (端点: {endpoint.name})")
+                print(
+                    f"📊 请求包含 {len([k for k in payload.keys() if k.startswith('input_image')])} 张图片"
+                )
 
-            # 处理响应
-            if response.status_code == 200:
-                response_data = response.json()
-                task_id = response_data.get("id")
-                polling_url = response_data.get("polling_url")
-                print(f"🔄 轮询URL: {polling_url}")
+                response = self._submit(
+                    endpoint, url, payload, headers, progress_callback
+                )
+                print(f"📡 响应状态: {response.status_code}")
+
+                # 处理响应
+                if response.status_code == 200:
+                    response_data = response.json()
+                    task_id = response_data.get("id")
+                    polling_url = response_data.get("polling_url")
+                    print(f"🔄 轮询URL: {polling_url}")
+
+                    if not task_id:
+                        print("❌ 未收到任务ID")
+                        print(f"响应内容: {response_data}")
+                        if progress_callback:
+                            progress_callback("❌ 未收到任务ID", 60, 100)
+                        return None
 
-                if not task_id:
-                    print("❌ 未收到任务ID")
-                    print(f"响应内容: {response_data}")
+                    print(f"🆔 任务ID: {task_id}")
+                    if self.metrics is not None:
+                        self.metrics.job_submitted(
+                            model, sum(len(image) for image in base64_images)
+                        )
                     if progress_callback:
-                        progress_callback("❌ 未收到任务ID", 60, 100)
-                    return None
+                        progress_callback(
+                            f"✅ 任务已提交 (ID: {task_id[:8]}...)", 70, 100
+                        )
 
-                print(f"🆔 任务ID: {task_id}")
-                if progress_callback:
-                    progress_callback(f"✅ 任务已提交 (ID: {task_id[:8]}...)", 70, 100)
+                    if output_path is None:
+                        output_path = self._default_output_path(output_format, task_id)
+
+                    # 开始轮询之前记录任务，进程中断后仍可收取结果
+                    self._record_job(
+                        task_id,
+                        polling_url,
+                        model,
+                        payload,
+                        output_path,
+                        output_format,
+                        len(base64_images),
+                        endpoint.name,
+                    )
 
-                # 等待结果
-                result_image = self.wait_for_result(
-                    polling_url, progress_callback=progress_callback
-                )
+                    # 等待结果
+                    if self.hedge_policy is not None:
+                        with self.tracer.span("queue_wait", hedged=True):
+                            ready = self._wait_hedged(
+                                {
+                                    "task_id": task_id,
+                                    "polling_url": polling_url,
+                                    "endpoint": endpoint,
+                                },
+                                spec,
+                                payload,
+                                poll_context=(model, len(base64_images)),
+                                progress_callback=progress_callback,
+                            )
+                    else:
+                        ready = self.wait_for_ready(
+                            polling_url,
+                            progress_callback=progress_callback,
+                            poll_context=(model, len(base64_images)),
+                            job_id=task_id,
+                            x_key=endpoint.x_key,
+                        )
 
-                if result_image is not None:
-                    # 保存结果
-                    if output_path is None:
-                        # 自动生成输出路径
-                        output_path = (
-                            f"native_multi_edited_{int(time.time())}.{output_format}"
+                    if ready is not None and self._save_sample(
+                        ready, output_path, output_format, progress_callback
+                    ):
+                        return self._finish_job(
+                            task_id, output_path, cache_key, progress_callback
                         )
+                    else:
+                        print("❌ 图像生成失败")
+                        if progress_callback:
+                            progress_callback("❌ 图像生成失败", 100, 100)
+                        return None
 
-                    result_image.save(output_path, format=output_format.upper())
-                    print(f"✅  完成! 保存到: {output_path}")
-                    if progress_callback:
-                        progress_callback("🎉 图片编辑完成！", 100, 100)
-                    return output_path
                 else:
-                    print("❌ 图像生成失败")
-                    if progress_callback:
-                        progress_callback("❌ 图像生成失败", 100, 100)
+                    self._report_submit_failure(
+                        response.status_code, response.text, progress_callback
+                    )
                     return None
-
-            elif response.status_code == 400:
-                print(f"❌ 请求参数错误: {response.text}")
-                if progress_callback:
-                    progress_callback(f"❌ 请求参数错误: {response.text}", 60, 100)
-                return None
-            elif response.status_code == 401:
-                print("❌ API密钥无效，请检查config.ini中的X_KEY")
-                if progress_callback:
-                    progress_callback("❌ API密钥无效", 60, 100)
-                return None
-            else:
-                print(f"❌ 请求失败: {response.status_code} - {response.text}")
-                if progress_callback:
-                    progress_callback(f"❌ 请求失败: {response.status_code}", 60, 100)
-                return None
+            finally:
+                self.balancer.release(endpoint)
+                self.rate_limiter.release_slot()
+                if self.metrics is not None:
+                    self.metrics.in_flight.dec()
 
         except requests.exceptions.Timeout:
             print("❌ 请求超时，请重试")
@@ -332,128 +1176,415 @@ class FluxKontextNativeMultiEditor:
                 progress_callback(f"❌ 意外错误: {str(e)}", 60, 100)
             return None
 
-    def pil_to_base64(self, pil_image):
-        """将PIL图像转换为base64字符串"""
-        try:
-            buffered = io.BytesIO()
-            pil_image.save(buffered, format="PNG")
-            img_base64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
-            print(f"🔄 图像已编码: {len(img_base64)} 字符")
-            return img_base64
-        except Exception as e:
-            print(f"❌ 图像编码错误: {str(e)}")
-            return None
+    def _report_submit_failure(self, status_code, text, progress_callback=None):
+        """报告提交失败的响应 (同步和异步编辑器共用)"""
+        if status_code == 400:
+            print(f"❌ 请求参数错误: {text}")
+            if progress_callback:
+                progress_callback(f"❌ 请求参数错误: {text}", 60, 100)
+        elif status_code == 401:
+            print("❌ API密钥无效，请检查config.ini中的X_KEY")
+            if progress_callback:
+                progress_callback("❌ API密钥无效", 60, 100)
+        elif status_code == 429:
+            print(f"❌ 请求被限流，已重试 {self.rate_limiter.max_retries} 次: {text}")
+            if progress_callback:
+                progress_callback("❌ 请求被限流，请稍后重试", 60, 100)
+        else:
+            print(f"❌ 请求失败: {status_code} - {text}")
+            if progress_callback:
+                progress_callback(f"❌ 请求失败: {status_code}", 60, 100)
 
-    def wait_for_result(self, polling_url, max_attempts=30, progress_callback=None):
-        """等待API处理结果"""
-        print(f"⏳ 等待处理结果: {polling_url}")
+    @staticmethod
+    def _default_output_path(output_format, task_id=None):
+        """未指定输出路径时使用的文件名，包含任务ID前缀以免并发任务互相覆盖"""
+        suffix = f"_{task_id[:8]}" if task_id else ""
+        return f"native_multi_edited_{int(time.time())}{suffix}.{output_format}"
 
-        if progress_callback:
-            progress_callback("🚀 任务已提交，开始处理...", 0, max_attempts)
+    def _submit(self, endpoint, url, payload, headers, progress_callback=None):
+        """
+        提交任务，按限流器的速率发送，收到429时按 Retry-After 退避后重试；
+        结果反馈给负载均衡器用于健康跟踪
 
-        for attempt in range(1, max_attempts + 1):
+        返回:
+            最后一次响应 (重试次数用尽时仍为429响应)
+        """
+        for attempt in range(self.rate_limiter.max_retries + 1):
+            self.rate_limiter.acquire_submit()
             try:
-                # 渐进式等待时间 - 多图片处理可能需要更长时间
-                wait_time = min(3 + attempt, 20)
-
-                if progress_callback:
-                    progress_callback(
-                        f"🔄 检查进度 {attempt}/{max_attempts} - 等待 {wait_time}秒",
-                        attempt,
-                        max_attempts,
+                with self.tracer.span(
+                    "submit", endpoint=endpoint.name, attempt=attempt
+                ) as span:
+                    response = self.transport.post(
+                        url, json=payload, headers=headers, timeout=60
                     )
+                    span.set(status=response.status_code)
+            except requests.exceptions.RequestException:
+                self.balancer.report_failure(endpoint)
+                raise
+
+            if response.status_code != 429 or attempt == self.rate_limiter.max_retries:
+                if response.status_code in UNHEALTHY_STATUS_CODES:
+                    self.balancer.report_failure(endpoint)
+                elif response.status_code == 200:
+                    self.balancer.report_success(endpoint)
+                return response
+
+            delay = self.rate_limiter.retry_delay(response, attempt)
+            print(f"⏳ 请求被限流 (429)，{delay:.1f}秒后重试")
+            if progress_callback:
+                progress_callback(f"⏳ 请求被限流，{delay:.1f}秒后重试...", 60, 100)
+            time.sleep(self.rate_limiter.throttled("submit", delay))
+        return response
 
-                print(f"🔄 尝试 {attempt}/{max_attempts} - 等待 {wait_time}秒")
-                time.sleep(wait_time)
+    def prepare_input_images(
+        self, image_paths, progress_callback=None, max_size=MAX_INPUT_SIZE
+    ):
+        """
+        读取、缩放并编码输入图片
 
-                # 检查任务状态
-                headers = {"x-key": os.environ["X_KEY"]}
-                print(f"🔄 检查任务状态: {polling_url}")
+        参数:
+            image_paths: 输入图片列表，每项可以是文件路径、bytes、文件对象或 PIL 图片
+            progress_callback: 进度回调函数
+            max_size: 最大边长 (由所选模型决定)
 
-                response = requests.get(polling_url, headers=headers, timeout=30)
+        返回:
+            base64字符串列表，任一图片失败时返回None
+        """
+        if progress_callback:
+            progress_callback("🔄 正在处理图片...", 20, 100)
 
-                if response.status_code != 200:
-                    print(f"⚠️  状态检查失败: {response.status_code}")
-                    if progress_callback:
-                        progress_callback(
-                            f"⚠️ 状态检查失败，重试中... ({response.status_code})",
-                            attempt,
-                            max_attempts,
-                        )
-                    continue
+        if image_paths is None:
+            image_paths = []
 
-                result = response.json()
-                status = result.get("status", "Unknown")
-                print(f"📊 状态: {status}")
+        for path in image_paths:
+            if isinstance(path, (str, os.PathLike)) and not os.path.exists(path):
+                print(f"❌ 图片文件不存在: {path}")
+                if progress_callback:
+                    progress_callback(f"❌ 图片文件不存在: {path}", 20, 100)
+                return None
 
-                if status == Status.READY.value:
-                    # 图像已准备好
-                    if progress_callback:
-                        progress_callback(
-                            "✅ 图像生成完成，正在下载...", max_attempts, max_attempts
-                        )
+        # 文件对象在这里读成字节 (可以发送到预处理进程，也用于计算缓存键)；
+        # 路径留给预处理步骤读取，多张图片时在各进程中并行读取
+        sources = []
+        for i, source in enumerate(image_paths):
+            if isinstance(source, (str, os.PathLike, Image.Image)):
+                sources.append(source)
+                continue
+            try:
+                sources.append(read_image_source(source)[0])
+            except (OSError, TypeError) as e:
+                print(f"❌ 读取图片 {i+1} ({_source_label(source)}) 时出错: {str(e)}")
+                if progress_callback:
+                    progress_callback(f"❌ 读取图片 {i+1} 时出错: {str(e)}", 20, 100)
+                return None
 
-                    sample_url = result.get("result", {}).get("sample")
-                    if not sample_url:
-                        print("❌ 响应中没有图像URL")
-                        if progress_callback:
-                            progress_callback(
-                                "❌ 响应中没有图像URL", attempt, max_attempts
-                            )
-                        return None
+        results = [None] * len(image_paths)
+        cache_keys = [None] * len(image_paths)
+        completed = []
+
+        def on_complete(i, base64_str, info):
+            if not isinstance(image_paths[i], (str, os.PathLike)):
+                # 已读成字节的来源在报告中仍显示原来的名称
+                info["source"] = os.path.basename(_source_label(image_paths[i]))
+            if info.get("cached"):
+                print(f"♻️ 图片 {i+1} 命中预处理缓存")
+            elif info["passthrough"]:
+                print(f"⚡ 图片 {i+1} 无需转换，直接发送原始{info['format']}数据")
+            elif info["resized"]:
+                print(f"📏 图片 {i+1} 已调整大小: {info['size']}")
+            print(f"🔄 图像已编码: {len(base64_str)} 字符")
+            print(f"✅ 图片 {i+1} 处理完成")
+            completed.append(i)
+            if progress_callback:
+                progress_callback(
+                    f"✅ 图片 {i+1} 处理完成", 20 + len(completed) * 10, 100
+                )
 
-                    # 下载图像
-                    print(f"⬇️  下载图像: {sample_url}")
-                    if progress_callback:
-                        progress_callback(
-                            "⬇️ 正在下载生成的图像...", max_attempts, max_attempts
-                        )
+        # 先查找预处理缓存，只处理未命中的图片 (PIL 图片没有原始字节，不使用缓存)
+        if self.payload_cache is not None:
+            params = self._preprocess_params(max_size)
+            for i, source in enumerate(sources):
+                if isinstance(source, Image.Image):
+                    continue
+                if isinstance(source, bytes):
+                    raw = source
+                else:
+                    with open(source, "rb") as f:
+                        raw = f.read()
+                cache_keys[i] = PayloadCache.make_key(raw, params)
+                hit = self.payload_cache.get(cache_keys[i])
+                if hit is not None:
+                    results[i] = (hit[0], dict(hit[1], cached=True, seconds=0.0))
+                    on_complete(i, *results[i])
 
-                    img_response = requests.get(sample_url, timeout=30)
+        pending = [i for i, result in enumerate(results) if result is None]
 
-                    if img_response.status_code == 200:
-                        image = Image.open(io.BytesIO(img_response.content))
-                        print("✅ 图像下载成功")
-                        if progress_callback:
-                            progress_callback(
-                                "🎉 图像处理完成！", max_attempts, max_attempts
-                            )
-                        return image
-                    else:
-                        print(f"❌ 图像下载失败: {img_response.status_code}")
-                        if progress_callback:
-                            progress_callback(
-                                f"❌ 图像下载失败: {img_response.status_code}",
-                                attempt,
-                                max_attempts,
-                            )
-                        return None
+        # 多张图片时分发到进程池并行处理
+        executor = self._preprocess_executor if len(pending) > 1 else None
 
-                elif status == Status.ERROR.value:
-                    error_msg = result.get("error", "未知错误")
-                    print(f"❌ 处理失败: {error_msg}")
-                    if progress_callback:
-                        progress_callback(
-                            f"❌ 处理失败: {error_msg}", attempt, max_attempts
-                        )
-                    return None
+        try:
+            processed = preprocess_images(
+                [sources[i] for i in pending],
+                self.encoding_policy,
+                executor=executor,
+                on_complete=lambda j, *result: on_complete(pending[j], *result),
+                fast_resize=self.fast_resize,
+                max_size=max_size,
+            )
+        except ImagePreprocessError as e:
+            index = pending[e.index]
+            print(f"❌ 处理图片 {index+1} 时出错: {str(e.cause)}")
+            if progress_callback:
+                progress_callback(
+                    f"❌ 处理图片 {index+1} 时出错: {str(e.cause)}", 20, 100
+                )
+            return None
+
+        for i, result in zip(pending, processed):
+            results[i] = result
+            for step, seconds in result[1].get("timings", {}).items():
+                self.tracer.record(f"image.{step}", seconds, index=i)
+            if self.payload_cache is not None and cache_keys[i] is not None:
+                self.payload_cache.put(cache_keys[i], *result)
+
+        self.last_input_report = [info for _, info in results]
+        return [base64_str for base64_str, _ in results]
+
+    def _preprocess_params(self, max_size=MAX_INPUT_SIZE):
+        """影响预处理结果的全部参数，作为预处理缓存键的一部分"""
+        return {
+            "policy": self.encoding_policy.to_dict(),
+            "max_size": max_size,
+            "fast_resize": self.fast_resize,
+        }
+
+    def _create_preprocess_executor(self):
+        """
+        创建图片预处理进程池 (preprocess_workers 不大于1时返回None)
+
+        工作进程使用 spawn 启动：编辑器运行时还有轮询线程、批量线程池、指标服务等线程，
+        在多线程进程中 fork 可能继承其他线程持有的锁而死锁。spawn 启动较慢，
+        因此创建后立即启动全部工作进程，与读取配置和提交请求重叠
+        """
+        if not self.preprocess_workers or self.preprocess_workers <= 1:
+            return None
+        executor = ProcessPoolExecutor(
+            max_workers=self.preprocess_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+        for _ in range(self.preprocess_workers):
+            executor.submit(int)
+        return executor
+
+    def build_payload(
+        self,
+        edit_instruction,
+        base64_images,
+        aspect_ratio="1:1",
+        output_format="png",
+        safety_tolerance=2,
+        seed=-1,
+        prompt_upsampling=False,
+    ):
+        """构建API请求体"""
+        payload = {
+            "prompt": edit_instruction,
+            "aspect_ratio": aspect_ratio,
+            "safety_tolerance": safety_tolerance,
+            "output_format": output_format,
+            "prompt_upsampling": prompt_upsampling,
+        }
+
+        if len(base64_images) > 0:
+            payload["input_image"] = base64_images[0]
+
+        # 添加额外的图片
+        if len(base64_images) > 1:
+            payload["input_image_2"] = base64_images[1]
+        if len(base64_images) > 2:
+            payload["input_image_3"] = base64_images[2]
+        if len(base64_images) > 3:
+            payload["input_image_4"] = base64_images[3]
+
+        if seed >= 0:
+            payload["seed"] = seed
+
+        return payload
+
+    def pil_to_base64(self, pil_image):
+        """将PIL图像转换为base64字符串"""
+        try:
+            buffered = io.BytesIO()
+            pil_image.save(buffered, format="PNG")
+            img_base64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
+            print(f"🔄 图像已编码: {len(img_base64)} 字符")
+            return img_base64
+        except Exception as e:
+            print(f"❌ 图像编码错误: {str(e)}")
+            return None
+
+    def wait_for_result(
+        self,
+        polling_url,
+        max_attempts=120,
+        progress_callback=None,
+        poll_context=None,
+        max_wait=None,
+    ):
+        """
+        等待API处理结果并下载为PIL图像
+
+        参数与 wait_for_ready 相同
+
+        返回:
+            PIL.Image，失败时返回None
+        """
+        result = self.wait_for_ready(
+            polling_url,
+            max_attempts=max_attempts,
+            progress_callback=progress_callback,
+            poll_context=poll_context,
+            max_wait=max_wait,
+        )
+        if result is None:
+            return None
+        return self._download_sample(result, progress_callback, 100, 100)
+
+    def wait_for_ready(
+        self,
+        polling_url,
+        max_attempts=120,
+        progress_callback=None,
+        poll_context=None,
+        max_wait=None,
+        job_id=None,
+        x_key=None,
+    ):
+        """
+        轮询任务状态直到完成
+
+        参数:
+            polling_url: 任务轮询地址
+            max_attempts: 最大状态检查次数
+            progress_callback: 进度回调函数
+            poll_context: 传递给轮询策略的任务上下文，如 (model, input_count)
+            max_wait: 最长等待秒数 (默认使用编辑器的 max_wait)
+            job_id: 任务记录中的任务ID，API返回处理失败时更新其状态
+            x_key: 提交该任务的API密钥 (默认使用第一个端点的密钥)
+
+        返回:
+            状态为 Ready 的响应字典，失败或超时时返回None
+        """
+        with self.tracer.span("queue_wait") as span:
+            result = self._wait_for_ready(
+                polling_url,
+                max_attempts,
+                progress_callback,
+                poll_context,
+                max_wait,
+                job_id,
+                x_key,
+            )
+            span.set(ok=result is not None)
+            return result
+
+    def _wait_for_ready(
+        self,
+        polling_url,
+        max_attempts,
+        progress_callback,
+        poll_context,
+        max_wait,
+        job_id,
+        x_key,
+    ):
+        """wait_for_ready 的实现，参数含义相同"""
+        print(f"⏳ 等待处理结果: {polling_url}")
+
+        if max_wait is None:
+            max_wait = self.max_wait
+
+        if x_key is None:
+            x_key = self.balancer.default.x_key
 
-                elif status == Status.PENDING.value:
+        if progress_callback:
+            progress_callback("🚀 任务已提交，开始处理...", 0, max_attempts)
+
+        if self.status_poller is not None:
+            return self._wait_with_status_poller(
+                polling_url, max_wait, progress_callback, job_id, x_key, poll_context
+            )
+
+        started = time.monotonic()
+
+        for attempt in range(1, max_attempts + 1):
+            try:
+                # 由轮询策略决定等待时间 - 首次快速探测，之后按策略退避
+                elapsed = time.monotonic() - started
+                wait_time = self.poll_strategy.next_interval(
+                    attempt, elapsed, poll_context
+                )
+                if elapsed + wait_time > max_wait:
+                    break
+
+                if progress_callback:
+                    progress_callback(
+                        f"🔄 检查进度 {attempt}/{max_attempts} - 等待 {wait_time:.1f}秒",
+                        attempt,
+                        max_attempts,
+                    )
+
+                print(f"🔄 尝试 {attempt}/{max_attempts} - 等待 {wait_time:.1f}秒")
+                time.sleep(wait_time)
+
+                # 检查任务状态
+                headers = {"x-key": x_key}
+                print(f"🔄 检查任务状态: {polling_url}")
+
+                self.rate_limiter.acquire_poll()
+                with self.tracer.span("poll", attempt=attempt) as span:
+                    response = self.transport.get(
+                        polling_url, headers=headers, timeout=30
+                    )
+                    span.set(status=response.status_code)
+
+                if response.status_code == 429:
+                    delay = self.rate_limiter.retry_delay(response, 0)
+                    print(f"⏳ 状态检查被限流 (429)，{delay:.1f}秒后继续")
                     if progress_callback:
                         progress_callback(
-                            f"⏳ 正在处理中... ({attempt}/{max_attempts})",
+                            f"⏳ 状态检查被限流，{delay:.1f}秒后继续...",
                             attempt,
                             max_attempts,
                         )
-                    print("⏳ 仍在处理中...")
-                else:
+                    time.sleep(self.rate_limiter.throttled("poll", delay))
+                    continue
+
+                if response.status_code != 200:
+                    print(f"⚠️  状态检查失败: {response.status_code}")
                     if progress_callback:
                         progress_callback(
-                            f"📊 状态: {status} ({attempt}/{max_attempts})",
+                            f"⚠️ 状态检查失败，重试中... ({response.status_code})",
                             attempt,
                             max_attempts,
                         )
-                    print(f"📊 未知状态: {status}")
+                    continue
+
+                result = response.json()
+                status = self._interpret_status(
+                    result,
+                    started,
+                    poll_context,
+                    job_id,
+                    progress_callback,
+                    attempt,
+                    max_attempts,
+                )
+                if status == Status.READY:
+                    return result
+                if status == Status.ERROR:
+                    return None
 
             except requests.exceptions.Timeout:
                 print(f"⏰ 请求超时 (尝试 {attempt}/{max_attempts})")
@@ -484,6 +1615,528 @@ class FluxKontextNativeMultiEditor:
             progress_callback("❌ 处理超时，请重试", max_attempts, max_attempts)
         return None
 
+    def _wait_with_status_poller(
+        self,
+        polling_url,
+        max_wait,
+        progress_callback=None,
+        job_id=None,
+        x_key=None,
+        poll_context=None,
+    ):
+        """通过集中轮询服务等待任务完成，不在当前线程中逐个轮询"""
+        started = time.monotonic()
+        future = self.status_poller.register(
+            polling_url, x_key, max_wait=max_wait, context=poll_context
+        )
+        try:
+            result = future.result(timeout=max_wait + self.status_poller.interval)
+        except Exception as e:
+            self.status_poller.unregister(polling_url)
+            print(f"❌ 等待结果失败: {str(e)}")
+            if progress_callback:
+                progress_callback("❌ 处理超时，请重试", 100, 100)
+            return None
+
+        # 集中轮询服务只在 Ready/Error 时完成 future
+        status = self._interpret_status(
+            result, started, poll_context, job_id, progress_callback
+        )
+        return result if status == Status.READY else None
+
+    def _interpret_status(
+        self,
+        result,
+        started,
+        poll_context=None,
+        job_id=None,
+        progress_callback=None,
+        attempt=100,
+        max_attempts=100,
+    ):
+        """
+        处理一次状态查询的响应 (同步和异步编辑器共用)
+
+        Ready 时把提交以来的实际耗时反馈给轮询策略，Error 时把任务记录标记为失败
+
+        参数:
+            result: 状态响应字典
+            started: 开始等待的 time.monotonic() 时间
+            poll_context: 传递给轮询策略的任务上下文
+            job_id: 任务记录中的任务ID
+            progress_callback: 进度回调函数
+            attempt / max_attempts: 当前检查次数和上限 (用于进度显示)
+
+        返回:
+            Status.READY、Status.ERROR，其余状态 (处理中或未知) 返回 Status.PENDING
+        """
+        status = result.get("status", "Unknown")
+        print(f"📊 状态: {status}")
+
+        if status == Status.READY.value:
+            # 图像已准备好
+            self.poll_strategy.record(poll_context, time.monotonic() - started)
+            if progress_callback:
+                progress_callback(
+                    "✅ 图像生成完成，正在下载...", max_attempts, max_attempts
+                )
+            return Status.READY
+
+        if status == Status.ERROR.value:
+            error_msg = result.get("error", "未知错误")
+            print(f"❌ 处理失败: {error_msg}")
+            self._update_job(job_id, JOB_FAILED, error=str(error_msg))
+            if progress_callback:
+                progress_callback(f"❌ 处理失败: {error_msg}", attempt, max_attempts)
+            return Status.ERROR
+
+        if status == Status.PENDING.value:
+            if progress_callback:
+                progress_callback(
+                    f"⏳ 正在处理中... ({attempt}/{max_attempts})",
+                    attempt,
+                    max_attempts,
+                )
+            print("⏳ 仍在处理中...")
+        else:
+            if progress_callback:
+                progress_callback(
+                    f"📊 状态: {status} ({attempt}/{max_attempts})",
+                    attempt,
+                    max_attempts,
+                )
+            print(f"📊 未知状态: {status}")
+        return Status.PENDING
+
+    def _wait_hedged(
+        self, primary, spec, payload, poll_context=None, progress_callback=None
+    ):
+        """
+        对冲等待：任务耗时超过 hedge_policy 给出的延迟仍未完成时，再提交一个相同的请求，
+        在当前线程中轮询两个任务，使用先完成的结果
+
+        落后的任务不再轮询 (API不支持取消)。对冲请求不写入任务记录，
+        进程中断后 resume 只收取原始任务
+
+        参数:
+            primary: 已提交的任务 {"task_id", "polling_url", "endpoint"}
+            spec: 模型的 ModelSpec，对冲请求提交到同一模型
+            payload: 原始请求体
+            poll_context: 任务上下文，如 (model, input_count)
+            progress_callback: 进度回调函数
+
+        返回:
+            状态为 Ready 的响应字典，全部失败或超时时返回None
+        """
+        policy = self.hedge_policy
+        started = time.monotonic()
+        hedge_delay = policy.begin(poll_context)
+        tasks = [dict(primary, started=started, attempt=0)]
+        for task in tasks:
+            task["next_poll"] = started + self.poll_strategy.next_interval(
+                1, 0.0, poll_context
+            )
+        hedge = None
+        deadline = started + self.max_wait
+        print(f"⏳ 等待处理结果: {primary['polling_url']}")
+        if hedge_delay is not None:
+            print(f"🪁 超过 {hedge_delay:.1f}秒 未完成时将对冲提交")
+
+        try:
+            while tasks:
+                now = time.monotonic()
+                if hedge_delay is not None and now - started >= hedge_delay:
+                    hedge_delay = None
+                    hedge = self._submit_hedge(spec, payload, progress_callback)
+                    if hedge is not None:
+                        hedge["next_poll"] = now + self.poll_strategy.next_interval(
+                            1, 0.0, poll_context
+                        )
+                        tasks.append(hedge)
+
+                task = min(tasks, key=lambda t: t["next_poll"])
+                wake = task["next_poll"]
+                if hedge_delay is not None:
+                    wake = min(wake, started + hedge_delay)
+                if wake > deadline:
+                    break
+                if wake > now:
+                    time.sleep(wake - now)
+                    continue
+
+                task["attempt"] += 1
+                result = self._poll_status(task["polling_url"], task["endpoint"].x_key)
+                now = time.monotonic()
+                task["next_poll"] = now + self.poll_strategy.next_interval(
+                    task["attempt"] + 1, now - task["started"], poll_context
+                )
+                if result is None:
+                    continue
+
+                status = result.get("status", "Unknown")
+                if status == Status.READY.value:
+                    # 按原始任务的提交时间计 (用户实际等待的时间)，
+                    # 对冲请求自己的耗时偏短，会拉低决定对冲延迟的分位数
+                    duration = now - started
+                    self.poll_strategy.record(poll_context, duration)
+                    policy.record(poll_context, duration, hedge_won=task is hedge)
+                    if task is hedge:
+                        print(f"🪁 对冲请求先完成: {hedge['task_id']}")
+                    if progress_callback:
+                        progress_callback("✅ 图像生成完成，正在下载...", 100, 100)
+                    return result
+
+                if status == Status.ERROR.value:
+                    error_msg = result.get("error", "未知错误")
+                    print(f"❌ 处理失败 ({task['task_id']}): {error_msg}")
+                    tasks.remove(task)
+                    if task is not hedge:
+                        self._update_job(
+                            task["task_id"], JOB_FAILED, error=str(error_msg)
+                        )
+                    if not tasks and progress_callback:
+                        progress_callback(f"❌ 处理失败: {error_msg}", 100, 100)
+                    continue
+
+                if progress_callback:
+                    progress_callback(
+                        f"⏳ 正在处理中... ({now - started:.0f}秒)",
+                        min(now - started, self.max_wait),
+                        self.max_wait,
+                    )
+        finally:
+            if hedge is not None:
+                self._release_hedge(hedge)
+
+        if tasks:
+            print("❌ 达到最长等待时间，处理失败")
+            if progress_callback:
+                progress_callback("❌ 处理超时，请重试", 100, 100)
+        return None
+
+    def _submit_hedge(self, spec, payload, progress_callback=None):
+        """
+        在预算允许且有空闲名额时提交对冲请求 (由负载均衡器选择端点，可能与原始任务不同)
+
+        对冲请求和原始任务一样占用一个名额，直到 _release_hedge 释放，
+        因此开启对冲后实际进行中的任务数仍不超过 max_in_flight
+
+        返回:
+            {"task_id", "polling_url", "endpoint", "started", "attempt"}，未提交时返回None
+        """
+        if not self.rate_limiter.acquire_slot(blocking=False):
+            print("🪁 进行中的任务已达上限，不提交对冲请求")
+            return None
+        if not self.hedge_policy.try_hedge():
+            self.rate_limiter.release_slot()
+            print("🪁 对冲预算已用完，继续等待原始任务")
+            return None
+        if self.metrics is not None:
+            self.metrics.in_flight.inc()
+
+        endpoint = self.balancer.acquire()
+        headers = {"x-key": endpoint.x_key, "Content-Type": "application/json"}
+        try:
+            response = self._submit(
+                endpoint, spec.url(endpoint.base_url), payload, headers
+            )
+            data = response.json() if response.status_code == 200 else {}
+        except (requests.exceptions.RequestException, ValueError) as e:
+            print(f"⚠️  对冲请求失败: {str(e)}")
+            data = {}
+        if not data.get("id") or not data.get("polling_url"):
+            self._release_hedge({"endpoint": endpoint})
+            self.hedge_policy.hedge_failed()
+            return None
+
+        print(f"🪁 已对冲提交: {data['id']} (端点: {endpoint.name})")
+        if self.metrics is not None:
+            self.metrics.job_submitted(
+                spec.name,
+                sum(
+                    len(value)
+                    for key, value in payload.items()
+                    if key.startswith("input_image")
+                ),
+            )
+        if progress_callback:
+            progress_callback("🪁 任务耗时较长，已提交对冲请求...", 80, 100)
+        return {
+            "task_id": data["id"],
+            "polling_url": data["polling_url"],
+            "endpoint": endpoint,
+            "started": time.monotonic(),
+            "attempt": 0,
+        }
+
+    def _release_hedge(self, hedge):
+        """释放对冲请求占用的端点和进行中任务名额"""
+        self.balancer.release(hedge["endpoint"])
+        self.rate_limiter.release_slot()
+        if self.metrics is not None:
+            self.metrics.in_flight.dec()
+
+    def _poll_status(self, polling_url, x_key):
+        """
+        检查一次任务状态
+
+        返回:
+            状态响应字典，请求失败或被限流时返回None
+        """
+        self.rate_limiter.acquire_poll()
+        try:
+            with self.tracer.span("poll") as span:
+                response = self.transport.get(
+                    polling_url, headers={"x-key": x_key}, timeout=30
+                )
+                span.set(status=response.status_code)
+        except requests.exceptions.RequestException as e:
+            print(f"🌐 状态检查出错: {str(e)}")
+            return None
+        if response.status_code == 429:
+            delay = self.rate_limiter.retry_delay(response, 0)
+            print(f"⏳ 状态检查被限流 (429)，{delay:.1f}秒后继续")
+            time.sleep(self.rate_limiter.throttled("poll", delay))
+            return None
+        if response.status_code != 200:
+            print(f"⚠️  状态检查失败: {response.status_code}")
+            return None
+        try:
+            return response.json()
+        except ValueError:
+            return None
+
+    def collect_job(self, job, progress_callback=None):
+        """
+        收取任务记录中一个已提交任务的结果
+
+        参数:
+            job: JobStore 返回的任务字典
+            progress_callback: 进度回调函数
+
+        返回:
+            成功时返回输出路径，失败或仍未完成时返回None
+        """
+        task_id = job["task_id"]
+        output_path = job["output_path"] or self._default_output_path(
+            job["output_format"], task_id
+        )
+        print(f"♻️ 继续收取任务: {task_id}")
+
+        # 轮询必须使用提交该任务的密钥
+        endpoint = self.balancer.get(job.get("endpoint") or "default")
+        if endpoint is None:
+            endpoint = self.balancer.default
+            print(
+                f"⚠️  配置中已没有端点 {job['endpoint']}，"
+                f"改用 {endpoint.name} 的密钥轮询"
+            )
+
+        ready = self.wait_for_ready(
+            job["polling_url"],
+            progress_callback=progress_callback,
+            poll_context=(job["model"], job["input_count"]),
+            job_id=task_id,
+            x_key=endpoint.x_key,
+        )
+        if ready is None or not self._save_sample(
+            ready, output_path, job["output_format"], progress_callback
+        ):
+            return None
+
+        self._update_job(task_id, JOB_COMPLETED, output_path=output_path)
+        print(f"✅  完成! 保存到: {output_path}")
+        return output_path
+
+    def _record_job(
+        self,
+        task_id,
+        polling_url,
+        model,
+        payload,
+        output_path,
+        output_format,
+        count,
+        endpoint=None,
+    ):
+        """记录已提交的任务 (未配置 job_store 时忽略)，请求体中的图片数据不会保存"""
+        if self.job_store is None:
+            return
+        params = {
+            key: value
+            for key, value in payload.items()
+            if not key.startswith("input_image")
+        }
+        try:
+            self.job_store.add(
+                task_id,
+                polling_url,
+                model,
+                params,
+                (
+                    os.path.abspath(output_path)
+                    if isinstance(output_path, (str, Path))
+                    else None
+                ),
+                output_format,
+                input_count=count,
+                endpoint=endpoint,
+            )
+        except Exception as e:
+            print(f"⚠️  记录任务失败: {str(e)}")
+
+    def _result_cache_key(self, model, payload, seed, use_result_cache=True):
+        """固定种子 (seed >= 0) 且启用了结果缓存时返回请求的缓存键，否则返回None"""
+        if not use_result_cache or self.result_cache is None or seed < 0:
+            return None
+        return ResultCache.make_key(model, payload)
+
+    def _restore_cached_result(
+        self, cache_key, output_path, output_format, progress_callback=None
+    ):
+        """
+        命中结果缓存时把缓存的结果写入输出路径或文件对象
+
+        返回:
+            命中时返回输出路径，未命中 (或 cache_key 为None) 时返回None
+        """
+        if cache_key is None:
+            return None
+        cached_path = self.result_cache.get(cache_key)
+        if cached_path is None:
+            return None
+
+        if output_path is None:
+            output_path = self._default_output_path(output_format)
+        try:
+            if isinstance(output_path, (str, Path)):
+                shutil.copyfile(cached_path, output_path)
+            else:
+                # 输出为文件对象 (内存中保存结果)
+                with open(cached_path, "rb") as cached_file:
+                    shutil.copyfileobj(cached_file, output_path)
+        except OSError as e:
+            # 复制在缓存锁之外进行，其间缓存文件可能已被其他线程淘汰，按未命中处理
+            print(f"⚠️  读取缓存结果失败，重新生成: {str(e)}")
+            self.result_cache.invalidate(cache_key)
+            return None
+        print(f"♻️ 命中结果缓存，保存到: {output_path}")
+        if progress_callback:
+            progress_callback("♻️ 命中结果缓存，图片编辑完成！", 100, 100)
+        return output_path
+
+    def _finish_job(self, task_id, output_path, cache_key=None, progress_callback=None):
+        """
+        结果保存成功后更新任务记录，并把结果写入结果缓存 (cache_key 不为None时)
+
+        返回:
+            输出路径
+        """
+        self._update_job(task_id, JOB_COMPLETED)
+        if cache_key is not None and isinstance(output_path, (str, Path)):
+            self.result_cache.put(cache_key, output_path)
+        print(f"✅  完成! 保存到: {output_path}")
+        if progress_callback:
+            progress_callback("🎉 图片编辑完成！", 100, 100)
+        return output_path
+
+    def _update_job(self, job_id, state, error=None, output_path=None):
+        """更新任务记录 (未配置 job_store 时忽略)"""
+        if self.job_store is None or job_id is None:
+            return
+        try:
+            self.job_store.update(job_id, state, error=error, output_path=output_path)
+        except Exception as e:
+            print(f"⚠️  更新任务记录失败: {str(e)}")
+
+    def _save_sample(self, result, destination, output_format, progress_callback=None):
+        """
+        将 Ready 响应中的生成图像保存到输出路径或文件对象
+
+        流式下载模式下直接把响应分块写入目标，只有服务端格式与请求格式不同时才解码转换；
+        否则沿用下载为PIL图像再保存的方式
+
+        返回:
+            成功时返回True
+        """
+        if not self.streaming_download:
+            with self.tracer.span("download"):
+                image = self._download_sample(result, progress_callback, 100, 100)
+            if image is None:
+                return False
+            with self.tracer.span("save"):
+                image.save(destination, format=output_format.upper())
+            return True
+
+        sample_url = result.get("result", {}).get("sample")
+        if not sample_url:
+            print("❌ 响应中没有图像URL")
+            if progress_callback:
+                progress_callback("❌ 响应中没有图像URL", 100, 100)
+            return False
+
+        print(f"⬇️  流式下载图像: {sample_url}")
+        if progress_callback:
+            progress_callback("⬇️ 正在下载生成的图像...", 100, 100)
+
+        try:
+            with self.tracer.span("download", streaming=True) as span:
+                stats = stream_download(
+                    self.transport, sample_url, destination, output_format
+                )
+                span.set(bytes=stats["bytes"], converted=stats["converted"])
+            if stats["converted"]:
+                self.tracer.record("save", stats["save_seconds"])
+            if self.metrics is not None:
+                self.metrics.downloaded(stats["bytes"])
+        except requests.exceptions.RequestException as e:
+            print(f"❌ 图像下载失败: {str(e)}")
+            if progress_callback:
+                progress_callback(f"❌ 图像下载失败: {str(e)}", 100, 100)
+            return False
+
+        self.last_download_stats = stats
+        print(
+            f"✅ 图像下载成功: {stats['bytes'] / 1024:.1f} KB, "
+            f"{stats['seconds'] * 1000:.0f} ms"
+            + (f", 已从 {stats['served_format']} 转换" if stats["converted"] else "")
+        )
+        return True
+
+    def _download_sample(self, result, progress_callback, attempt, max_attempts):
+        """从 Ready 状态响应中下载生成的图像"""
+        sample_url = result.get("result", {}).get("sample")
+        if not sample_url:
+            print("❌ 响应中没有图像URL")
+            if progress_callback:
+                progress_callback("❌ 响应中没有图像URL", attempt, max_attempts)
+            return None
+
+        # 下载图像
+        print(f"⬇️  下载图像: {sample_url}")
+        if progress_callback:
+            progress_callback("⬇️ 正在下载生成的图像...", max_attempts, max_attempts)
+
+        img_response = self.transport.get(sample_url, timeout=30)
+
+        if img_response.status_code == 200:
+            if self.metrics is not None:
+                self.metrics.downloaded(len(img_response.content))
+            image = Image.open(io.BytesIO(img_response.content))
+            print("✅ 图像下载成功")
+            if progress_callback:
+                progress_callback("🎉 图像处理完成！", max_attempts, max_attempts)
+            return image
+        else:
+            print(f"❌ 图像下载失败: {img_response.status_code}")
+            if progress_callback:
+                progress_callback(
+                    f"❌ 图像下载失败: {img_response.status_code}",
+                    attempt,
+                    max_attempts,
+                )
+            return None
+
 
 def create_sample_config():
     """创建示例配置文件"""
@@ -491,6 +2144,25 @@ def create_sample_config():
 # 从 https://api.bfl.ai 获取您的API密钥
 X_KEY = 在此输入您的API密钥
 BASE_URL = https://api.bfl.ai
+
+# 额外的密钥/端点 (可选)，提交按权重在所有成员之间分配
+# [ENDPOINT:backup]
+# X_KEY = 第二个API密钥
+# BASE_URL = https://api.bfl.ai
+# WEIGHT = 1
+#
+# [BALANCER]
+# strategy = least_in_flight
+# failure_threshold = 3
+# cooldown = 30
+
+# 客户端限流 (可选)，同一进程中的所有编辑器共享
+# [RATE_LIMIT]
+# submit_per_second = 2
+# poll_per_second = 10
+# burst = 4
+# max_in_flight = 24
+# max_retries = 5
 """
 
     with open("config.ini", "w", encoding="utf-8") as f:
@@ -500,8 +2172,325 @@ BASE_URL = https://api.bfl.ai
     print("请编辑此文件并添加您的API密钥")
 
 
+def add_editor_arguments(parser):
+    """添加单任务和批量模式共用的编辑器参数"""
+    parser.add_argument(
+        "--poll-strategy",
+        choices=list(POLL_STRATEGIES),
+        default="eta",
+        help="轮询间隔策略",
+    )
+    parser.add_argument(
+        "--upload-format",
+        choices=EncodingPolicy.FORMATS,
+        default="png",
+        help="输入图片需要重新编码时使用的格式",
+    )
+    parser.add_argument(
+        "--upload-quality",
+        type=int,
+        help="JPEG/WebP 上传质量 (1-100，默认90；指定后JPEG输入也重新编码)",
+    )
+    parser.add_argument(
+        "--upload-max-bytes",
+        type=int,
+        help="每张输入图片编码后的字节数目标 (JPEG/WebP 自动降低质量)",
+    )
+    parser.add_argument(
+        "--png-compress-level",
+        type=int,
+        choices=range(0, 10),
+        default=6,
+        help="PNG 压缩等级 (0-9)",
+    )
+    parser.add_argument(
+        "--upload-optimize", action="store_true", help="启用编码器额外优化"
+    )
+    parser.add_argument(
+        "--no-passthrough",
+        action="store_true",
+        help="总是重新编码输入图片，不直接发送原始字节",
+    )
+    parser.add_argument(
+        "--upload-report", action="store_true", help="打印每张输入图片的编码报告"
+    )
+    parser.add_argument(
+        "--fast-resize",
+        action="store_true",
+        help="大尺寸JPEG使用草稿解码和 reducing_gap 快速缩放",
+    )
+    parser.add_argument(
+        "--payload-cache-dir",
+        help="预处理结果磁盘缓存目录，重复使用相同输入图片时跳过预处理",
+    )
+    parser.add_argument(
+        "--clear-payload-cache",
+        action="store_true",
+        help="运行前清空预处理缓存",
+    )
+    parser.add_argument(
+        "--result-cache-dir",
+        help="生成结果缓存目录，固定种子 (--seed >= 0) 的相同请求直接返回缓存结果",
+    )
+    parser.add_argument(
+        "--result-cache-ttl",
+        type=float,
+        default=7 * 24,
+        help="结果缓存有效期 (小时)",
+    )
+    parser.add_argument(
+        "--no-streaming-download",
+        action="store_true",
+        help="下载结果后用PIL重新编码保存 (旧行为)",
+    )
+    parser.add_argument(
+        "--job-db",
+        default=DEFAULT_JOB_DB,
+        help="任务记录数据库，提交后立即记录任务，中断后可用 resume 子命令收取结果",
+    )
+    parser.add_argument("--no-job-db", action="store_true", help="不记录已提交的任务")
+    parser.add_argument(
+        "--hedge-percentile",
+        type=float,
+        help="启用对冲提交：任务耗时超过历史该分位数 (如 95) 时再提交一次，使用先完成的结果",
+    )
+    parser.add_argument(
+        "--hedge-budget",
+        type=float,
+        default=0.1,
+        help="对冲提交数占任务总数的上限",
+    )
+    parser.add_argument(
+        "--trace",
+        help="把各阶段耗时 (预处理、提交、轮询、下载等) 逐条写入该 JSONL 文件",
+    )
+    parser.add_argument(
+        "--trace-summary",
+        action="store_true",
+        help="运行结束后打印各阶段耗时的 p50/p95/p99",
+    )
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        help="在该本地端口提供 Prometheus 格式的 /metrics (运行期间)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=min(4, os.cpu_count() or 1),
+        help="输入图片并行预处理的进程数 (1为串行)",
+    )
+
+
+def create_editor_from_args(args):
+    """根据命令行参数创建编辑器"""
+    encoding_policy = EncodingPolicy(
+        format=args.upload_format,
+        quality=args.upload_quality,
+        optimize=args.upload_optimize,
+        compress_level=args.png_compress_level,
+        max_bytes=args.upload_max_bytes,
+        passthrough=not args.no_passthrough,
+    )
+    payload_cache = None
+    if args.payload_cache_dir:
+        payload_cache = PayloadCache(args.payload_cache_dir)
+        if args.clear_payload_cache:
+            payload_cache.invalidate()
+
+    result_cache = None
+    if args.result_cache_dir:
+        result_cache = ResultCache(
+            args.result_cache_dir, ttl=args.result_cache_ttl * 3600
+        )
+
+    job_store = None if args.no_job_db else JobStore(args.job_db)
+
+    hedge_policy = None
+    if args.hedge_percentile:
+        hedge_policy = HedgePolicy(
+            percentile=args.hedge_percentile, budget=args.hedge_budget
+        )
+
+    tracer = Tracer()
+    if args.trace:
+        tracer.add_sink(JsonlSink(args.trace))
+    if args.trace_summary:
+        tracer.add_sink(LatencyAggregator())
+
+    metrics = None
+    if args.metrics_port:
+        metrics = EditorMetrics()
+        start_metrics_server(metrics.registry, port=args.metrics_port)
+        print(f"📈 运行指标: http://127.0.0.1:{args.metrics_port}/metrics")
+
+    return FluxKontextNativeMultiEditor(
+        poll_strategy=create_poll_strategy(args.poll_strategy),
+        encoding_policy=encoding_policy,
+        preprocess_workers=args.workers,
+        fast_resize=args.fast_resize,
+        payload_cache=payload_cache,
+        result_cache=result_cache,
+        streaming_download=not args.no_streaming_download,
+        job_store=job_store,
+        hedge_policy=hedge_policy,
+        tracer=tracer,
+        metrics=metrics,
+    )
+
+
+def print_trace_summary(editor):
+    """打印编辑器内存汇总的各阶段耗时 (启用 --trace-summary 时)"""
+    for sink in editor.tracer.sinks:
+        if isinstance(sink, LatencyAggregator):
+            print("⏱️  各阶段耗时:")
+            print(sink.format_summary())
+
+
+def batch_main(argv):
+    """批量模式 - 在同一进程中执行清单中的全部任务"""
+    parser = argparse.ArgumentParser(
+        prog="flux_kontext_multi_native.py batch",
+        description="按 JSONL/CSV 清单批量执行编辑任务",
+    )
+    parser.add_argument("manifest", help="任务清单 (.jsonl 或 .csv)")
+    parser.add_argument(
+        "--results",
+        "-r",
+        default="batch_results.jsonl",
+        help="结果文件 (JSONL，每完成一个任务追加一行)",
+    )
+    parser.add_argument(
+        "--output-dir", default="batch_outputs", help="未指定 output 的任务的输出目录"
+    )
+    parser.add_argument("--concurrency", "-c", type=int, default=4, help="并发任务数")
+    parser.add_argument(
+        "--no-resume",
+        action="store_true",
+        help="不跳过结果文件中已完成的任务，全部重新执行",
+    )
+    add_editor_arguments(parser)
+    args = parser.parse_args(argv)
+
+    try:
+        jobs = load_manifest(args.manifest, output_dir=args.output_dir)
+    except (OSError, ManifestError) as e:
+        print(f"❌ 无法读取任务清单: {str(e)}")
+        exit(1)
+
+    print(f"📋 共 {len(jobs)} 个任务，并发 {args.concurrency}")
+
+    try:
+        editor = create_editor_from_args(args)
+    except FileNotFoundError as e:
+        print(f"❌ {str(e)}")
+        print("\n💡 提示: 使用 --create-config 创建配置文件模板")
+        exit(1)
+
+    try:
+        summary = run_batch(
+            editor,
+            jobs,
+            args.results,
+            concurrency=args.concurrency,
+            resume=not args.no_resume,
+        )
+    except KeyboardInterrupt:
+        print(f"\n⏸️  已中断，重新运行相同命令将从 {args.results} 继续")
+        exit(130)
+    finally:
+        editor.close()
+
+    if summary["interrupted"]:
+        print(
+            f"⏸️  已中断: 成功 {summary['ok']}，失败 {summary['failed']}，"
+            f"未执行 {summary['cancelled']}，重新运行相同命令将从 {args.results} 继续"
+        )
+        exit(130)
+
+    print(
+        f"🏁 批量完成: 成功 {summary['ok']}，失败 {summary['failed']}，"
+        f"跳过 {summary['skipped']}，耗时 {summary['seconds']:.1f}秒"
+    )
+    print(f"📄 结果: {args.results}")
+    print_trace_summary(editor)
+    if editor.hedge_policy is not None:
+        stats = editor.hedge_policy.get_stats()
+        print(
+            f"🪁 对冲: {stats['hedged']} 次 (占 {stats['extra_ratio']:.0%})，"
+            f"对冲胜出 {stats['hedge_wins']} 次，预算拒绝 {stats['budget_denied']} 次"
+        )
+    if summary["failed"]:
+        exit(1)
+
+
+def resume_main(argv):
+    """恢复模式 - 收取任务记录中所有未完成任务的结果"""
+    parser = argparse.ArgumentParser(
+        prog="flux_kontext_multi_native.py resume",
+        description="继续轮询并下载进程中断前已提交的任务",
+    )
+    parser.add_argument("--concurrency", "-c", type=int, default=4, help="并发任务数")
+    parser.add_argument(
+        "--max-age",
+        type=float,
+        default=24,
+        help="超过该小时数的任务不再轮询，直接标记为过期",
+    )
+    parser.add_argument(
+        "--list", action="store_true", help="只列出未完成的任务，不进行轮询"
+    )
+    add_editor_arguments(parser)
+    args = parser.parse_args(argv)
+
+    if args.no_job_db:
+        print("❌ resume 需要任务记录数据库，不能与 --no-job-db 同时使用")
+        exit(1)
+
+    if args.list:
+        store = JobStore(args.job_db)
+        jobs = store.unfinished()
+        for job in jobs:
+            submitted = time.strftime(
+                "%Y-%m-%d %H:%M:%S", time.localtime(job["submitted_at"])
+            )
+            print(f"{job['task_id']}  {submitted}  {job['output_path'] or '-'}")
+        print(f"📋 未完成任务: {len(jobs)}，全部状态: {store.get_stats()}")
+        store.close()
+        return
+
+    try:
+        editor = create_editor_from_args(args)
+    except FileNotFoundError as e:
+        print(f"❌ {str(e)}")
+        print("\n💡 提示: 使用 --create-config 创建配置文件模板")
+        exit(1)
+
+    try:
+        summary = resume_jobs(
+            editor, concurrency=args.concurrency, max_age=args.max_age * 3600
+        )
+    finally:
+        editor.close()
+        editor.job_store.close()
+
+    print(
+        f"🏁 收取完成: 成功 {summary['completed']}，失败 {summary['failed']}，"
+        f"仍未完成 {summary['pending']}，过期 {summary['expired']}"
+    )
+    if summary["failed"] or summary["pending"]:
+        exit(1)
+
+
 def main():
     """主函数 - 命令行界面"""
+    if len(sys.argv) > 1 and sys.argv[1] == "batch":
+        batch_main(sys.argv[2:])
+        return
+    if len(sys.argv) > 1 and sys.argv[1] == "resume":
+        resume_main(sys.argv[2:])
+        return
+
     parser = argparse.ArgumentParser(description="Flux Kontext 原生多图片编辑工具")
     parser.add_argument(
         "--inputs", "-i", nargs="+", required=True, help="输入图像路径列表 (最多4张)"
@@ -511,8 +2500,8 @@ def main():
     parser.add_argument(
         "--model",
         "-m",
-        choices=["flux-kontext-pro", "flux-kontext-max"],
-        default="flux-kontext-pro",
+        choices=list(MODEL_REGISTRY),
+        default=DEFAULT_MODEL,
         help="选择模型",
     )
     parser.add_argument(
@@ -537,6 +2526,7 @@ def main():
     parser.add_argument(
         "--prompt-upsampling", action="store_true", help="启用提示词增强"
     )
+    add_editor_arguments(parser)
     parser.add_argument("--create-config", action="store_true", help="创建示例配置文件")
 
     args = parser.parse_args()
@@ -548,7 +2538,7 @@ def main():
 
     try:
         # 初始化编辑器
-        editor = FluxKontextNativeMultiEditor()
+        editor = create_editor_from_args(args)
 
         # 执行原生多图片编辑
         result = editor.edit_multi_images_native(
@@ -563,6 +2553,11 @@ def main():
             prompt_upsampling=args.prompt_upsampling,
         )
 
+        if args.upload_report and editor.last_input_report:
+            print("📊 输入图片编码报告:")
+            print(format_input_report(editor.last_input_report))
+        print_trace_summary(editor)
+
         if result:
             print(f"🎉 原生多图片编辑成功完成: {result}")
         else:
@@ -0,0 +1,432 @@
+"""
+Flux Kontext 轮询调度
+提供可插拔的轮询间隔策略，决定每次状态检查之前等待多久
+
+策略:
+    LinearBackoffPolling      - 旧版固定线性退避 min(3 + attempt, 20)
+    ExponentialBackoffPolling - 快速首探 + 带抖动的指数退避
+    EtaAwarePolling           - 按 (模型, 输入图片数) 学习典型完成时间，在预计完成时间附近密集轮询
+
+集中轮询:
+    BatchStatusPoller         - 单个调度线程检查所有已注册任务的状态，每个任务的下次检查时间由轮询策略决定
+"""
+
+import random
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from flux_kontext_models import model_latency_priors
+from flux_kontext_tracing import NULL_TRACER
+
+
+class PollStrategy:
+    """轮询间隔策略基类"""
+
+    def next_interval(self, attempt, elapsed, context=None):
+        """
+        计算第 attempt 次状态检查之前需要等待的秒数
+
+        参数:
+            attempt: 当前检查次数 (从1开始)
+            elapsed: 任务提交后已经过的秒数
+            context: 任务上下文，如 (model, input_count)
+        """
+        raise NotImplementedError
+
+    def record(self, context, duration):
+        """记录一次任务的实际完成耗时 (默认忽略)"""
+
+
+class LinearBackoffPolling(PollStrategy):
+    """旧版线性退避策略"""
+
+    def __init__(self, base=3, max_interval=20):
+        self.base = base
+        self.max_interval = max_interval
+
+    def next_interval(self, attempt, elapsed, context=None):
+        return min(self.base + attempt, self.max_interval)
+
+
+class ExponentialBackoffPolling(PollStrategy):
+    """快速首探 + 带抖动的指数退避"""
+
+    def __init__(
+        self,
+        initial_delay=0.5,
+        base_interval=1.0,
+        factor=1.3,
+        max_interval=6.0,
+        jitter=0.2,
+    ):
+        """
+        参数:
+            initial_delay: 第一次检查前的等待时间
+            base_interval: 第二次检查前的等待时间
+            factor: 之后每次间隔的增长倍数
+            max_interval: 间隔上限
+            jitter: 随机抖动比例 (0.2 表示 ±20%)，避免大量任务同步轮询
+        """
+        self.initial_delay = initial_delay
+        self.base_interval = base_interval
+        self.factor = factor
+        self.max_interval = max_interval
+        self.jitter = jitter
+
+    def next_interval(self, attempt, elapsed, context=None):
+        if attempt <= 1:
+            return self.initial_delay
+
+        interval = min(
+            self.base_interval * self.factor ** (attempt - 2), self.max_interval
+        )
+        if self.jitter:
+            interval *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return interval
+
+
+class EtaAwarePolling(PollStrategy):
+    """根据历史完成时间预测ETA的轮询策略"""
+
+    def __init__(
+        self,
+        fallback=None,
+        alpha=0.3,
+        min_samples=3,
+        near_interval=0.75,
+        max_interval=6.0,
+        priors=None,
+    ):
+        """
+        参数:
+            fallback: 样本不足时使用的策略 (默认 ExponentialBackoffPolling)
+            alpha: 指数移动平均的平滑系数
+            min_samples: 开始使用ETA所需的最少样本数
+            near_interval: 预计完成时间窗口内的最小轮询间隔
+            max_interval: 超出预计窗口后的间隔上限
+            priors: 先验完成时间 {model: 秒}，在没有样本时用作初始估计
+                    (默认取模型注册表中的 expected_latency)
+        """
+        self.fallback = fallback or ExponentialBackoffPolling()
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self.near_interval = near_interval
+        self.max_interval = max_interval
+        self.priors = dict(model_latency_priors() if priors is None else priors)
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def estimate(self, context):
+        """
+        返回 (预计完成时间, 偏差)，无可用估计时返回None
+        """
+        with self._lock:
+            stats = self._stats.get(context)
+            if stats and stats["count"] >= self.min_samples:
+                return stats["mean"], stats["dev"]
+
+        model = context[0] if isinstance(context, tuple) and context else context
+        if model in self.priors:
+            prior = self.priors[model]
+            return prior, prior * 0.5
+        return None
+
+    def record(self, context, duration):
+        with self._lock:
+            stats = self._stats.get(context)
+            if stats is None:
+                self._stats[context] = {"mean": duration, "dev": 0.0, "count": 1}
+                return
+            error = duration - stats["mean"]
+            stats["mean"] += self.alpha * error
+            stats["dev"] += self.alpha * (abs(error) - stats["dev"])
+            stats["count"] += 1
+
+    def next_interval(self, attempt, elapsed, context=None):
+        estimate = self.estimate(context)
+        if estimate is None:
+            return self.fallback.next_interval(attempt, elapsed, context)
+
+        eta, dev = estimate
+        near_interval = max(self.near_interval, min(dev * 0.25, self.max_interval))
+        window_start = max(eta - 2 * dev, 0.0)
+        window_end = eta + 2 * dev + near_interval
+
+        # 远未到预计完成时间：以较长间隔接近窗口开始
+        if elapsed < window_start:
+            return max(min(window_start - elapsed, self.max_interval), near_interval)
+
+        # 预计完成窗口内：密集轮询以尽快发现完成
+        if elapsed < window_end:
+            return near_interval
+
+        # 已超出预计窗口：逐渐放缓
+        overdue = elapsed - window_end
+        return min(near_interval + overdue * 0.25, self.max_interval)
+
+
+POLL_STRATEGIES = {
+    "linear": LinearBackoffPolling,
+    "exponential": ExponentialBackoffPolling,
+    "eta": EtaAwarePolling,
+}
+
+
+def create_poll_strategy(name):
+    """按名称创建轮询策略"""
+    if name not in POLL_STRATEGIES:
+        raise ValueError(f"未知的轮询策略: {name}")
+    return POLL_STRATEGIES[name]()
+
+
+def simulate_detection_lag(strategy, durations, context=None, max_attempts=200):
+    """
+    在模拟的任务耗时分布上测量完成检测延迟
+
+    每个任务完成后把真实耗时 (而不是发现完成的时间) 记录给策略，
+    避免 ETA 策略学到被轮询间隔拉长的耗时
+
+    参数:
+        strategy: 轮询策略
+        durations: 任务实际耗时列表 (秒)
+        context: 传递给策略的任务上下文
+        max_attempts: 每个任务的最大检查次数
+
+    返回:
+        {"mean_lag", "p95_lag", "max_lag", "mean_polls"}
+    """
+    lags = []
+    polls = []
+    for duration in durations:
+        elapsed = 0.0
+        for attempt in range(1, max_attempts + 1):
+            elapsed += strategy.next_interval(attempt, elapsed, context)
+            if elapsed >= duration:
+                lags.append(elapsed - duration)
+                polls.append(attempt)
+                strategy.record(context, duration)
+                break
+
+    if not lags:
+        return {"mean_lag": 0.0, "p95_lag": 0.0, "max_lag": 0.0, "mean_polls": 0.0}
+
+    ordered = sorted(lags)
+    return {
+        "mean_lag": sum(lags) / len(lags),
+        "p95_lag": ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)],
+        "max_lag": ordered[-1],
+        "mean_polls": sum(polls) / len(polls),
+    }
+
+
+class BatchStatusPoller:
+    """
+    集中式状态轮询服务 - 所有任务共享一个调度线程和连接池
+
+    设置 poll_strategy 时，每个任务按自己的检查次数、已等待时间和上下文决定下次检查时间
+    (与逐个轮询时相同)；否则所有任务按固定间隔检查
+    """
+
+    FINAL_STATUSES = ("Ready", "Error")
+
+    def __init__(
+        self,
+        transport,
+        interval=1.0,
+        initial_delay=0.5,
+        max_workers=4,
+        request_timeout=30,
+        max_wait=460,
+        rate_limiter=None,
+        poll_strategy=None,
+        tracer=None,
+    ):
+        """
+        参数:
+            transport: 提供 get(url, **kwargs) 的传输层 (如 PooledTransport)
+            interval: 未设置 poll_strategy 时的固定轮询间隔 (秒)
+            initial_delay: 未设置 poll_strategy 时，注册后第一次检查前的等待时间
+            max_workers: 并发发送状态请求的固定线程数
+            request_timeout: 单次状态请求超时时间
+            max_wait: 单个任务的最长等待秒数，超时后 future 抛出 TimeoutError
+            rate_limiter: 共享的 RateLimiter，状态请求按其轮询速率发送，收到429时整体退避
+            poll_strategy: 轮询间隔策略 (PollStrategy)，通常与编辑器使用同一个实例
+            tracer: 每次状态请求记录一个 poll 区间 (Tracer)
+        """
+        self.transport = transport
+        self.poll_strategy = poll_strategy
+        self.tracer = tracer or NULL_TRACER
+        self.interval = interval
+        self.initial_delay = initial_delay
+        self.request_timeout = request_timeout
+        self.max_wait = max_wait
+        self.rate_limiter = rate_limiter
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self._fetch_pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="flux-poll"
+        )
+        self._stats = {
+            "ticks": 0,
+            "polls": 0,
+            "completed": 0,
+            "timeouts": 0,
+            "throttled": 0,
+        }
+        self._thread = threading.Thread(
+            target=self._run, name="flux-batch-poller", daemon=True
+        )
+        self._thread.start()
+
+    def register(self, polling_url, x_key, callback=None, max_wait=None, context=None):
+        """
+        注册一个待轮询的任务
+
+        参数:
+            polling_url: 任务轮询地址
+            x_key: 查询该任务使用的API密钥
+            callback: 任务到达 Ready/Error 时调用 callback(future)
+            max_wait: 覆盖默认的最长等待秒数
+            context: 传给轮询策略的任务上下文，如 (model, input_count)
+
+        返回:
+            concurrent.futures.Future，结果为最终的状态响应字典
+        """
+        if self._closed:
+            raise RuntimeError("轮询服务已关闭")
+
+        future = Future()
+        if callback:
+            future.add_done_callback(callback)
+
+        now = time.monotonic()
+        entry = {
+            "future": future,
+            "headers": {"x-key": x_key},
+            "context": context,
+            "registered_at": now,
+            "attempt": 1,
+            "deadline": now + (max_wait or self.max_wait),
+        }
+        entry["next_at"] = now + self._next_interval(entry, now)
+        with self._lock:
+            self._jobs[polling_url] = entry
+        self._wakeup.set()
+        return future
+
+    def unregister(self, polling_url):
+        """取消注册，对应的 future 被取消"""
+        with self._lock:
+            entry = self._jobs.pop(polling_url, None)
+        if entry:
+            entry["future"].cancel()
+
+    def _next_interval(self, entry, now):
+        """该任务第 entry["attempt"] 次检查之前的等待秒数"""
+        if self.poll_strategy is None:
+            return self.initial_delay if entry["attempt"] == 1 else self.interval
+        return self.poll_strategy.next_interval(
+            entry["attempt"], now - entry["registered_at"], entry["context"]
+        )
+
+    def get_stats(self):
+        """返回调度统计信息"""
+        with self._lock:
+            return dict(self._stats, registered=len(self._jobs))
+
+    def close(self):
+        """停止调度线程，未完成的任务被取消"""
+        self._closed = True
+        self._wakeup.set()
+        self._thread.join(timeout=5)
+        with self._lock:
+            entries = list(self._jobs.values())
+            self._jobs.clear()
+        for entry in entries:
+            entry["future"].cancel()
+        self._fetch_pool.shutdown(wait=False)
+
+    def _run(self):
+        while not self._closed:
+            now = time.monotonic()
+            with self._lock:
+                due = [
+                    (url, entry)
+                    for url, entry in self._jobs.items()
+                    if entry["next_at"] <= now
+                ]
+                next_due = min(
+                    (entry["next_at"] for entry in self._jobs.values()), default=None
+                )
+
+            if due:
+                with self._lock:
+                    self._stats["ticks"] += 1
+                for url, entry in due:
+                    entry["attempt"] += 1
+                    entry["next_at"] = now + self._next_interval(entry, now)
+                list(self._fetch_pool.map(lambda item: self._poll_one(*item), due))
+                continue
+
+            timeout = None if next_due is None else max(next_due - now, 0.0)
+            self._wakeup.wait(timeout)
+            self._wakeup.clear()
+
+    def _poll_one(self, polling_url, entry):
+        future = entry["future"]
+        if future.done():
+            self._finish(polling_url)
+            return
+
+        if time.monotonic() > entry["deadline"]:
+            self._finish(polling_url)
+            with self._lock:
+                self._stats["timeouts"] += 1
+            if not future.done():
+                future.set_exception(TimeoutError(f"轮询超时: {polling_url}"))
+            return
+
+        try:
+            with self._lock:
+                self._stats["polls"] += 1
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire_poll()
+            with self.tracer.span("poll", attempt=entry["attempt"] - 1) as span:
+                response = self.transport.get(
+                    polling_url, headers=entry["headers"], timeout=self.request_timeout
+                )
+                span.set(status=response.status_code)
+            if response.status_code == 429:
+                self._throttled(entry, response)
+                return
+            if response.status_code != 200:
+                return
+            result = response.json()
+        except Exception as e:
+            print(f"⚠️  状态检查出错: {str(e)}")
+            return
+
+        if result.get("status") in self.FINAL_STATUSES:
+            self._finish(polling_url)
+            with self._lock:
+                self._stats["completed"] += 1
+            if not future.done():
+                future.set_result(result)
+
+    def _throttled(self, entry, response):
+        """服务端限流：推迟该任务的下一次检查，并让限流器暂停所有状态请求"""
+        with self._lock:
+            self._stats["throttled"] += 1
+        if self.rate_limiter is not None:
+            delay = self.rate_limiter.retry_delay(response, 0)
+            self.rate_limiter.throttled("poll", delay)
+        else:
+            delay = self.interval
+        entry["next_at"] = max(entry["next_at"], time.monotonic() + delay)
+
+    def _finish(self, polling_url):
+        with self._lock:
+            self._jobs.pop(polling_url, None)
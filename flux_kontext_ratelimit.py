@@ -0,0 +1,347 @@
+"""
+Flux Kontext 客户端限流
+在同一进程中使用相同API密钥的编辑器之间共享请求速率和并发任务数上限，并统一处理 429 / Retry-After
+
+    TokenBucket - 令牌桶，reserve() 返回需要等待的秒数，同步和异步调用方都可以使用
+    RateLimiter - 提交/轮询两个令牌桶 + 进行中任务数上限 + 429 退避
+
+配置 (config.ini):
+    [RATE_LIMIT]
+    submit_per_second = 2      # 每秒最多提交的任务数
+    poll_per_second = 10       # 每秒最多发送的状态查询数
+    burst = 4                  # 令牌桶容量，允许的短时突发请求数
+    max_in_flight = 24         # 同时进行中的任务数上限
+    max_retries = 5            # 收到429后的最大重试次数
+"""
+
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from email.utils import parsedate_to_datetime
+
+# [RATE_LIMIT] 配置项 -> (RateLimiter 参数, 类型)
+RATE_LIMIT_OPTIONS = {
+    "submit_per_second": ("submit_rate", float),
+    "poll_per_second": ("poll_rate", float),
+    "burst": ("burst", int),
+    "max_in_flight": ("max_in_flight", int),
+    "max_retries": ("max_retries", int),
+    "backoff_base": ("backoff_base", float),
+    "backoff_max": ("backoff_max", float),
+}
+
+
+class TokenBucket:
+    """令牌桶 - 按固定速率补充令牌，令牌不足时调用方排队等待"""
+
+    def __init__(self, rate, burst=None):
+        """
+        参数:
+            rate: 每秒补充的令牌数
+            burst: 令牌桶容量 (默认等于 rate，至少为1)
+        """
+        if rate <= 0:
+            raise ValueError("rate 必须大于0")
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, tokens=1):
+        """
+        预留令牌并返回需要等待的秒数
+
+        令牌不足时记为欠账，之后的调用方在其后排队，因此并发调用得到的等待时间依次递增
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= tokens
+            deficit = -self._tokens if self._tokens < 0 else 0.0
+            return max(self._updated - now, 0.0) + deficit / self.rate
+
+    def acquire(self, tokens=1):
+        """阻塞直到获得令牌，返回实际等待的秒数"""
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+        return delay
+
+    def pause(self, delay):
+        """暂停发放令牌 delay 秒 (服务端要求退避时使用)，恢复后不允许突发"""
+        with self._lock:
+            until = time.monotonic() + delay
+            if until > self._updated:
+                self._refill(time.monotonic())
+                self._tokens = min(self._tokens, 0.0)
+                self._updated = until
+
+    def _refill(self, now):
+        """按流逝时间补充令牌 (调用方持有锁)；暂停期间 _updated 位于未来，不补充"""
+        if now > self._updated:
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+
+
+def parse_retry_after(value):
+    """
+    解析 Retry-After 响应头
+
+    返回:
+        需要等待的秒数，无法解析时返回None
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(retry_at.timestamp() - time.time(), 0.0)
+
+
+class RateLimiter:
+    """客户端限流器 - 提交和轮询分别限速，限制进行中的任务数，统一处理429退避"""
+
+    def __init__(
+        self,
+        submit_rate=None,
+        poll_rate=None,
+        burst=None,
+        max_in_flight=None,
+        max_retries=5,
+        backoff_base=1.0,
+        backoff_max=60.0,
+    ):
+        """
+        参数:
+            submit_rate: 每秒最多提交的任务数 (None 表示不限)
+            poll_rate: 每秒最多发送的状态查询数 (None 表示不限)
+            burst: 令牌桶容量
+            max_in_flight: 同时进行中 (已提交、尚未完成) 的任务数上限 (None 表示不限)
+            max_retries: 提交收到429后的最大重试次数
+            backoff_base: 响应没有 Retry-After 时的初始退避秒数，之后每次翻倍
+            backoff_max: 单次退避的上限
+        """
+        self.submit_bucket = TokenBucket(submit_rate, burst) if submit_rate else None
+        self.poll_bucket = TokenBucket(poll_rate, burst) if poll_rate else None
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._slots = (
+            threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+        )
+        # 等待名额的协程 (事件循环, future)，释放名额时唤醒一个，等待期间不轮询
+        self._slot_waiters = deque()
+        self._slot_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._stats = {
+            "submits": 0,
+            "polls": 0,
+            "throttled_submits": 0,
+            "throttled_polls": 0,
+            "rate_wait_seconds": 0.0,
+            "slot_wait_seconds": 0.0,
+            "in_flight": 0,
+            "max_in_flight_seen": 0,
+        }
+
+    def acquire_submit(self):
+        """提交前调用，必要时阻塞等待令牌"""
+        self._count("submits", self._reserve(self.submit_bucket, sleep=True))
+
+    def acquire_poll(self):
+        """状态查询前调用，必要时阻塞等待令牌"""
+        self._count("polls", self._reserve(self.poll_bucket, sleep=True))
+
+    async def acquire_submit_async(self):
+        """acquire_submit 的异步版本"""
+        delay = self._reserve(self.submit_bucket)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._count("submits", delay)
+
+    async def acquire_poll_async(self):
+        """acquire_poll 的异步版本"""
+        delay = self._reserve(self.poll_bucket)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        self._count("polls", delay)
+
+    def acquire_slot(self, blocking=True, timeout=None):
+        """
+        占用一个进行中任务名额
+
+        返回:
+            成功占用时返回True，非阻塞或超时未获得时返回False
+        """
+        if self._slots is None:
+            self._enter_slot(0.0)
+            return True
+        started = time.monotonic()
+        if not self._slots.acquire(blocking, timeout):
+            return False
+        self._enter_slot(time.monotonic() - started)
+        return True
+
+    async def acquire_slot_async(self):
+        """
+        acquire_slot 的异步版本，等待期间不占用线程
+
+        没有空闲名额时登记一个 future，由 release_slot 唤醒后再尝试占用
+        (名额可能先被同步调用方取走，此时重新登记)
+        """
+        if self._slots is None:
+            self._enter_slot(0.0)
+            return
+        started = time.monotonic()
+        loop = asyncio.get_running_loop()
+        while True:
+            # 尝试占用和登记在同一把锁内，避免两者之间的释放被错过
+            with self._slot_lock:
+                if self._slots.acquire(blocking=False):
+                    break
+                waiter = loop.create_future()
+                self._slot_waiters.append((loop, waiter))
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                with self._slot_lock:
+                    woken = (loop, waiter) not in self._slot_waiters
+                    if not woken:
+                        self._slot_waiters.remove((loop, waiter))
+                if woken:
+                    # 已被唤醒但不再需要名额，把唤醒转给下一个等待者
+                    self._wake_slot_waiter()
+                raise
+        self._enter_slot(time.monotonic() - started)
+
+    def release_slot(self):
+        """任务结束 (成功、失败或放弃) 后释放名额"""
+        with self._lock:
+            self._stats["in_flight"] -= 1
+        if self._slots is not None:
+            with self._slot_lock:
+                self._slots.release()
+            self._wake_slot_waiter()
+
+    def _wake_slot_waiter(self):
+        """唤醒一个等待名额的协程 (跳过事件循环已关闭的等待者)"""
+        while True:
+            with self._slot_lock:
+                if not self._slot_waiters:
+                    return
+                loop, waiter = self._slot_waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(_set_waiter_done, waiter)
+                return
+            except RuntimeError:
+                continue
+
+    def retry_delay(self, response, attempt):
+        """
+        计算收到429后的退避秒数：优先使用 Retry-After，否则按指数退避并加入抖动
+
+        参数:
+            response: 429 响应 (requests 或 aiohttp)
+            attempt: 已重试次数 (从0开始)
+        """
+        delay = parse_retry_after(response.headers.get("Retry-After"))
+        if delay is None:
+            delay = self.backoff_base * 2**attempt * random.uniform(0.8, 1.2)
+        return min(delay, self.backoff_max)
+
+    def throttled(self, kind, delay):
+        """
+        记录一次服务端限流并暂停对应的令牌桶，使同一进程中的其他请求也一起退避
+
+        参数:
+            kind: "submit" 或 "poll"
+            delay: 暂停秒数
+
+        返回:
+            调用方还需自行等待的秒数 (对应的令牌桶未启用时为 delay，否则为0)
+        """
+        with self._lock:
+            self._stats[f"throttled_{kind}s"] += 1
+        bucket = self.submit_bucket if kind == "submit" else self.poll_bucket
+        if bucket is None:
+            return delay
+        bucket.pause(delay)
+        return 0.0
+
+    def get_stats(self):
+        """返回请求数、限流次数、等待时间和进行中任务数"""
+        with self._lock:
+            return dict(self._stats)
+
+    def _reserve(self, bucket, sleep=False):
+        if bucket is None:
+            return 0.0
+        return bucket.acquire() if sleep else bucket.reserve()
+
+    def _count(self, name, waited):
+        with self._lock:
+            self._stats[name] += 1
+            self._stats["rate_wait_seconds"] += waited
+
+    def _enter_slot(self, waited):
+        with self._lock:
+            self._stats["in_flight"] += 1
+            self._stats["slot_wait_seconds"] += waited
+            self._stats["max_in_flight_seen"] = max(
+                self._stats["max_in_flight_seen"], self._stats["in_flight"]
+            )
+
+
+def _set_waiter_done(waiter):
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+def rate_limit_settings_from_config(config):
+    """
+    从 ConfigParser 的 [RATE_LIMIT] 部分读取限流设置
+
+    返回:
+        RateLimiter 参数字典，没有该部分时返回空字典
+    """
+    if not config.has_section("RATE_LIMIT"):
+        return {}
+    settings = {}
+    for option, (name, cast) in RATE_LIMIT_OPTIONS.items():
+        if config.has_option("RATE_LIMIT", option):
+            try:
+                settings[name] = cast(config["RATE_LIMIT"][option])
+            except ValueError:
+                raise ValueError(f"[RATE_LIMIT] {option} 的值无效")
+    return settings
+
+
+_shared_limiters = {}
+_shared_lock = threading.Lock()
+
+
+def get_shared_rate_limiter(scope=None, **settings):
+    """
+    返回进程内共享的限流器，相同作用域和设置的编辑器得到同一个实例
+
+    参数:
+        scope: 共享范围，通常为API密钥指纹 (服务端按密钥限流，不同密钥互不影响)
+        其余参数与 RateLimiter 相同
+    """
+    key = (scope, tuple(sorted(settings.items())))
+    with _shared_lock:
+        limiter = _shared_limiters.get(key)
+        if limiter is None:
+            limiter = _shared_limiters[key] = RateLimiter(**settings)
+        return limiter
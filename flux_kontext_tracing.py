@@ -0,0 +1,389 @@
+"""
+Flux Kontext 延迟追踪
+为编辑流程的每个阶段记录结构化的计时区间 (span)，写入可替换的输出 (sink)
+
+    Tracer              - span() 上下文管理器记录一个阶段，同一线程中嵌套的区间自动成为子区间；
+                          没有任何 sink 时不创建区间对象，开销可以忽略
+    JsonlSink           - 每个区间一行JSON，可在运行结束后用本模块汇总
+    LatencyAggregator   - 在内存中按阶段汇总 p50/p95/p99
+    OpenTelemetrySink   - 转发到 OpenTelemetry (可选，需要 opentelemetry-api)
+
+阶段名称:
+    edit                整个编辑请求
+    config_load         读取配置文件
+    slot_wait           等待进行中任务名额
+    preprocess          全部输入图片预处理
+    image.read / image.decode / image.resize / image.encode   单张图片的各步骤
+    build_payload       构建请求体
+    submit              一次提交请求的往返时间
+    queue_wait          提交后等待任务完成 (服务端排队和生成)
+    poll                一次状态查询的往返时间
+    download            下载结果 (流式下载时包含写入)
+    save                解码转换并保存结果
+
+汇总已有的追踪文件:
+    python flux_kontext_tracing.py trace.jsonl
+"""
+
+import json
+import math
+import secrets
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:  # pragma: no cover - 可选依赖
+    otel_trace = None
+
+
+class Span:
+    """一个计时区间"""
+
+    __slots__ = (
+        "name",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "start",
+        "duration",
+        "attrs",
+        "error",
+    )
+
+    def __init__(self, name, trace_id, parent_id=None, attrs=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.start = time.time()
+        self.duration = None
+        self.attrs = attrs or {}
+        self.error = None
+
+    def set(self, **attrs):
+        """补充区间属性 (如响应状态码)"""
+        self.attrs.update(attrs)
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start,
+            "duration_ms": round(self.duration * 1000, 3),
+            "attrs": self.attrs,
+            "error": self.error,
+        }
+
+
+class _NullSpan:
+    """追踪未启用时使用的空区间"""
+
+    __slots__ = ()
+
+    def set(self, **attrs):
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+    """记录计时区间并分发到各个 sink"""
+
+    def __init__(self, sinks=None):
+        """
+        参数:
+            sinks: 具有 emit(span) 和 close() 方法的对象列表
+        """
+        self.sinks = list(sinks or [])
+        self._local = threading.local()
+
+    @property
+    def enabled(self):
+        return bool(self.sinks)
+
+    def add_sink(self, sink):
+        self.sinks.append(sink)
+
+    def _stack(self):
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        return stack
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """
+        记录一个阶段，用法: with tracer.span("submit", endpoint="default") as span: ...
+
+        同一线程中嵌套的区间成为当前区间的子区间；块内抛出的异常记录在 error 中并继续抛出
+        """
+        if not self.sinks:
+            yield _NULL_SPAN
+            return
+
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        span = Span(
+            name,
+            parent.trace_id if parent else secrets.token_hex(16),
+            parent.span_id if parent else None,
+            attrs,
+        )
+        stack.append(span)
+        started = time.monotonic()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.duration = time.monotonic() - started
+            stack.pop()
+            self._emit(span)
+
+    def record(self, name, duration, **attrs):
+        """
+        记录一个已经在别处计时的阶段 (如在预处理进程中完成的步骤)，作为当前区间的子区间
+        """
+        if not self.sinks:
+            return
+        stack = self._stack()
+        parent = stack[-1] if stack else None
+        span = Span(
+            name,
+            parent.trace_id if parent else secrets.token_hex(16),
+            parent.span_id if parent else None,
+            attrs,
+        )
+        span.start -= duration
+        span.duration = duration
+        self._emit(span)
+
+    def _emit(self, span):
+        for sink in self.sinks:
+            try:
+                sink.emit(span)
+            except Exception as e:
+                print(f"⚠️  写入追踪数据失败: {str(e)}")
+
+    def close(self):
+        """关闭所有 sink"""
+        for sink in self.sinks:
+            sink.close()
+
+
+class _NullTracer(Tracer):
+    """不记录任何区间的共享追踪器，不能添加 sink"""
+
+    def __init__(self):
+        super().__init__()
+        self.sinks = ()
+
+    def add_sink(self, sink):
+        raise TypeError(
+            "NULL_TRACER 是共享的空追踪器，不能添加 sink；请创建新的 Tracer"
+        )
+
+
+# 未配置追踪时编辑器使用的共享实例 (不可变，向一个编辑器添加 sink 不会影响其他编辑器)
+NULL_TRACER = _NullTracer()
+
+
+class JsonlSink:
+    """每个区间写一行JSON"""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8", buffering=1)
+        self._lock = threading.Lock()
+
+    def emit(self, span):
+        line = json.dumps(span.to_dict(), ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+
+    def close(self):
+        with self._lock:
+            if not self._file.closed:
+                self._file.close()
+
+
+def _percentile(ordered, q):
+    """最近秩法分位数，ordered 已排序"""
+    return ordered[max(math.ceil(q / 100 * len(ordered)) - 1, 0)]
+
+
+class LatencyAggregator:
+    """在内存中按阶段收集耗时，输出分位数汇总"""
+
+    def __init__(self, window=10000):
+        """
+        参数:
+            window: 每个阶段保留的最近样本数
+        """
+        self.window = window
+        self._durations = {}
+        self._errors = {}
+        self._lock = threading.Lock()
+
+    def emit(self, span):
+        self.add(span.name, span.duration, error=span.error is not None)
+
+    def add(self, name, duration, error=False):
+        with self._lock:
+            durations = self._durations.setdefault(name, [])
+            durations.append(duration)
+            if len(durations) > self.window:
+                del durations[: len(durations) - self.window]
+            if error:
+                self._errors[name] = self._errors.get(name, 0) + 1
+
+    def close(self):
+        pass
+
+    def summary(self):
+        """
+        返回:
+            {阶段: {"count", "errors", "mean", "p50", "p95", "p99", "max"}}，单位为秒
+        """
+        with self._lock:
+            snapshot = {name: sorted(d) for name, d in self._durations.items()}
+            errors = dict(self._errors)
+        return {
+            name: {
+                "count": len(ordered),
+                "errors": errors.get(name, 0),
+                "mean": sum(ordered) / len(ordered),
+                "p50": _percentile(ordered, 50),
+                "p95": _percentile(ordered, 95),
+                "p99": _percentile(ordered, 99),
+                "max": ordered[-1],
+            }
+            for name, ordered in snapshot.items()
+        }
+
+    def format_summary(self):
+        """返回按阶段排列的分位数表格 (毫秒)"""
+        rows = self.summary()
+        lines = [
+            f"{'阶段':<16} {'次数':>6} {'p50':>9} {'p95':>9} {'p99':>9} {'最大':>9} {'错误':>5}"
+        ]
+        for name in sorted(rows):
+            row = rows[name]
+            lines.append(
+                f"{name:<16} {row['count']:>6} "
+                f"{row['p50'] * 1000:>7.1f}ms {row['p95'] * 1000:>7.1f}ms "
+                f"{row['p99'] * 1000:>7.1f}ms {row['max'] * 1000:>7.1f}ms "
+                f"{row['errors']:>5}"
+            )
+        return "\n".join(lines)
+
+
+class OpenTelemetrySink:
+    """
+    把区间转发给 OpenTelemetry 追踪器
+
+    子区间先于父区间结束，因此按 trace 缓存，根区间结束后按父子顺序一次性导出
+    """
+
+    def __init__(self, tracer=None):
+        """
+        参数:
+            tracer: opentelemetry.trace.Tracer (默认使用全局 TracerProvider)
+        """
+        if otel_trace is None:
+            raise ImportError(
+                "需要安装 opentelemetry-api: pip install opentelemetry-api"
+            )
+        self.tracer = tracer or otel_trace.get_tracer("flux_kontext")
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def emit(self, span):
+        with self._lock:
+            spans = self._pending.setdefault(span.trace_id, [])
+            spans.append(span)
+            if span.parent_id is not None:
+                return
+            del self._pending[span.trace_id]
+        self._export(spans)
+
+    def _export(self, spans):
+        children = {}
+        for span in spans:
+            children.setdefault(span.parent_id, []).append(span)
+
+        def export(span, context):
+            start_ns = int(span.start * 1e9)
+            otel_span = self.tracer.start_span(
+                span.name,
+                context=context,
+                start_time=start_ns,
+                attributes={k: v for k, v in span.attrs.items() if v is not None},
+            )
+            if span.error:
+                otel_span.set_status(
+                    otel_trace.Status(otel_trace.StatusCode.ERROR, span.error)
+                )
+            child_context = otel_trace.set_span_in_context(otel_span)
+            for child in children.get(span.span_id, []):
+                export(child, child_context)
+            otel_span.end(end_time=start_ns + int(span.duration * 1e9))
+
+        for root in children.get(None, []):
+            export(root, None)
+
+    def close(self):
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+        for spans in pending:
+            self._export(spans)
+
+
+def load_spans(path):
+    """
+    读取 JsonlSink 写入的追踪文件
+
+    返回:
+        区间字典列表，不完整的行会被忽略
+    """
+    spans = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                spans.append(json.loads(line))
+            except ValueError:
+                continue
+    return spans
+
+
+def summarize_file(path, aggregator=None):
+    """汇总追踪文件，返回填充好的 LatencyAggregator (可传入已有实例合并多个文件)"""
+    if aggregator is None:
+        aggregator = LatencyAggregator(window=sys.maxsize)
+    for span in load_spans(path):
+        aggregator.add(
+            span["name"], span["duration_ms"] / 1000, error=bool(span.get("error"))
+        )
+    return aggregator
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("用法: python flux_kontext_tracing.py trace.jsonl [...]")
+        sys.exit(2)
+    aggregator = None
+    for path in sys.argv[1:]:
+        aggregator = summarize_file(path, aggregator)
+    print(aggregator.format_summary())
+
+
+if __name__ == "__main__":
+    main()
@@ -10,10 +10,26 @@ streamlit run streamlit_app.py
 import streamlit as st
 import os
 import time
-from PIL import Image
+import uuid
 import io
 import base64
-from flux_kontext_multi_native import FluxKontextNativeMultiEditor
+from flux_kontext_multi_native import FluxKontextNativeMultiEditor, make_thumbnail
+from flux_kontext_background import (
+    JOB_FAILED,
+    JOB_QUEUED,
+    JOB_RUNNING,
+    JOB_SUCCEEDED,
+    BackgroundRunner,
+    ProgressView,
+)
+from flux_kontext_balancer import normalize_base_url
+from flux_kontext_cache import ResultCache
+from flux_kontext_metrics import (
+    DEFAULT_METRICS_PORT,
+    EditorMetrics,
+    start_metrics_server,
+)
+from flux_kontext_models import MODEL_REGISTRY
 
 # 页面配置
 st.set_page_config(
@@ -96,12 +112,67 @@ st.markdown(
 )
 
 
+@st.cache_resource
+def get_result_cache():
+    """进程内所有会话共享的生成结果缓存"""
+    return ResultCache(os.path.join(".flux_cache", "results"))
+
+
+# 上传图片预览的最大边长 (像素)
+PREVIEW_SIZE = 384
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def get_thumbnail(data):
+    """按文件内容缓存的上传图片缩略图，页面重新运行时直接返回，不再解码和发送原图"""
+    return make_thumbnail(data, PREVIEW_SIZE)
+
+
+# 有进行中的任务时任务列表的刷新间隔 (秒)
+JOB_REFRESH_SECONDS = 1.0
+
+
+@st.cache_resource
+def get_background_runner():
+    """
+    进程内所有会话共享的后台执行器
+
+    任务在事件循环中异步执行，等待生成结果时不占用线程，大量会话同时提交也不需要排队等线程；
+    同时进行的任务数由环境变量 FLUX_BACKGROUND_CONCURRENCY 指定 (默认100，另受限流器名额约束)，
+    预处理和下载等阻塞步骤的线程数由 FLUX_BACKGROUND_WORKERS 指定 (默认8)
+    """
+    return BackgroundRunner(
+        max_workers=int(os.environ.get("FLUX_BACKGROUND_WORKERS", 8)),
+        max_concurrency=int(os.environ.get("FLUX_BACKGROUND_CONCURRENCY", 100)),
+    )
+
+
+@st.cache_resource
+def get_metrics():
+    """
+    进程内所有会话共享的运行指标，同时在本地端口提供 Prometheus 格式的 /metrics
+
+    端口由环境变量 FLUX_METRICS_PORT 指定 (默认9464，0 表示不启动)
+    """
+    metrics = EditorMetrics()
+    port = int(os.environ.get("FLUX_METRICS_PORT", DEFAULT_METRICS_PORT))
+    if port:
+        try:
+            start_metrics_server(metrics.registry, port=port)
+            print(f"📈 运行指标: http://127.0.0.1:{port}/metrics")
+        except OSError as e:
+            print(f"⚠️  指标端口 {port} 不可用: {str(e)}")
+    return metrics
+
+
 def init_session_state():
     """初始化会话状态"""
     if "editor" not in st.session_state:
         st.session_state.editor = None
-    if "processing" not in st.session_state:
-        st.session_state.processing = False
+    if "jobs" not in st.session_state:
+        st.session_state.jobs = []
+    if "job_views" not in st.session_state:
+        st.session_state.job_views = {}
     if "result_image" not in st.session_state:
         st.session_state.result_image = None
     if "edit_instruction" not in st.session_state:
@@ -112,10 +183,19 @@ def init_session_state():
         st.session_state.base_url = "https://api.bfl.ai"
     if "api_configured" not in st.session_state:
         st.session_state.api_configured = False
-    if "log_messages" not in st.session_state:
-        st.session_state.log_messages = []
-    if "log_expanded" not in st.session_state:
-        st.session_state.log_expanded = True
+
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def get_editor(api_key, base_url):
+    """
+    按 (API密钥, BASE_URL) 缓存的编辑器，在页面重新运行和相同配置的会话之间复用，
+    连接池、限流器和预处理缓存保持有效；配置只保存在内存中，不写入文件
+    """
+    return FluxKontextNativeMultiEditor(
+        config={"API": {"X_KEY": api_key, "BASE_URL": base_url}},
+        result_cache=get_result_cache(),
+        metrics=get_metrics(),
+    )
 
 
 def load_editor():
@@ -124,26 +204,9 @@ def load_editor():
         if st.session_state.editor is None:
             # 使用页面配置的API密钥和BASE_URL
             if st.session_state.api_key.strip():
-                # 验证和格式化BASE_URL
-                base_url = st.session_state.base_url.strip()
-                if not base_url:
-                    base_url = "https://api.bfl.ai"
-                elif not base_url.startswith("http"):
-                    base_url = f"https://{base_url}"
-
-                # 临时创建配置文件
-                config_content = f"""[API]
-X_KEY = {st.session_state.api_key.strip()}
-BASE_URL = {base_url}
-"""
-                with open("temp_config.ini", "w", encoding="utf-8") as f:
-                    f.write(config_content)
-
-                # 创建编辑器实例，指定临时配置文件
-                from flux_kontext_multi_native import FluxKontextNativeMultiEditor
-
-                st.session_state.editor = FluxKontextNativeMultiEditor(
-                    config_path="temp_config.ini"
+                st.session_state.editor = get_editor(
+                    st.session_state.api_key.strip(),
+                    normalize_base_url(st.session_state.base_url.strip()),
                 )
                 st.session_state.api_configured = True
             else:
@@ -198,13 +261,7 @@ def create_config_section():
         st.success("✅ API密钥已配置")
 
         # 显示当前BASE_URL
-        current_base_url = (
-            st.session_state.base_url.strip()
-            if st.session_state.base_url.strip()
-            else "https://api.bfl.ai"
-        )
-        if not current_base_url.startswith("http"):
-            current_base_url = f"https://{current_base_url}"
+        current_base_url = normalize_base_url(st.session_state.base_url.strip())
         st.info(f"🔗 当前API服务器: {current_base_url}")
 
         if st.button("🧪 测试API连接"):
@@ -227,42 +284,125 @@ def create_config_section():
     )
 
 
-def render_collapsible_log(key_suffix=""):
-    """渲染可折叠的日志容器"""
-    if not st.session_state.log_messages:
+def render_collapsible_log(log_text):
+    """渲染带滚动的日志容器 (log_text 已经过HTML转义)"""
+    if not log_text:
         return
 
-    st.markdown("#### 📋 处理日志")
-
-    # 如果展开状态，显示日志
-    if st.session_state.log_expanded:
-        # 显示最近的日志（限制显示条数以提高性能）
-        recent_logs = st.session_state.log_messages[-15:]  # 只显示最近15条日志
-        log_text = "\n".join(recent_logs)
-
-        # HTML转义日志内容
-        import html
-
-        escaped_log_text = html.escape(log_text)
-
-        # 创建一个带滚动的日志容器
-        log_container_html = f"""
-        <div style="
-            height: 200px; 
-            overflow-y: auto; 
-            background-color: #1e1e1e; 
-            color: #ffffff; 
-            padding: 10px; 
-            border-radius: 5px; 
-            font-family: 'Consolas', 'Monaco', 'Courier New', monospace; 
-            font-size: 0.85rem; 
-            line-height: 1.4; 
-            white-space: pre-wrap; 
-            border: 1px solid #404040;
-            ">{escaped_log_text}</div>
-        """
+    # 创建一个带滚动的日志容器
+    log_container_html = f"""
+    <div style="
+        height: 200px; 
+        overflow-y: auto; 
+        background-color: #1e1e1e; 
+        color: #ffffff; 
+        padding: 10px; 
+        border-radius: 5px; 
+        font-family: 'Consolas', 'Monaco', 'Courier New', monospace; 
+        font-size: 0.85rem; 
+        line-height: 1.4; 
+        white-space: pre-wrap; 
+        border: 1px solid #404040;
+        ">{log_text}</div>
+    """
+
+    st.markdown(log_container_html, unsafe_allow_html=True)
+
+
+JOB_STATE_ICONS = {
+    JOB_QUEUED: "🕒",
+    JOB_RUNNING: "🔄",
+    JOB_SUCCEEDED: "✅",
+    JOB_FAILED: "❌",
+}
+
+
+def get_progress_view(job):
+    """返回本会话中该任务的增量进度视图，并拉取最新一帧"""
+    view = st.session_state.job_views.get(job.id)
+    if view is None:
+        # 只显示最近15条日志，每帧只转义新增的行
+        view = st.session_state.job_views[job.id] = ProgressView(
+            job.channel, max_lines=15
+        )
+    view.refresh()
+    return view
+
+
+def render_job(job):
+    """渲染一个任务的状态、进度和结果"""
+    view = get_progress_view(job)
+    snapshot = job.snapshot()
+    params = snapshot["params"]
+    end = snapshot["finished_at"] or time.time()
+    elapsed = end - (snapshot["started_at"] or end)
+    with st.container(border=True):
+        info_col, result_col = st.columns([3, 2])
+        with info_col:
+            label = job.label if len(job.label) <= 80 else job.label[:80] + "…"
+            st.markdown(f"**{JOB_STATE_ICONS[snapshot['state']]} #{job.id}** {label}")
+            st.caption(
+                f"{params.get('model')} · {params.get('inputs', 0)} 张输入图片 · "
+                f"已用 {elapsed:.0f}秒"
+            )
+            if snapshot["state"] == JOB_FAILED:
+                st.error(snapshot["error"] or "😞 图片编辑失败，请检查设置并重试")
+            elif snapshot["state"] != JOB_SUCCEEDED:
+                st.progress(view.progress, text=view.message)
+            with st.expander("📋 处理日志"):
+                render_collapsible_log(view.log_text())
+
+        with result_col:
+            result = snapshot["result"]
+            if snapshot["state"] == JOB_SUCCEEDED and result and os.path.exists(result):
+                st.image(result, caption="生成/编辑后的图片", use_container_width=True)
+                output_format = params.get("output_format", "png")
+                with open(result, "rb") as file:
+                    st.download_button(
+                        label="📥 下载图片",
+                        data=file.read(),
+                        file_name=os.path.basename(result),
+                        mime=f"image/{output_format}",
+                        key=f"download_job_{job.id}",
+                    )
+
+
+def _render_active_jobs(jobs):
+    for job in jobs:
+        render_job(job)
 
-        st.markdown(log_container_html, unsafe_allow_html=True)
+    # 有任务结束时重新运行整个页面，把它移到已完成列表；全部结束后定时刷新随之关闭
+    if any(job.finished for job in jobs):
+        st.rerun()
+
+
+def render_job_panel():
+    """
+    任务列表
+
+    进行中的任务放在按固定间隔刷新的片段中，每帧只读取进度通道的增量；
+    已完成的任务 (图片和下载数据) 在片段之外渲染，不随每次刷新重新发送
+    """
+    jobs = st.session_state.jobs
+    if not jobs:
+        return
+    active = [job for job in jobs if not job.finished]
+    finished = [job for job in jobs if job.finished]
+
+    header_col, clear_col = st.columns([4, 1])
+    with header_col:
+        st.markdown(f"### 📋 任务列表（进行中 {len(active)} / 共 {len(jobs)}）")
+    with clear_col:
+        if st.button("🧹 清除已完成", disabled=not finished):
+            st.session_state.jobs = active
+            for job in finished:
+                st.session_state.job_views.pop(job.id, None)
+            st.rerun()
+
+    if active:
+        st.fragment(_render_active_jobs, run_every=JOB_REFRESH_SECONDS)(active)
+    for job in finished:
+        render_job(job)
 
 
 def quality_presets():
@@ -332,12 +472,17 @@ def main():
         st.markdown("### ⚙️ 高级设置")
 
         # 模型选择
+        model_names = list(MODEL_REGISTRY)
         model = st.selectbox(
             "AI模型",
-            ["flux-kontext-pro", "flux-kontext-max"],
-            index=0 if preset_config["model"] == "flux-kontext-pro" else 1,
-            help="Pro模型更快，Max模型质量更高",
+            model_names,
+            index=model_names.index(preset_config["model"]),
+            help="；".join(
+                f"{spec.name}: {spec.description}，约{spec.expected_latency:.0f}秒"
+                for spec in MODEL_REGISTRY.values()
+            ),
         )
+        max_inputs = MODEL_REGISTRY[model].max_inputs
 
         # 宽高比
         aspect_ratio = st.selectbox(
@@ -376,6 +521,14 @@ def main():
                 "种子值", min_value=0, max_value=2147483647, value=42
             )
 
+        # 结果缓存
+        use_result_cache = st.checkbox(
+            "缓存固定种子的结果",
+            value=True,
+            disabled=not use_seed,
+            help="使用固定种子时，相同的图片、提示词和参数直接返回之前的结果，不再调用API",
+        )
+
     # 主内容区域
     col1, col2 = st.columns([1, 1])
 
@@ -386,16 +539,16 @@ def main():
 
         # 图片上传
         uploaded_files = st.file_uploader(
-            "选择要编辑的图片（可选，最多4张）",
+            f"选择要编辑的图片（可选，最多{max_inputs}张）",
             type=["jpg", "jpeg", "png"],
             accept_multiple_files=True,
             help="可选择上传JPG、JPEG、PNG格式图片进行编辑。如不上传，将进行纯文本生成",
         )
 
         if uploaded_files:
-            if len(uploaded_files) > 4:
-                st.warning("⚠️ 最多只能上传4张图片，将使用前4张")
-                uploaded_files = uploaded_files[:4]
+            if len(uploaded_files) > max_inputs:
+                st.warning(f"⚠️ 最多只能上传{max_inputs}张图片，将使用前{max_inputs}张")
+                uploaded_files = uploaded_files[:max_inputs]
 
             st.success(f"✅ 已上传 {len(uploaded_files)} 张图片")
 
@@ -403,8 +556,11 @@ def main():
             cols = st.columns(min(len(uploaded_files), 4))
             for i, uploaded_file in enumerate(uploaded_files):
                 with cols[i]:
-                    image = Image.open(uploaded_file)
-                    st.image(image, caption=f"图片 {i+1}", use_container_width=True)
+                    st.image(
+                        get_thumbnail(uploaded_file.getvalue()),
+                        caption=f"图片 {i+1}",
+                        use_container_width=True,
+                    )
 
     with col2:
         st.markdown(
@@ -503,179 +659,30 @@ def main():
                 if not load_editor():
                     return
 
-                # 开始处理
-                st.session_state.processing = True
-
-                # 保存上传的文件（如果有的话）
-                temp_paths = []
-                if uploaded_files:
-                    for i, uploaded_file in enumerate(uploaded_files):
-                        temp_path = (
-                            f"temp_image_{i}.{uploaded_file.name.split('.')[-1]}"
-                        )
-                        with open(temp_path, "wb") as f:
-                            f.write(uploaded_file.getbuffer())
-                        temp_paths.append(temp_path)
-
-                # 清空之前的日志
-                st.session_state.log_messages = []
-
-                # 创建并排布局：左侧进度，右侧结果
-                st.markdown("### 🔄 处理进度与结果")
-                main_col1, main_col2 = st.columns([1, 1])
-
-                # 左侧：进度显示
-                with main_col1:
-                    st.markdown("#### ⏳ 处理进度")
-
-                    # 主进度条
-                    progress_bar = st.progress(0)
-
-                    # 状态显示
-                    status_col1, status_col2 = st.columns([3, 1])
-                    with status_col1:
-                        status_text = st.empty()
-                    with status_col2:
-                        progress_percent = st.empty()
-
-                    # 日志区域 - 创建固定的日志容器
-                    st.markdown("#### 📋 处理日志")
-
-                    # 日志内容占位符
-                    log_content_placeholder = st.empty()
-
-                # 右侧：结果预览
-                with main_col2:
-                    st.markdown("#### 🎊 结果预览")
-                    result_placeholder = st.empty()
-                    download_placeholder = st.empty()
-
-                # 进度回调函数
-                def update_progress(message, current, total):
-                    """更新进度显示"""
-                    progress = (
-                        min(int((current / total) * 100), 100) if total > 0 else 0
-                    )
+                # 交给后台线程执行，本次页面运行立即结束，可以继续提交其他任务
+                job = get_background_runner().submit(
+                    st.session_state.editor,
+                    st.session_state.edit_instruction,
+                    # 上传的文件直接作为输入，在内存中读取，不写临时文件
+                    image_paths=list(uploaded_files or []),
+                    edit_instruction=st.session_state.edit_instruction,
+                    output_path=(
+                        f"flux_edited_{int(time.time())}_{uuid.uuid4().hex[:8]}"
+                        f".{output_format}"
+                    ),
+                    model=model,
+                    aspect_ratio=aspect_ratio,
+                    output_format=output_format,
+                    safety_tolerance=safety_tolerance,
+                    seed=seed,
+                    prompt_upsampling=prompt_upsampling,
+                    use_result_cache=use_seed and use_result_cache,
+                )
+                st.session_state.jobs.insert(0, job)
 
-                    # 更新进度条
-                    progress_bar.progress(progress)
-
-                    # 更新状态文本
-                    status_text.markdown(f"**{message}**")
-                    progress_percent.markdown(f"**{progress}%**")
-
-                    # 添加到日志
-                    timestamp = time.strftime("%H:%M:%S")
-                    st.session_state.log_messages.append(f"[{timestamp}] {message}")
-
-                    # 更新日志内容（只有在展开状态才显示）
-                    if st.session_state.log_expanded:
-                        # 显示最近的日志（限制显示条数以提高性能）
-                        recent_logs = st.session_state.log_messages[
-                            -15:
-                        ]  # 只显示最近15条日志
-                        log_text = "\n".join(recent_logs)
-
-                        # HTML转义日志内容
-                        import html
-
-                        escaped_log_text = html.escape(log_text)
-
-                        # 创建一个带滚动的日志容器
-                        log_container_html = f"""
-                        <div style="
-                            height: 200px; 
-                            overflow-y: auto; 
-                            background-color: #1e1e1e; 
-                            color: #ffffff; 
-                            padding: 10px; 
-                            border-radius: 5px; 
-                            font-family: 'Consolas', 'Monaco', 'Courier New', monospace; 
-                            font-size: 0.85rem; 
-                            line-height: 1.4; 
-                            white-space: pre-wrap; 
-                            border: 1px solid #404040;
-                            ">{escaped_log_text}</div>
-                        """
-
-                        with log_content_placeholder:
-                            st.markdown(log_container_html, unsafe_allow_html=True)
-                    else:
-                        # 折叠状态下清空内容
-                        log_content_placeholder.empty()
-
-                    # 强制刷新界面
-                    time.sleep(0.1)
-
-                try:
-                    # 初始化进度
-                    update_progress("🚀 开始处理...", 0, 100)
-
-                    # 执行编辑
-                    result = st.session_state.editor.edit_multi_images_native(
-                        image_paths=temp_paths,
-                        edit_instruction=st.session_state.edit_instruction,
-                        output_path=f"flux_edited_{int(time.time())}.{output_format}",
-                        model=model,
-                        aspect_ratio=aspect_ratio,
-                        output_format=output_format,
-                        safety_tolerance=safety_tolerance,
-                        seed=seed,
-                        prompt_upsampling=prompt_upsampling,
-                        progress_callback=update_progress,
-                    )
+                st.toast(f"✅ 任务 #{job.id} 已加入队列")
 
-                    if result:
-                        update_progress("🎉 编辑完成！", 100, 100)
-                        st.session_state.result_image = result
-
-                        # 在右侧显示结果
-                        with result_placeholder.container():
-                            result_image = Image.open(result)
-                            st.image(
-                                result_image,
-                                caption="生成/编辑后的图片",
-                                use_container_width=True,
-                            )
-
-                        # 在右侧显示下载按钮
-                        with download_placeholder.container():
-                            download_label = (
-                                "📥 下载编辑后的图片"
-                                if (uploaded_files and len(uploaded_files) > 0)
-                                else "📥 下载生成的图片"
-                            )
-                            with open(result, "rb") as file:
-                                st.download_button(
-                                    label=download_label,
-                                    data=file.read(),
-                                    file_name=f"flux_generated_{int(time.time())}.{output_format}",
-                                    mime=f"image/{output_format}",
-                                    key="download_progress_result",
-                                )
-
-                        # 显示成功消息
-                        st.success("🎉 图片处理成功完成!")
-
-                    else:
-                        update_progress("❌ 编辑失败", 100, 100)
-                        st.error("😞 图片编辑失败，请检查设置并重试")
-
-                except Exception as e:
-                    update_progress(f"❌ 处理出错: {str(e)}", 100, 100)
-                    st.error(f"❌ 处理过程中出现错误: {str(e)}")
-
-                finally:
-                    # 清理临时文件
-                    for temp_path in temp_paths:
-                        if os.path.exists(temp_path):
-                            os.remove(temp_path)
-
-                    # 清理临时配置文件
-                    if os.path.exists("temp_config.ini"):
-                        os.remove("temp_config.ini")
-
-                    st.session_state.processing = False
+    render_job_panel()
 
     # 使用技巧
     with st.expander("💡 使用技巧和建议"):